@@ -1,134 +1,202 @@
+import io
+import os
 import sqlite3
-from flask import Flask, request, jsonify
+import time
+from flask import Blueprint, Flask, request, jsonify, redirect
 from flask_cors import CORS
 import datetime
 
-app = Flask(__name__)
-CORS(app)  # 启用 CORS，允许所有来源的跨域请求
+from db import get_db, pool_stats
+from pagination import parse_page_args, paginate, PageArgs, DEFAULT_PAGE_SIZE
+from search import search_players as search_player_rows
+from settings_cache import SettingsCache
+from importer import import_players, IMPORT_FORMATS, IMPORT_MODES
+from batch import BATCH_IDS, run_batch, run_batch_returning, validate_ids
+from migrations import migrate, USERS_MIGRATIONS, SETTINGS_MIGRATIONS, PLAYERS_MIGRATIONS, EVENTS_MIGRATIONS
+from response_cache import conditional_get
+from metrics import init_metrics
+from changes import fetch_changes, DEFAULT_CHANGES_LIMIT, MAX_CHANGES_LIMIT
+from tokens import signer, init_auth, TokenError
+from login_throttle import LoginThrottle, retry_after_header, init_proxy_fix
+from serializer import parse_fields, json_rows_response
+from player_stats import read_player_stats
+from dates import normalize_date, parse_date_range
+import events
+from bootstrap import BOOTSTRAP_LOCK, apply_bootstrap, run_once, startup_stats
+from write_queue import write, writer_stats, WriteQueueFullError
+from mcsm import MCSMSync, MCSM_SYNC
+from mail_queue import EmailQueue, EMAIL_QUEUE
+from server_status import ServerStatusPoller
+from server_registry import (FleetStatusPoller, SERVER_FIELDS, server_row_to_dict, validate_server,
+                             sync_default_server)
+from password_hasher import PasswordHasher, HasherBusyError, DEFAULT_ROUNDS, DEFAULT_WORKERS
+from members import MEMBER_SORT_FIELDS, members_attach, member_row_to_dict, parse_member_filters
+
+# 所有接口注册在 api 蓝图上，由 create_app 创建 Flask 应用
+api = Blueprint('api', __name__)
 
 # 数据库文件路径
 USERS_DATABASE = 'users.db'
 SETTINGS_DATABASE = 'settings.db'
 PLAYERS_DATABASE = 'player.db'
 
+# 密码以 bcrypt 哈希保存（与 app1.py 相同），哈希计算在有界线程池中执行
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', DEFAULT_ROUNDS))
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', DEFAULT_WORKERS))
+password_hasher = PasswordHasher(rounds=BCRYPT_ROUNDS, workers=HASH_WORKERS)
+
+# 设置读缓存，所有读取设置的地方都通过它获取
+settings_cache = SettingsCache(SETTINGS_DATABASE)
+
+# 玩家变动同步到 MCSM 实例（白名单、权限组），设置 MCSM_SYNC=1 时启用
+mcsm_sync = MCSMSync(settings_cache)
+
+# 邮件发送队列，设置 EMAIL_QUEUE=1 时启用；请求中只写入队列，由后台线程发送
+email_queue = EmailQueue(SETTINGS_DATABASE, settings_cache)
+REGISTER_EMAIL = ('注册成功', '{username}，你好：\n\n你的账号已注册成功。\n')
+BAN_EMAIL = ('账号已被封禁', '你的账号已被管理员封禁，如有疑问请联系管理员。\n')
+
+# Minecraft 服务器状态，后台定期查询，第一次访问 /server/status 时启动
+server_status = ServerStatusPoller(settings_cache, PLAYERS_DATABASE)
+# 登记表中所有服务器的状态，第一次访问 /servers/status 时启动
+fleet_status = FleetStatusPoller(SETTINGS_DATABASE, PLAYERS_DATABASE)
+
+# 登录限流，按用户名和 IP 计数
+login_throttle = LoginThrottle()
+
+# 合法的玩家权限组
+PERMISSION_GROUPS = ('Player', 'Graduate Engineer', 'Engineer', 'Senior Engineer', 'Admin')
+
+# 列表接口允许的排序字段，第一个为默认排序（主键）
+USER_SORT_FIELDS = ('id', 'username', 'email')
+PLAYER_SORT_FIELDS = ('game_id', 'join_date', 'leave_date', 'permission_group')
+# 玩家列表接口返回的字段，可通过 ?fields= 选择其中一部分
+PLAYER_COLUMNS = ('game_id', 'qq', 'email', 'permission_group', 'join_date', 'leave_date')
+
 # 初始化用户数据库
 def init_users_db():
-    conn = sqlite3.connect(USERS_DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            is_active INTEGER NOT NULL DEFAULT 1
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    with get_db(USERS_DATABASE) as conn:
+        migrate(conn, USERS_MIGRATIONS)
 
 
 # 初始化设置数据库
 def init_settings_db():
-    conn = sqlite3.connect(SETTINGS_DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            minecraftServerIP TEXT NOT NULL,
-            mcsmApiAddress TEXT NOT NULL,
-            emailServiceHost TEXT NOT NULL,
-            mcsmDaemonId TEXT NOT NULL,
-            emailServicePort TEXT NOT NULL,
-            mcsmInstanceId TEXT NOT NULL,
-            emailServiceUsername TEXT NOT NULL,
-            mcsmApikey TEXT NOT NULL,
-            emailServicePassword TEXT NOT NULL
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    with get_db(SETTINGS_DATABASE) as conn:
+        migrate(conn, SETTINGS_MIGRATIONS)
 
 # 初始化玩家数据库
 def init_players_db():
-    conn = sqlite3.connect(PLAYERS_DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS players (
-            game_id TEXT PRIMARY KEY,
-            qq TEXT,
-            email TEXT,
-            permission_group TEXT CHECK(permission_group IN ('Player', 'Graduate Engineer', 'Engineer', 'Senior Engineer', 'Admin')),
-            join_date TEXT,
-            leave_date TEXT,
-            leave_reason TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    with get_db(PLAYERS_DATABASE) as conn:
+        migrate(conn, PLAYERS_MIGRATIONS)
+
+# 初始化事件发件箱数据库（只在启用事件推送时创建）
+def init_events_db():
+    with get_db(events.EVENTS_DATABASE) as conn:
+        migrate(conn, EVENTS_MIGRATIONS)
 
 
 # 注册用户（用于测试，实际应用中可能需要更完善的注册逻辑）
-@app.route('/auth/register', methods=['POST'])
+@api.route('/auth/register', methods=['POST'])
 def register():
     data = request.get_json()
     username = data.get('username')
     email = data.get('email')
     password = data.get('password')
 
-    # 连接数据库
-    conn = sqlite3.connect(USERS_DATABASE)
-    cursor = conn.cursor()
-
-    # 检查用户是否已存在
-    cursor.execute('SELECT * FROM users WHERE username =? OR email =?', (username, email))
-    existing_user = cursor.fetchone()
-    if existing_user:
-        conn.close()
-        return jsonify({"message": "用户名或邮箱已存在"}), 400
-
-    # 插入新用户，密码明文保存
-    cursor.execute('INSERT INTO users (username, email, password, is_active) VALUES (?,?,?,?)',
-                   (username, email, password, 1))
-    conn.commit()
-    conn.close()
+    if not username or not email or not password:
+        return jsonify({"message": "用户名、邮箱和密码不能为空"}), 400
 
+    # 连接数据库
+    with get_db(USERS_DATABASE) as conn:
+        cursor = conn.cursor()
+
+        # 检查用户是否已存在；邮箱忽略大小写和首尾空格比较（与 idx_users_email_norm 唯一索引一致）
+        cursor.execute('SELECT * FROM users WHERE username =? OR lower(trim(email)) = lower(trim(?))',
+                       (username, email))
+        existing_user = cursor.fetchone()
+        if existing_user:
+            return jsonify({"message": "用户名或邮箱已存在"}), 400
+
+    # 插入新用户，密码保存为 bcrypt 哈希；哈希计算期间不占用数据库连接
+    hashed_password = password_hasher.hash(password)
+    with get_db(USERS_DATABASE) as conn:
+        try:
+            conn.execute('INSERT INTO users (username, email, password, is_active) VALUES (?,?,?,?)',
+                         (username, email, sqlite3.Binary(hashed_password), 1))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            return jsonify({"message": "用户名或邮箱已存在"}), 400
+
+    email_queue.enqueue(email, REGISTER_EMAIL[0], REGISTER_EMAIL[1].format(username=username))
     return jsonify({"message": "注册成功"}), 201
 
 
 # 登录接口
-@app.route('/auth/login', methods=['POST'])
+@api.route('/auth/login', methods=['POST'])
 def login():
     data = request.get_json()
     username = data.get('username')
     password = data.get('password')
 
+    # 尝试次数过多时直接拒绝，不查询数据库
+    retry_after = login_throttle.check(username, request.remote_addr)
+    if retry_after:
+        return jsonify({"message": "登录尝试次数过多，请稍后再试"}), 429, retry_after_header(retry_after)
+
     # 连接数据库
-    conn = sqlite3.connect(USERS_DATABASE)
-    cursor = conn.cursor()
+    with get_db(USERS_DATABASE) as conn:
+        cursor = conn.cursor()
 
-    # 查询用户
-    cursor.execute('SELECT * FROM users WHERE username =?', (username,))
-    user = cursor.fetchone()
+        # 查询用户
+        cursor.execute('SELECT id, password, is_active, role FROM users WHERE username =?', (username,))
+        user = cursor.fetchone()
 
     if user:
-        user_id, user_username, user_email, user_password, is_active = user
+        user_id, user_password, is_active, role = user
         # 检查用户是否被封禁
         if is_active == 0:
-            conn.close()
             return jsonify({"message": "该用户已被封禁，无法登录"}), 403
 
-        # 验证密码，直接比较明文密码
-        if password == user_password:
-            conn.close()
-            return jsonify({"message": "登录成功"}), 200
+        # 验证 bcrypt 哈希
+        if password and password_hasher.verify(password, user_password):
+            login_throttle.record_success(username, request.remote_addr)
+            # 哈希的 cost 与当前配置不一致时，在后台升级
+            if password_hasher.needs_rehash(user_password):
+                password_hasher.rehash_async(password, lambda new_hash: update_password_hash(user_id, new_hash))
+            # 签发访问令牌和刷新令牌，之后的请求不再需要查询用户表
+            return jsonify({"message": "登录成功", **signer.issue_pair(user_id, role)}), 200
 
-    conn.close()
     return jsonify({"message": "用户名或密码错误"}), 401
 
 
+# 保存升级后的密码哈希（在哈希线程池中调用）
+def update_password_hash(user_id, hashed_password):
+    with get_db(USERS_DATABASE) as conn:
+        conn.execute('UPDATE users SET password =? WHERE id =?', (sqlite3.Binary(hashed_password), user_id))
+        conn.commit()
+
+
+# 刷新访问令牌：验证刷新令牌，并重新检查用户是否仍然存在、未被封禁
+@api.route('/auth/refresh', methods=['POST'])
+def refresh_token():
+    data = request.get_json(silent=True) or {}
+    try:
+        payload = signer.verify(data.get('refresh_token'), 'refresh')
+    except TokenError:
+        return jsonify({"message": "登录已过期，请重新登录"}), 401
+
+    with get_db(USERS_DATABASE) as conn:
+        user = conn.execute('SELECT is_active, role FROM users WHERE id =?', (payload['sub'],)).fetchone()
+    if user is None or user[0] == 0:
+        signer.revoke_user(payload['sub'])
+        return jsonify({"message": "登录已过期，请重新登录"}), 401
+
+    return jsonify({"access_token": signer.issue_access(payload['sub'], user[1]), "token_type": "Bearer",
+                    "expires_in": signer.access_ttl}), 200
+
+
 # 保存设置接口
-@app.route('/settings/save', methods=['POST'])
+@api.route('/settings/save', methods=['POST'])
 def save_settings():
     data = request.get_json()
     minecraftServerIP = data.get('minecraftServerIP')
@@ -142,40 +210,51 @@ def save_settings():
     emailServicePassword = data.get('emailServicePassword')
 
     # 连接设置数据库
-    conn = sqlite3.connect(SETTINGS_DATABASE)
-    cursor = conn.cursor()
-
-    # 先检查是否已有设置记录，如果有则更新，没有则插入
-    cursor.execute('SELECT * FROM settings')
-    existing_settings = cursor.fetchone()
-    if existing_settings:
-        cursor.execute('''
-            UPDATE settings SET 
-            minecraftServerIP =?,
-            mcsmApiAddress =?,
-            emailServiceHost =?,
-            mcsmDaemonId =?,
-            emailServicePort =?,
-            mcsmInstanceId =?,
-            emailServiceUsername =?,
-            mcsmApikey =?,
-            emailServicePassword =?
-            WHERE id =?
-        ''', (
-            minecraftServerIP,
-            mcsmApiAddress,
-            emailServiceHost,
-            mcsmDaemonId,
-            emailServicePort,
-            mcsmInstanceId,
-            emailServiceUsername,
-            mcsmApikey,
-            emailServicePassword,
-            existing_settings[0]
-        ))
-    else:
-        cursor.execute('''
-            INSERT INTO settings (
+    with get_db(SETTINGS_DATABASE) as conn:
+        cursor = conn.cursor()
+
+        # 先检查是否已有设置记录，如果有则更新，没有则插入
+        cursor.execute('SELECT * FROM settings')
+        existing_settings = cursor.fetchone()
+        if existing_settings:
+            cursor.execute('''
+                UPDATE settings SET 
+                minecraftServerIP =?,
+                mcsmApiAddress =?,
+                emailServiceHost =?,
+                mcsmDaemonId =?,
+                emailServicePort =?,
+                mcsmInstanceId =?,
+                emailServiceUsername =?,
+                mcsmApikey =?,
+                emailServicePassword =?
+                WHERE id =?
+            ''', (
+                minecraftServerIP,
+                mcsmApiAddress,
+                emailServiceHost,
+                mcsmDaemonId,
+                emailServicePort,
+                mcsmInstanceId,
+                emailServiceUsername,
+                mcsmApikey,
+                emailServicePassword,
+                existing_settings[0]
+            ))
+        else:
+            cursor.execute('''
+                INSERT INTO settings (
+                    minecraftServerIP,
+                    mcsmApiAddress,
+                    emailServiceHost,
+                    mcsmDaemonId,
+                    emailServicePort,
+                    mcsmInstanceId,
+                    emailServiceUsername,
+                    mcsmApikey,
+                    emailServicePassword
+                ) VALUES (?,?,?,?,?,?,?,?,?)
+            ''', (
                 minecraftServerIP,
                 mcsmApiAddress,
                 emailServiceHost,
@@ -185,150 +264,248 @@ def save_settings():
                 emailServiceUsername,
                 mcsmApikey,
                 emailServicePassword
-            ) VALUES (?,?,?,?,?,?,?,?,?)
-        ''', (
-            minecraftServerIP,
-            mcsmApiAddress,
-            emailServiceHost,
-            mcsmDaemonId,
-            emailServicePort,
-            mcsmInstanceId,
-            emailServiceUsername,
-            mcsmApikey,
-            emailServicePassword
-        ))
-
-    conn.commit()
-    conn.close()
+            ))
+
+        # 服务器登记表中的 default 行与设置保持一致
+        sync_default_server(conn, minecraftServerIP, mcsmApiAddress, mcsmDaemonId, mcsmInstanceId, mcsmApikey)
+        conn.commit()
+    settings_cache.invalidate()
+    fleet_status.refresh()
 
     return jsonify({"message": "设置保存成功"}), 200
 
 
 # 获取设置接口
-@app.route('/settings/get', methods=['GET'])
+@api.route('/settings/get', methods=['GET'])
 def get_settings():
-    # 连接设置数据库
-    conn = sqlite3.connect(SETTINGS_DATABASE)
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT * FROM settings')
-    settings = cursor.fetchone()
+    settings = settings_cache.get()
 
     if settings:
-        settings_data = {
-            "minecraftServerIP": settings[1],
-            "mcsmApiAddress": settings[2],
-            "emailServiceHost": settings[3],
-            "mcsmDaemonId": settings[4],
-            "emailServicePort": settings[5],
-            "mcsmInstanceId": settings[6],
-            "emailServiceUsername": settings[7],
-            "mcsmApikey": settings[8],
-            "emailServicePassword": settings[9]
-        }
-        conn.close()
-        return jsonify(settings_data), 200
+        return jsonify(settings.to_dict()), 200
     else:
-        conn.close()
         return jsonify({}), 200
 
 
+def user_row_to_dict(user):
+    return {
+        "id": user[0],
+        "username": user[1],
+        "email": user[2],
+        "is_banned": not user[3]
+    }
+
+
 # 获取所有用户
-@app.route('/users', methods=['GET'])
+# 支持 limit/after/sort/order 分页参数，stream=ndjson|json 时流式输出
+@api.route('/users', methods=['GET'])
+@conditional_get(USERS_DATABASE, 'users')
 def get_users():
-    conn = sqlite3.connect(USERS_DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, username, email, is_active FROM users')
-    users = cursor.fetchall()
-    conn.close()
-
-    user_list = []
-    for user in users:
-        user_dict = {
-            "id": user[0],
-            "username": user[1],
-            "email": user[2],
-            "is_banned": not user[3]
-        }
-        user_list.append(user_dict)
+    try:
+        page = parse_page_args(request.args, USER_SORT_FIELDS)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if page is not None:
+        return paginate(USERS_DATABASE, 'SELECT id, username, email, is_active FROM users', [], [],
+                        page, 'id', user_row_to_dict)
+
+    with get_db(USERS_DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, username, email, is_active FROM users')
+        users = cursor.fetchall()
+
+    user_list = [user_row_to_dict(user) for user in users]
 
     return jsonify(user_list), 200
 
 
 # 删除用户
-@app.route('/users/<int:user_id>', methods=['DELETE'])
+@api.route('/users/<int:user_id>', methods=['DELETE'])
 def delete_user(user_id):
-    conn = sqlite3.connect(USERS_DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM users WHERE id =?', (user_id,))
-    conn.commit()
-    conn.close()
+    with get_db(USERS_DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM users WHERE id =?', (user_id,))
+        conn.commit()
+        deleted = cursor.rowcount
+    if deleted:
+        signer.revoke_user(user_id)
+        events.publish('user.deleted', {"id": user_id})
     return jsonify({"message": "用户删除成功"}), 200
 
 
 # 编辑用户
-@app.route('/users/<int:user_id>', methods=['PUT'])
+@api.route('/users/<int:user_id>', methods=['PUT'])
 def edit_user(user_id):
     data = request.get_json()
     username = data.get('username')
     email = data.get('email')
     password = data.get('password')
 
-    conn = sqlite3.connect(USERS_DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET username =?, email =?, password =? WHERE id =?',
-                   (username, email, password, user_id))
-    conn.commit()
-    conn.close()
+    # 没有提供新密码时保留原来的密码
+    hashed_password = sqlite3.Binary(password_hasher.hash(password)) if password else None
+    with get_db(USERS_DATABASE) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('UPDATE users SET username =?, email =?, password = COALESCE(?, password) WHERE id =?',
+                           (username, email, hashed_password, user_id))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            # 用户名重复，或邮箱与其他账号只有大小写/首尾空格不同
+            conn.rollback()
+            return jsonify({"message": "用户名或邮箱已存在"}), 400
     return jsonify({"message": "用户信息修改成功"}), 200
 
 
 # 封禁用户
-@app.route('/users/<int:user_id>/ban', methods=['PUT'])
+@api.route('/users/<int:user_id>/ban', methods=['PUT'])
 def ban_user(user_id):
-    conn = sqlite3.connect(USERS_DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET is_active = 0 WHERE id =?', (user_id,))
-    conn.commit()
-    conn.close()
+    def ban(conn):
+        # 封禁前的状态和邮箱，只在由正常变为封禁时发送通知
+        user = conn.execute('SELECT is_active, email FROM users WHERE id =?', (user_id,)).fetchone()
+        conn.execute('UPDATE users SET is_active = 0 WHERE id =?', (user_id,))
+        return user
+
+    user = write(USERS_DATABASE, ban)
+    if user:
+        signer.revoke_user(user_id)
+        events.publish('user.banned', {"id": user_id, "is_banned": True})
+        if user[0]:
+            email_queue.enqueue(user[1], *BAN_EMAIL)
     return jsonify({"message": "用户封禁成功"}), 200
 
 
 # 解封用户
-@app.route('/users/<int:user_id>/unban', methods=['PUT'])
+@api.route('/users/<int:user_id>/unban', methods=['PUT'])
 def unban_user(user_id):
-    conn = sqlite3.connect(USERS_DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET is_active = 1 WHERE id =?', (user_id,))
-    conn.commit()
-    conn.close()
+    updated = write(USERS_DATABASE, lambda conn: conn.execute(
+        'UPDATE users SET is_active = 1 WHERE id =?', (user_id,)).rowcount)
+    if updated:
+        events.publish('user.unbanned', {"id": user_id, "is_banned": False})
     return jsonify({"message": "用户解封成功"}), 200
 
+def parse_changes_args(args):
+    since = args.get('since', type=int)
+    limit = args.get('limit', DEFAULT_CHANGES_LIMIT, type=int)
+    return since, max(1, min(limit, MAX_CHANGES_LIMIT))
+
+
+# 用户增量变更，since 为上次返回的 next_since；resync 为 true 时需要重新获取 /users
+@api.route('/users/changes', methods=['GET'])
+def get_user_changes():
+    since, limit = parse_changes_args(request.args)
+    with get_db(USERS_DATABASE) as conn:
+        result = fetch_changes(conn, 'user_changes', 'users', 'id', ('id', 'username', 'email', 'is_active'),
+                               since, limit, user_row_to_dict)
+    if result is None:
+        return jsonify({"message": "变更日志不可用"}), 503
+    return jsonify(result), 200
+
+
+# 批量修改用户
+# action: ban | unban | delete，所有 ids 在一个事务中处理
+@api.route('/users/batch', methods=['POST'])
+def batch_update_users():
+    data = request.get_json()
+    action = data.get('action')
+    ids = data.get('ids')
+    if not validate_ids(ids, int):
+        return jsonify({"message": "无效的 ids"}), 400
+
+    if action == 'ban':
+        sql = f'UPDATE users SET is_active = 0 WHERE id IN {BATCH_IDS}'
+    elif action == 'unban':
+        sql = f'UPDATE users SET is_active = 1 WHERE id IN {BATCH_IDS}'
+    elif action == 'delete':
+        sql = f'DELETE FROM users WHERE id IN {BATCH_IDS}'
+    else:
+        return jsonify({"message": "无效的批量操作"}), 400
+
+    with get_db(USERS_DATABASE) as conn:
+        requested, affected = run_batch(conn, sql, (), ids)
+    if affected:
+        if action in ('ban', 'delete'):
+            signer.revoke_users(ids)
+        events.publish('users.batch', {"action": action, "ids": ids})
+    return jsonify({"message": "批量操作成功", "requested": requested, "affected": affected}), 200
+
+# 日期过滤参数（日期已规范化为 YYYY-MM-DD，条件可以走 join_date / leave_date 索引）：
+# joined_after / joined_before：加入日期不早于 / 不晚于该日期；left_between=开始,结束：离开日期在该范围内（含两端）
+def parse_player_date_filters(args):
+    conditions = []
+    params = []
+    joined_after = normalize_date(args.get('joined_after'))
+    if joined_after is not None:
+        conditions.append('join_date >= ?')
+        params.append(joined_after)
+    joined_before = normalize_date(args.get('joined_before'))
+    if joined_before is not None:
+        conditions.append('join_date <= ?')
+        params.append(joined_before)
+    if 'left_between' in args:
+        left_start, left_end = parse_date_range(args['left_between'])
+        # 只给出结束日期时仍然排除没有离开日期的玩家
+        conditions.append('leave_date >= ?')
+        params.append(left_start or '')
+        if left_end is not None:
+            conditions.append('leave_date <= ?')
+            params.append(left_end)
+    return conditions, params
+
+
+def player_row_to_dict(player):
+    return {
+        "game_id": player[0],
+        "qq": player[1],
+        "email": player[2],
+        "permission_group": player[3],
+        "join_date": player[4],
+        "leave_date": player[5]
+    }
+
+
 # 获取所有玩家信息
-@app.route('/players', methods=['GET'])
+# 支持 limit/after/sort/order 分页参数，stream=ndjson|json 时流式输出
+@api.route('/players', methods=['GET'])
+@conditional_get(PLAYERS_DATABASE, 'players')
 def get_players():
-    conn = sqlite3.connect(PLAYERS_DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT game_id, qq, email, permission_group, join_date, leave_date FROM players')
-    players = cursor.fetchall()
-    conn.close()
-
-    player_list = []
-    for player in players:
-        player_dict = {
-            "game_id": player[0],
-            "qq": player[1],
-            "email": player[2],
-            "permission_group": player[3],
-            "join_date": player[4],
-            "leave_date": player[5]
-        }
-        player_list.append(player_dict)
-
-    return jsonify(player_list), 200
+    try:
+        page = parse_page_args(request.args, PLAYER_SORT_FIELDS)
+        fields = parse_fields(request.args, PLAYER_COLUMNS)
+        conditions, params = parse_player_date_filters(request.args)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if page is not None:
+        return paginate(PLAYERS_DATABASE,
+                        'SELECT game_id, qq, email, permission_group, join_date, leave_date FROM players',
+                        conditions, params, page, 'game_id', player_row_to_dict,
+                        None if fields == PLAYER_COLUMNS else fields)
+
+    # 只查询需要的列，结果直接编码为 JSON
+    sql = f'SELECT {", ".join(fields)} FROM players'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    with get_db(PLAYERS_DATABASE) as conn:
+        players = conn.execute(sql, params).fetchall()
+
+    return json_rows_response(players, fields)
+
+
+# 成员视图：玩家及其关联的面板账号（按邮箱匹配），在 player.db 的连接上 ATTACH users.db 后一次查询。
+# 过滤参数 permission_group、has_account=true|false、banned=true|false 以及玩家列表的日期过滤；
+# 始终分页（默认 limit 100），也支持 stream=ndjson|json
+@api.route('/members', methods=['GET'])
+def get_members():
+    try:
+        page = parse_page_args(request.args, MEMBER_SORT_FIELDS) or PageArgs(
+            DEFAULT_PAGE_SIZE, None, MEMBER_SORT_FIELDS[0], 'asc', None)
+        select_sql, conditions, params = parse_member_filters(request.args, PERMISSION_GROUPS)
+        date_conditions, date_params = parse_player_date_filters(request.args)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    return paginate(PLAYERS_DATABASE, select_sql, conditions + date_conditions, params + date_params,
+                    page, 'game_id', member_row_to_dict, attach=members_attach(USERS_DATABASE))
 
 # 添加玩家
-@app.route('/players', methods=['POST'])
+@api.route('/players', methods=['POST'])
 def add_player():
     data = request.get_json()
     game_id = data.get('game_id')
@@ -340,34 +517,74 @@ def add_player():
     leave_reason = data.get('leave_reason')
 
     # 验证 permission_group 是否合法
-    if permission_group not in ['Player', 'Graduate Engineer', 'Engineer', 'Senior Engineer', 'Admin']:
+    if permission_group not in PERMISSION_GROUPS:
         return jsonify({"message": "无效的权限组"}), 400
+    # 日期统一保存为 YYYY-MM-DD
+    try:
+        join_date = normalize_date(join_date)
+        leave_date = normalize_date(leave_date)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
 
-    conn = sqlite3.connect(PLAYERS_DATABASE)
-    cursor = conn.cursor()
     try:
-        cursor.execute('INSERT INTO players (game_id, qq, email, permission_group, join_date, leave_date, leave_reason) VALUES (?,?,?,?,?,?,?)',
-                       (game_id, qq, email, permission_group, join_date, leave_date, leave_reason))
-        conn.commit()
-        return jsonify({"message": "玩家添加成功"}), 201
+        write(PLAYERS_DATABASE, lambda conn: conn.execute(
+            'INSERT INTO players (game_id, qq, email, permission_group, join_date, leave_date, leave_reason) VALUES (?,?,?,?,?,?,?)',
+            (game_id, qq, email, permission_group, join_date, leave_date, leave_reason)))
     except sqlite3.IntegrityError:
-        conn.rollback()
         return jsonify({"message": "游戏 ID 已存在"}), 400
-    finally:
-        conn.close()
+
+    events.publish('player.added', {"game_id": game_id, "qq": qq, "email": email,
+                                    "permission_group": permission_group,
+                                    "join_date": join_date, "leave_date": leave_date})
+    mcsm_sync.player_added(game_id, permission_group)
+    return jsonify({"message": "玩家添加成功"}), 201
+
+# 批量导入玩家
+# 请求体为 CSV（首行为表头）或 NDJSON，边读取边分批写入
+# 参数：format=csv|ndjson（默认根据 Content-Type 判断），mode=skip|upsert（默认 skip）
+@api.route('/players/import', methods=['POST'])
+def import_players_route():
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = 'csv' if request.mimetype in ('text/csv', 'application/csv') else 'ndjson'
+    if fmt not in IMPORT_FORMATS:
+        return jsonify({"message": "无效的导入格式"}), 400
+    mode = request.args.get('mode', 'skip')
+    if mode not in IMPORT_MODES:
+        return jsonify({"message": "无效的导入模式"}), 400
+
+    text_stream = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+    with get_db(PLAYERS_DATABASE) as conn:
+        try:
+            report = import_players(conn, text_stream, fmt, mode, PERMISSION_GROUPS, track_changes=MCSM_SYNC)
+        except ValueError as e:
+            # 表头错误或编码错误；已提交的批次保留
+            return jsonify({"message": f"导入失败: {str(e)}"}), 400
+
+    if report.written:
+        # 导入可能有上万行，只通知客户端重新加载
+        events.publish('players.imported', {"written": report.written})
+    for game_id, permission_group in report.added:
+        mcsm_sync.player_added(game_id, permission_group)
+    for game_id, permission_group in report.group_changed:
+        mcsm_sync.permission_group_changed(game_id, permission_group)
+    return jsonify(report.to_dict()), 200
 
 # 删除玩家
-@app.route('/players/<string:game_id>', methods=['DELETE'])
+@api.route('/players/<string:game_id>', methods=['DELETE'])
 def delete_player(game_id):
-    conn = sqlite3.connect(PLAYERS_DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM players WHERE game_id =?', (game_id,))
-    conn.commit()
-    conn.close()
+    with get_db(PLAYERS_DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM players WHERE game_id =?', (game_id,))
+        conn.commit()
+        deleted = cursor.rowcount
+    if deleted:
+        events.publish('player.deleted', {"game_id": game_id})
+        mcsm_sync.player_removed(game_id)
     return jsonify({"message": "玩家删除成功"}), 200
 
 # 编辑玩家
-@app.route('/players/<string:game_id>', methods=['PUT'])
+@api.route('/players/<string:game_id>', methods=['PUT'])
 def edit_player(game_id):
     data = request.get_json()
     qq = data.get('qq')
@@ -378,102 +595,404 @@ def edit_player(game_id):
     leave_reason = data.get('leave_reason')
 
     # 验证 permission_group 是否合法
-    if permission_group not in ['Player', 'Graduate Engineer', 'Engineer', 'Senior Engineer', 'Admin']:
+    if permission_group not in PERMISSION_GROUPS:
         return jsonify({"message": "无效的权限组"}), 400
-
-    conn = sqlite3.connect(PLAYERS_DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE players SET qq =?, email =?, permission_group =?, join_date =?, leave_date =?, leave_reason =? WHERE game_id =?',
-                   (qq, email, permission_group, join_date, leave_date, leave_reason, game_id))
-    conn.commit()
-    conn.close()
+    # 日期统一保存为 YYYY-MM-DD
+    try:
+        join_date = normalize_date(join_date)
+        leave_date = normalize_date(leave_date)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    # 返回修改前的权限组，玩家不存在时返回 None
+    def update_player(conn):
+        row = conn.execute('SELECT permission_group FROM players WHERE game_id =?', (game_id,)).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            'UPDATE players SET qq =?, email =?, permission_group =?, join_date =?, leave_date =?, leave_reason =? WHERE game_id =?',
+            (qq, email, permission_group, join_date, leave_date, leave_reason, game_id))
+        return row
+
+    previous = write(PLAYERS_DATABASE, update_player)
+    if previous is not None:
+        events.publish('player.updated', {"game_id": game_id, "qq": qq, "email": email,
+                                          "permission_group": permission_group,
+                                          "join_date": join_date, "leave_date": leave_date})
+        # 权限组没有变化时不需要向 MCSM 发送命令
+        if previous[0] != permission_group:
+            mcsm_sync.permission_group_changed(game_id, permission_group)
     return jsonify({"message": "玩家信息修改成功"}), 200
 
 # 批量删除玩家
-@app.route('/players/batch-delete', methods=['POST'])
+@api.route('/players/batch-delete', methods=['POST'])
 def batch_delete_players():
     data = request.get_json()
     game_ids = data.get('game_ids')
-
-    conn = sqlite3.connect(PLAYERS_DATABASE)
-    cursor = conn.cursor()
-    placeholders = ','.join('?' for _ in game_ids)
-    cursor.execute(f'DELETE FROM players WHERE game_id IN ({placeholders})', game_ids)
-    conn.commit()
-    conn.close()
-    return jsonify({"message": "玩家批量删除成功"}), 200
+    if not validate_ids(game_ids, str):
+        return jsonify({"message": "无效的 game_ids"}), 400
+
+    with get_db(PLAYERS_DATABASE) as conn:
+        requested, deleted = run_batch_returning(
+            conn, f'DELETE FROM players WHERE game_id IN {BATCH_IDS} RETURNING game_id', (), game_ids)
+    if deleted:
+        events.publish('players.batch', {"action": "delete", "game_ids": game_ids})
+        # 只同步实际删除的玩家，不存在的 game_id 不发送命令
+        for game_id in deleted:
+            mcsm_sync.player_removed(game_id)
+    return jsonify({"message": "玩家批量删除成功", "affected": len(deleted)}), 200
+
+# 批量修改玩家
+# action: delete | set_permission_group | set_leave，所有 game_ids 在一个事务中处理
+@api.route('/players/batch', methods=['POST'])
+def batch_update_players():
+    data = request.get_json()
+    action = data.get('action')
+    game_ids = data.get('game_ids')
+    if not validate_ids(game_ids, str):
+        return jsonify({"message": "无效的 game_ids"}), 400
+
+    # delete 和 set_permission_group 返回实际修改的 game_id，只为这些玩家向 MCSM 发送命令
+    if action == 'delete':
+        sql, params = f'DELETE FROM players WHERE game_id IN {BATCH_IDS} RETURNING game_id', ()
+    elif action == 'set_permission_group':
+        permission_group = data.get('permission_group')
+        if permission_group not in PERMISSION_GROUPS:
+            return jsonify({"message": "无效的权限组"}), 400
+        # 权限组已经相同的玩家不修改，不计入 affected
+        sql = (f'UPDATE players SET permission_group =? WHERE game_id IN {BATCH_IDS} '
+               'AND permission_group IS NOT ? RETURNING game_id')
+        params = (permission_group, permission_group)
+    elif action == 'set_leave':
+        try:
+            leave_date = normalize_date(data.get('leave_date'))
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        sql = f'UPDATE players SET leave_date =?, leave_reason =? WHERE game_id IN {BATCH_IDS}'
+        params = (leave_date, data.get('leave_reason'))
+    else:
+        return jsonify({"message": "无效的批量操作"}), 400
+
+    with get_db(PLAYERS_DATABASE) as conn:
+        if action == 'set_leave':
+            requested, affected = run_batch(conn, sql, params, game_ids)
+            changed = ()
+        else:
+            requested, changed = run_batch_returning(conn, sql, params, game_ids)
+            affected = len(changed)
+    if affected:
+        event = {"action": action, "game_ids": game_ids}
+        if action == 'set_permission_group':
+            event["permission_group"] = params[0]
+        events.publish('players.batch', event)
+        for game_id in changed:
+            if action == 'delete':
+                mcsm_sync.player_removed(game_id)
+            else:
+                mcsm_sync.permission_group_changed(game_id, params[0])
+    return jsonify({"message": "批量操作成功", "requested": requested, "affected": affected}), 200
 
 # 搜索玩家
-@app.route('/players/search', methods=['GET'])
+# 使用全文索引按相关度排序，可选 limit/offset 分页
+@api.route('/players/search', methods=['GET'])
+@conditional_get(PLAYERS_DATABASE, 'players')
 def search_players():
     keyword = request.args.get('keyword')
-    conn = sqlite3.connect(PLAYERS_DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT game_id, qq, email, permission_group, join_date, leave_date FROM players WHERE game_id LIKE? OR qq LIKE? OR email LIKE?',
-                   (f'%{keyword}%', f'%{keyword}%', f'%{keyword}%'))
-    players = cursor.fetchall()
-    conn.close()
-
-    player_list = []
-    for player in players:
-        player_dict = {
-            "game_id": player[0],
-            "qq": player[1],
-            "email": player[2],
-            "permission_group": player[3],
-            "join_date": player[4],
-            "leave_date": player[5]
-        }
-        player_list.append(player_dict)
-
-    return jsonify(player_list), 200
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', 0, type=int)
+    if (limit is not None and limit < 1) or offset < 0:
+        return jsonify({"message": "无效的分页参数"}), 400
+    try:
+        fields = parse_fields(request.args, PLAYER_COLUMNS)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    with get_db(PLAYERS_DATABASE) as conn:
+        players = search_player_rows(conn, keyword, limit, offset, fields)
+
+    return json_rows_response(players, fields)
+
+# 玩家统计：各权限组人数、每月加入/离开人数、在职/已离开人数。
+# 数据来自触发器维护的汇总表，读取耗时与玩家数量无关；离开日期晚于今天的玩家算在职，因此不做响应缓存
+@api.route('/players/stats', methods=['GET'])
+def get_player_stats():
+    with get_db(PLAYERS_DATABASE) as conn:
+        try:
+            stats = read_player_stats(conn)
+        except sqlite3.OperationalError:
+            # 数据库尚未迁移
+            return jsonify({"message": "统计数据不可用"}), 503
+    return jsonify(stats), 200
+
+# 玩家增量变更，since 为上次返回的 next_since；resync 为 true 时需要重新获取 /players
+@api.route('/players/changes', methods=['GET'])
+def get_player_changes():
+    since, limit = parse_changes_args(request.args)
+    with get_db(PLAYERS_DATABASE) as conn:
+        result = fetch_changes(conn, 'player_changes', 'players', 'game_id',
+                               ('game_id', 'qq', 'email', 'permission_group', 'join_date', 'leave_date'),
+                               since, limit, player_row_to_dict)
+    if result is None:
+        return jsonify({"message": "变更日志不可用"}), 503
+    return jsonify(result), 200
 
 # 获取特定权限组（Graduate Engineer, Engineer, Senior Engineer）的玩家
-@app.route('/players/engineer-groups', methods=['GET'])
+@api.route('/players/engineer-groups', methods=['GET'])
+@conditional_get(PLAYERS_DATABASE, 'players')
 def get_players_by_engineer_groups():
+    try:
+        fields = parse_fields(request.args, PLAYER_COLUMNS)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
     # 连接玩家数据库
-    conn = sqlite3.connect(PLAYERS_DATABASE)
-    cursor = conn.cursor()
-    # 查询特定权限组的玩家
-    cursor.execute('SELECT game_id, qq, email, permission_group, join_date, leave_date FROM players WHERE permission_group IN (?,?,?)', ('Graduate Engineer', 'Engineer', 'Senior Engineer'))
-    players = cursor.fetchall()
-    conn.close()
-
-    player_list = []
-    for player in players:
-        player_dict = {
-            "game_id": player[0],
-            "qq": player[1],
-            "email": player[2],
-            "permission_group": player[3],
-            "join_date": player[4],
-            "leave_date": player[5]
-        }
-        player_list.append(player_dict)
-
-    return jsonify(player_list), 200
+    with get_db(PLAYERS_DATABASE) as conn:
+        # 查询特定权限组的玩家
+        players = conn.execute(f'SELECT {", ".join(fields)} FROM players WHERE permission_group IN (?,?,?)',
+                               ('Graduate Engineer', 'Engineer', 'Senior Engineer')).fetchall()
+
+    return json_rows_response(players, fields)
 
 # 修改玩家权限组
-@app.route('/players/<string:game_id>/permission-group', methods=['PUT'])
+@api.route('/players/<string:game_id>/permission-group', methods=['PUT'])
 def update_player_permission_group(game_id):
     data = request.get_json()
     new_permission_group = data.get('permission_group')
 
     # 检查新权限组是否合法
-    if new_permission_group not in ['Player', 'Graduate Engineer', 'Engineer', 'Senior Engineer', 'Admin']:
+    if new_permission_group not in PERMISSION_GROUPS:
         return jsonify({"message": "无效的权限组"}), 400
 
-    conn = sqlite3.connect(PLAYERS_DATABASE)
-    cursor = conn.cursor()
-    # 更新玩家的权限组
-    cursor.execute('UPDATE players SET permission_group =? WHERE game_id =?', (new_permission_group, game_id))
-    conn.commit()
-    conn.close()
+    # 更新玩家的权限组；权限组没有变化时不修改，也不发送事件和 MCSM 命令
+    updated = write(PLAYERS_DATABASE, lambda conn: conn.execute(
+        'UPDATE players SET permission_group =? WHERE game_id =? AND permission_group IS NOT ?',
+        (new_permission_group, game_id, new_permission_group)).rowcount)
+    if updated:
+        events.publish('player.permission_group', {"game_id": game_id, "permission_group": new_permission_group})
+        mcsm_sync.permission_group_changed(game_id, new_permission_group)
 
     return jsonify({"message": "玩家权限组修改成功"}), 200
 
-if __name__ == '__main__':
+# 登录限流计数
+@api.route('/auth/throttle-stats', methods=['GET'])
+def throttle_stats():
+    return jsonify(login_throttle.stats()), 200
+
+
+# 访问令牌签发/验证计数
+@api.route('/auth/token-stats', methods=['GET'])
+def token_stats():
+    return jsonify(signer.stats()), 200
+
+
+# 事件推送：由独立的事件服务（events.py）提供 SSE 连接，这里重定向过去，不占用工作线程
+# 事件类型：player.added / player.updated / player.deleted / player.permission_group / players.batch /
+# players.imported / user.banned / user.unbanned / user.deleted / users.batch
+@api.route('/events', methods=['GET'])
+def events_stream():
+    # 事件服务只在一个 worker 进程中运行，其他进程同样重定向到配置的端口
+    if not events.EVENTS_ENABLED:
+        return jsonify({"message": "事件推送未启用"}), 503
+    url = events.public_events_url(request.host)
+    if request.query_string:
+        # EventSource 不能设置请求头，访问令牌通过 access_token 参数传递
+        url += '?' + request.query_string.decode('latin-1')
+    return redirect(url, code=307)
+
+
+@api.route('/events/stats', methods=['GET'])
+def events_stats():
+    return jsonify(events.broker.stats()), 200
+
+# 数据库连接池健康状态
+@api.route('/db/health', methods=['GET'])
+def db_health():
+    return jsonify(pool_stats()), 200
+
+# Minecraft 服务器状态：在线人数、版本、MOTD、在线的已登记玩家。返回后台轮询的缓存结果，不访问网络；
+# stale 为 true 表示超过 SERVER_STATUS_TTL 秒没有成功查询
+@api.route('/server/status', methods=['GET'])
+def get_server_status():
+    return jsonify(server_status.get()), 200
+
+
+# 服务器登记表
+@api.route('/servers', methods=['GET'])
+def get_servers():
+    with get_db(SETTINGS_DATABASE) as conn:
+        rows = conn.execute(f'SELECT id, {", ".join(SERVER_FIELDS)} FROM servers ORDER BY id').fetchall()
+    return jsonify([server_row_to_dict(row) for row in rows]), 200
+
+
+@api.route('/servers', methods=['POST'])
+def add_server():
+    try:
+        values = validate_server(request.get_json() or {})
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    with get_db(SETTINGS_DATABASE) as conn:
+        try:
+            cursor = conn.execute(f'INSERT INTO servers ({", ".join(values)}) VALUES ({",".join("?" * len(values))})',
+                                  tuple(values.values()))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            return jsonify({"message": "服务器名称已存在"}), 400
+    fleet_status.refresh()
+    return jsonify({"message": "服务器添加成功", "id": cursor.lastrowid}), 201
+
+
+# 只修改请求中出现的字段；不传 mcsm_apikey 时保留原来的密钥
+@api.route('/servers/<int:server_id>', methods=['PUT'])
+def edit_server(server_id):
+    try:
+        values = validate_server(request.get_json() or {}, partial=True)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if not values:
+        return jsonify({"message": "没有要修改的字段"}), 400
+    with get_db(SETTINGS_DATABASE) as conn:
+        try:
+            cursor = conn.execute(f'UPDATE servers SET {", ".join(f"{field} =?" for field in values)} WHERE id =?',
+                                  (*values.values(), server_id))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            return jsonify({"message": "服务器名称已存在"}), 400
+    if not cursor.rowcount:
+        return jsonify({"message": "服务器不存在"}), 404
+    fleet_status.refresh()
+    return jsonify({"message": "服务器修改成功"}), 200
+
+
+@api.route('/servers/<int:server_id>', methods=['DELETE'])
+def delete_server(server_id):
+    with get_db(SETTINGS_DATABASE) as conn:
+        cursor = conn.execute('DELETE FROM servers WHERE id =?', (server_id,))
+        conn.commit()
+    if not cursor.rowcount:
+        return jsonify({"message": "服务器不存在"}), 404
+    fleet_status.refresh()
+    return jsonify({"message": "服务器删除成功"}), 200
+
+
+# 所有启用的服务器的状态（Server List Ping + MCSM 实例信息）和合计，返回后台并发轮询的缓存快照
+@api.route('/servers/status', methods=['GET'])
+def get_fleet_status():
+    return jsonify(fleet_status.get()), 200
+
+
+# MCSM 同步队列和发送统计
+@api.route('/mcsm/stats', methods=['GET'])
+def mcsm_stats():
+    return jsonify(mcsm_sync.stats()), 200
+
+
+# 给某个权限组的所有玩家发送邮件，只加入发送队列，立即返回加入的数量
+@api.route('/emails/broadcast', methods=['POST'])
+def broadcast_email():
+    if not EMAIL_QUEUE:
+        return jsonify({"message": "邮件发送未启用"}), 503
+    data = request.get_json()
+    permission_group = data.get('permission_group')
+    subject = data.get('subject')
+    body = data.get('body')
+    if permission_group not in PERMISSION_GROUPS:
+        return jsonify({"message": "无效的权限组"}), 400
+    if not isinstance(subject, str) or not subject.strip() or not isinstance(body, str) or not body.strip():
+        return jsonify({"message": "标题和正文不能为空"}), 400
+    queued = email_queue.enqueue_permission_group(PLAYERS_DATABASE, permission_group, subject, body)
+    return jsonify({"message": "邮件已加入发送队列", "queued": queued}), 202
+
+
+# 邮件队列状态和发送统计
+@api.route('/emails/stats', methods=['GET'])
+def email_stats():
+    return jsonify(email_queue.stats()), 200
+
+
+# 合并写入的队列和批次统计
+@api.route('/db/write-stats', methods=['GET'])
+def write_stats():
+    return jsonify(writer_stats()), 200
+
+
+# 写入队列已满（启用 WRITE_COALESCING 时），让客户端稍后重试
+@api.errorhandler(WriteQueueFullError)
+def write_queue_full(e):
+    return jsonify({"message": "服务器繁忙，请稍后再试"}), 503, {"Retry-After": "1"}
+
+
+# 密码哈希线程池繁忙（队列已满或等待超时）
+@api.errorhandler(HasherBusyError)
+def hasher_busy(e):
+    return jsonify({"message": "服务器繁忙，请稍后再试"}), 503, {"Retry-After": "1"}
+
+# 本进程的启动耗时：create_app、初始化（含等待文件锁）
+@api.route('/startup-stats', methods=['GET'])
+def get_startup_stats():
+    return jsonify({**startup_stats, "pid": os.getpid()}), 200
+
+
+# 启用访问令牌时只有管理员可以读取的接口
+ADMIN_ENDPOINTS = (
+    'api.get_settings', 'api.get_users', 'api.get_user_changes', 'api.get_members',
+    'api.get_servers', 'api.get_fleet_status', 'api.mcsm_stats', 'api.email_stats',
+    'api.throttle_stats', 'api.token_stats', 'api.events_stats', 'api.db_health', 'api.write_stats',
+    'api.get_startup_stats',
+)
+
+
+# 初始化所有数据库（迁移、全文索引），可重复执行
+def init_databases():
     init_users_db()  # 初始化用户数据库
     init_settings_db()  # 初始化设置数据库
     init_players_db()  # 初始化玩家数据库
+    if events.EVENTS_ENABLED:
+        init_events_db()  # 初始化事件发件箱
+
+
+# 应用工厂。config 中的值写入 app.config，另外支持：
+# BOOTSTRAP: 'lazy'（默认，第一个请求前初始化数据库）| 'eager'（立即初始化）| False（不初始化）
+# BOOTSTRAP_LOCK: 多进程初始化时使用的锁文件
+# 使用 gunicorn 时推荐 gunicorn --preload 'app:create_app({"BOOTSTRAP": "eager"})'，
+# 初始化只在主进程执行一次，worker fork 之后直接处理请求
+def create_app(config=None):
+    created_at = time.perf_counter()
+    config = dict(config or {})
+    bootstrap_mode = config.pop('BOOTSTRAP', 'lazy')
+    lock_path = config.pop('BOOTSTRAP_LOCK', BOOTSTRAP_LOCK)
+
+    app = Flask(__name__)
+    app.config.update(config)
+    CORS(app)  # 启用 CORS，允许所有来源的跨域请求
+    # 设置环境变量 TRUSTED_PROXIES=<代理层数> 时按 X-Forwarded-For 识别客户端 IP（登录限流按 IP 计数）
+    init_proxy_fix(app)
+    # 设置环境变量 METRICS_ENABLED=1 时启用 /metrics 和请求/SQL 计时
+    init_metrics(app)
+    # 设置环境变量 AUTH_REQUIRED=1 时，除登录、注册、刷新令牌外的接口都需要访问令牌
+    # 设置、账号、服务器、邮件和运行状态等接口的 GET 请求也只允许管理员
+    if init_auth(app, ('api.register', 'api.login', 'api.refresh_token', 'api.events_stream', 'metrics'),
+                 {"missing": "未登录", "invalid": "登录已过期，请重新登录", "forbidden": "权限不足"},
+                 admin_endpoints=ADMIN_ENDPOINTS):
+        events.broker.authenticate = signer.verify
+    app.register_blueprint(api)
+    if events.EVENTS_ENABLED:
+        # 事件经 EVENTS_DATABASE 的 event_outbox 表在进程间传递；
+        # 每个处理请求的进程在第一个请求时竞争事件服务的文件锁，只有一个进程启动事件服务
+        events.broker.outbox_path = events.EVENTS_DATABASE
+        app.before_request(events.broker.ensure_leader)
+    if EMAIL_QUEUE:
+        # 重启后第一个请求启动发送线程，继续发送队列中剩余的邮件
+        app.before_request(email_queue.ensure_started)
+
+    apply_bootstrap(app, bootstrap_mode, lock_path, init_databases, created_at)
+    return app
+
+
+# 兼容 gunicorn app:app 和直接导入 app；导入时不访问数据库，初始化推迟到第一个请求
+app = create_app()
+
+if __name__ == '__main__':
+    run_once(BOOTSTRAP_LOCK, init_databases)
     app.run(debug=True, host='127.0.0.1', port=5000)
\ No newline at end of file
@@ -1,58 +1,56 @@
+import os
 import re
 import sqlite3
-import bcrypt
-from flask import Flask, request, jsonify, session
+import time
+from flask import Blueprint, Flask, request, jsonify, session
 from flask_cors import CORS
 
+from password_hasher import PasswordHasher, HasherBusyError, DEFAULT_ROUNDS, DEFAULT_WORKERS
+from migrations import migrate, USERS_MIGRATIONS, SETTINGS_MIGRATIONS
+from tokens import signer, init_auth, TokenError
+from login_throttle import LoginThrottle, retry_after_header, init_proxy_fix
+from bootstrap import BOOTSTRAP_LOCK, apply_bootstrap, startup_stats
+
 # 数据库文件路径
 USERS_DB_PATH = 'users.db'
 SETTINGS_DB_PATH = 'settings.db'
 
-app = Flask(__name__)
-# 添加跨域支持，允许所有来源的请求
-CORS(app)
+# bcrypt 参数，可通过环境变量调整
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', DEFAULT_ROUNDS))
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', DEFAULT_WORKERS))
+
+# 密码哈希线程池，登录和注册都不在请求线程上直接计算 bcrypt
+password_hasher = PasswordHasher(rounds=BCRYPT_ROUNDS, workers=HASH_WORKERS)
+
+# 登录限流，在查询数据库和 bcrypt 验证之前拒绝过多的尝试
+login_throttle = LoginThrottle()
+
+# 哈希线程池繁忙（队列已满或等待超时）时返回 503，建议客户端等待的秒数
+HASHER_BUSY_RETRY_AFTER = int(os.environ.get('HASHER_BUSY_RETRY_AFTER', '1'))
 
-# 初始化 users.db 数据库
-def init_users_db():
-    conn = sqlite3.connect(USERS_DB_PATH)
-    c = conn.cursor()
 
-    # 创建 users 表
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            username TEXT PRIMARY KEY,
-            password BLOB,  # 修改为 BLOB 类型以存储二进制数据
-            email TEXT,
-            is_active INTEGER DEFAULT 1
-        )
-    ''')
+def hasher_busy_response():
+    return jsonify({"message": "Server is busy, please try again later"}), 503, \
+        retry_after_header(HASHER_BUSY_RETRY_AFTER)
 
-    conn.commit()
-    conn.close()
+# 所有接口注册在 api 蓝图上，由 create_app 创建 Flask 应用
+api = Blueprint('api', __name__)
+
+# 初始化 users.db 数据库（与 app.py 共用同一套表结构和迁移）
+def init_users_db():
+    conn = sqlite3.connect(USERS_DB_PATH)
+    try:
+        migrate(conn, USERS_MIGRATIONS)
+    finally:
+        conn.close()
 
 # 初始化 settings.db 数据库
 def init_settings_db():
     conn = sqlite3.connect(SETTINGS_DB_PATH)
-    c = conn.cursor()
-
-    # 创建 settings 表
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            minecraftServerIP TEXT,
-            mcsmApiAddress TEXT,
-            emailServiceHost TEXT,
-            mcsmDaemonId TEXT,
-            emailServicePort TEXT,
-            mcsmInstanceId TEXT,
-            emailServiceUsername TEXT,
-            mcsmApikey TEXT,
-            emailServicePassword TEXT
-        )
-    ''')
-
-    conn.commit()
-    conn.close()
+    try:
+        migrate(conn, SETTINGS_MIGRATIONS)
+    finally:
+        conn.close()
 
 # 创建管理员用户
 def create_admin_user():
@@ -60,24 +58,25 @@ def create_admin_user():
     admin_password = "admin123"
     admin_email = "admin@example.com"
 
-    # 对密码进行哈希处理
-    hashed_password = bcrypt.hashpw(admin_password.encode('utf-8'), bcrypt.gensalt())
-
+    conn = None
     try:
         # 获取数据库连接
         conn = sqlite3.connect(USERS_DB_PATH)
         c = conn.cursor()
 
         # 检查管理员用户是否已经存在
-        c.execute("SELECT * FROM users WHERE username =?", (admin_username,))
+        c.execute("SELECT 1 FROM users WHERE username =?", (admin_username,))
         existing_user = c.fetchone()
 
         if existing_user:
             print("Admin user already exists.")
         else:
+            # 只有需要创建时才计算哈希；在主进程初始化时执行，不使用哈希线程池（线程不能跨 fork）
+            import bcrypt
+            hashed_password = bcrypt.hashpw(admin_password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS))
             # 插入管理员用户记录
-            c.execute("INSERT INTO users (username, password, email, is_active) VALUES (?,?,?,?)",
-                      (admin_username, sqlite3.Binary(hashed_password), admin_email, 1))
+            c.execute("INSERT INTO users (username, password, email, is_active, role) VALUES (?,?,?,?,?)",
+                      (admin_username, sqlite3.Binary(hashed_password), admin_email, 1, 'admin'))
             conn.commit()
             print("Admin user created successfully.")
     except sqlite3.Error as e:
@@ -95,15 +94,28 @@ def get_users_db_connection():
 def get_settings_db_connection():
     return sqlite3.connect(SETTINGS_DB_PATH)
 
-# 调用初始化函数确保数据库表存在
-init_users_db()
-init_settings_db()
+# 保存升级后的密码哈希
+def update_password_hash(username, hashed_password):
+    conn = None
+    try:
+        conn = get_users_db_connection()
+        c = conn.cursor()
+        c.execute("UPDATE users SET password =? WHERE username =?", (sqlite3.Binary(hashed_password), username))
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Database error: {str(e)}")
+    finally:
+        if conn:
+            conn.close()
 
-# 调用创建管理员用户函数
-create_admin_user()
+# 初始化数据库并创建管理员用户，可重复执行
+def bootstrap_databases():
+    init_users_db()
+    init_settings_db()
+    create_admin_user()
 
 # 模拟用户注册（可根据需求完善）
-@app.route('/auth/register', methods=['POST'])
+@api.route('/auth/register', methods=['POST'])
 def register():
     data = request.get_json()
     username = data.get('username')
@@ -120,10 +132,14 @@ def register():
 
     try:
         # 传入数据库文件的完整路径
+        # 对密码进行哈希处理
+        try:
+            hashed_password = password_hasher.hash(password)
+        except HasherBusyError:
+            # 包括 HasherTimeoutError；必须在下面的 except Exception 之前处理，否则会被报告为 500
+            return hasher_busy_response()
         conn = get_users_db_connection()
         c = conn.cursor()
-        # 对密码进行哈希处理
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
         try:
             # 插入用户数据
             c.execute("INSERT INTO users (username, email, password, is_active) VALUES (?,?,?,?)", 
@@ -131,7 +147,8 @@ def register():
             conn.commit()
             return jsonify({"message": "User registered successfully"}), 201
         except sqlite3.IntegrityError:
-            return jsonify({"message": "Username already exists"}), 409
+            # 用户名重复，或邮箱与已有账号忽略大小写后相同
+            return jsonify({"message": "Username or email already exists"}), 409
         except sqlite3.Error as e:
             return jsonify({"message": f"Database error: {str(e)}"}), 500
         finally:
@@ -140,7 +157,7 @@ def register():
         return jsonify({"message": f"Failed to connect to database: {str(e)}"}), 500
 
 # 登录接口
-@app.route('/auth/login', methods=['POST'])
+@api.route('/auth/login', methods=['POST'])
 def login():
     data = request.get_json()
     username = data.get('username')
@@ -150,32 +167,114 @@ def login():
     if not username or not password:
         return jsonify({"message": "Username and password are required"}), 400
 
+    retry_after = login_throttle.check(username, request.remote_addr)
+    if retry_after:
+        return jsonify({"message": "Too many login attempts, please try again later"}), 429, \
+            retry_after_header(retry_after)
+
     try:
         # 传入数据库文件的完整路径
         conn = get_users_db_connection()
         c = conn.cursor()
         try:
-            c.execute("SELECT * FROM users WHERE username =?", (username,))
+            c.execute("SELECT id, password, is_active, role FROM users WHERE username =?", (username,))
             user = c.fetchone()
-            if user:
-                if user[3] == 0:  # 检查用户是否被封禁
-                    return jsonify({"message": "Your account has been banned"}), 403
-                else:
-                    # 验证密码
-                    stored_password = user[2]
-                    if bcrypt.checkpw(password.encode('utf-8'), stored_password):
-                        session['user_id'] = username  # 记录用户名到 session 中
-                        return jsonify({"message": "Login successful"}), 200
-                    else:
-                        return jsonify({"message": "Username or password is incorrect"}), 401
-            else:
-                return jsonify({"message": "Username or password is incorrect"}), 401
         except sqlite3.Error as e:
             return jsonify({"message": f"Database error: {str(e)}"}), 500
         finally:
             conn.close()
+
+        if user:
+            user_id, stored_password, is_active, role = user
+            if is_active == 0:  # 检查用户是否被封禁
+                return jsonify({"message": "Your account has been banned"}), 403
+            else:
+                # 验证密码
+                try:
+                    password_ok = password_hasher.verify(password, stored_password)
+                except HasherBusyError:
+                    return hasher_busy_response()
+                if password_ok:
+                    login_throttle.record_success(username, request.remote_addr)
+                    # 哈希的 cost 与当前配置不一致时，在后台升级
+                    if password_hasher.needs_rehash(stored_password):
+                        password_hasher.rehash_async(password, lambda new_hash: update_password_hash(username, new_hash))
+                    session['user_id'] = username  # 记录用户名到 session 中
+                    # 签发访问令牌和刷新令牌，之后的请求不再需要查询用户表
+                    return jsonify({"message": "Login successful", **signer.issue_pair(user_id, role)}), 200
+                else:
+                    return jsonify({"message": "Username or password is incorrect"}), 401
+        else:
+            return jsonify({"message": "Username or password is incorrect"}), 401
     except Exception as e:
         return jsonify({"message": f"Failed to connect to database: {str(e)}"}), 500
 
+# 刷新访问令牌：验证刷新令牌，并重新检查用户是否仍然存在、未被封禁
+@api.route('/auth/refresh', methods=['POST'])
+def refresh_token():
+    data = request.get_json(silent=True) or {}
+    try:
+        payload = signer.verify(data.get('refresh_token'), 'refresh')
+    except TokenError:
+        return jsonify({"message": "Token is invalid or expired"}), 401
+
+    conn = get_users_db_connection()
+    try:
+        user = conn.execute("SELECT is_active, role FROM users WHERE id =?", (payload['sub'],)).fetchone()
+    except sqlite3.Error as e:
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+    finally:
+        conn.close()
+    if user is None or user[0] == 0:
+        signer.revoke_user(payload['sub'])
+        return jsonify({"message": "Token is invalid or expired"}), 401
+
+    return jsonify({"access_token": signer.issue_access(payload['sub'], user[1]), "token_type": "Bearer",
+                    "expires_in": signer.access_ttl}), 200
+
+# 登录限流计数
+@api.route('/auth/throttle-stats', methods=['GET'])
+def throttle_stats():
+    return jsonify(login_throttle.stats()), 200
+
+# 密码哈希线程池状态
+@api.route('/auth/hasher-stats', methods=['GET'])
+def hasher_stats():
+    return jsonify(password_hasher.stats()), 200
+
+# 本进程的启动耗时：create_app、初始化（含等待文件锁）
+@api.route('/startup-stats', methods=['GET'])
+def get_startup_stats():
+    return jsonify({**startup_stats, "pid": os.getpid()}), 200
+
+# 应用工厂，BOOTSTRAP / BOOTSTRAP_LOCK 的含义与 app.py 相同：
+# 默认在第一个请求前初始化；gunicorn --preload 'app1:create_app({"BOOTSTRAP": "eager"})' 只在主进程初始化一次
+def create_app(config=None):
+    created_at = time.perf_counter()
+    config = dict(config or {})
+    bootstrap_mode = config.pop('BOOTSTRAP', 'lazy')
+    lock_path = config.pop('BOOTSTRAP_LOCK', BOOTSTRAP_LOCK)
+
+    app = Flask(__name__)
+    # session 需要密钥，未设置 SECRET_KEY 时每次启动随机生成（重启后旧 session 失效）
+    app.secret_key = os.environ.get('SECRET_KEY') or os.urandom(24)
+    app.config.update(config)
+    # 添加跨域支持，允许所有来源的请求
+    CORS(app)
+    # 设置环境变量 TRUSTED_PROXIES=<代理层数> 时按 X-Forwarded-For 识别客户端 IP（登录限流按 IP 计数）
+    init_proxy_fix(app)
+    # 设置环境变量 AUTH_REQUIRED=1 时，除登录、注册、刷新令牌外的接口都需要访问令牌
+    init_auth(app, ('api.register', 'api.login', 'api.refresh_token'),
+              {"missing": "Authentication required", "invalid": "Token is invalid or expired",
+               "forbidden": "Permission denied"},
+              admin_endpoints=('api.throttle_stats', 'api.hasher_stats', 'api.get_startup_stats'))
+    app.register_blueprint(api)
+
+    apply_bootstrap(app, bootstrap_mode, lock_path, bootstrap_databases, created_at)
+    return app
+
+# 兼容直接导入 app；导入时不访问数据库，也不计算 bcrypt
+app = create_app()
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
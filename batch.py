@@ -0,0 +1,48 @@
+# 批量操作：先把 id 写入连接上的临时表，再用一条语句联表更新，
+# 不受 SQLite 绑定参数数量上限的限制
+
+# 在 SQL 中引用临时表，例如 DELETE FROM players WHERE game_id IN BATCH_IDS
+BATCH_IDS = '(SELECT id FROM temp.batch_ids)'
+
+
+# 把 id 写入临时表（连接池中的连接会复用临时表，先清空），返回去重后的数量
+def load_batch_ids(conn, ids):
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS batch_ids (id PRIMARY KEY)')
+    conn.execute('DELETE FROM temp.batch_ids')
+    conn.executemany('INSERT OR IGNORE INTO temp.batch_ids (id) VALUES (?)', ((value,) for value in ids))
+    return conn.execute('SELECT COUNT(*) FROM temp.batch_ids').fetchone()[0]
+
+
+# 在同一个事务中执行批量语句，返回 (去重后的 id 数量, 受影响的行数)
+def run_batch(conn, sql, params, ids):
+    try:
+        requested = load_batch_ids(conn, ids)
+        cursor = conn.execute(sql, params)
+        affected = cursor.rowcount
+        conn.execute('DELETE FROM temp.batch_ids')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return requested, affected
+
+
+# 同 run_batch，sql 以 RETURNING <列> 结尾，返回 (去重后的 id 数量, 受影响的行的该列值列表)
+def run_batch_returning(conn, sql, params, ids):
+    try:
+        requested = load_batch_ids(conn, ids)
+        values = [row[0] for row in conn.execute(sql, params).fetchall()]
+        conn.execute('DELETE FROM temp.batch_ids')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return requested, values
+
+
+def validate_ids(ids, id_type):
+    if not isinstance(ids, list):
+        return False
+    if id_type is int:
+        return all(isinstance(value, int) and not isinstance(value, bool) for value in ids)
+    return all(isinstance(value, id_type) for value in ids)
@@ -0,0 +1,781 @@
+import argparse
+import datetime
+import http.client
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from stub_servers import FakeSLPServer, StubMCSMServer, StubSMTPServer
+
+# 压测工具：生成测试数据，逐个接口压测并输出吞吐量和延迟分位数。
+# 用法：python benchmark.py --players 100000 --users 2000 --mode both --output bench.json
+#      python benchmark.py --compare old.json new.json
+#      python benchmark.py --serialization --players 100000
+#      python benchmark.py --mcsm --commands 2000
+#      python benchmark.py --email --emails 500
+#      python benchmark.py --server-status --players 10000
+#      python benchmark.py --fleet 50
+
+PERMISSION_GROUPS = ('Player', 'Graduate Engineer', 'Engineer', 'Senior Engineer', 'Admin')
+# 各权限组的人数比例，普通玩家占绝大多数
+GROUP_WEIGHTS = (80, 8, 6, 4, 2)
+LEAVE_REASONS = ('毕业', '长期不上线', '违反服务器规则', '主动退出', None)
+# 测试用户的 bcrypt cost；压测时 app 也使用同样的 cost（BCRYPT_ROUNDS），登录后不会触发后台重新哈希
+BENCH_BCRYPT_ROUNDS = 4
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# 生成玩家和用户数据，写入 work_dir 下的 player.db / users.db / settings.db
+def generate_data(work_dir, players, users, seed=0):
+    rng = random.Random(seed)
+    sys.path.insert(0, BASE_DIR)
+    from migrations import migrate, USERS_MIGRATIONS, SETTINGS_MIGRATIONS, PLAYERS_MIGRATIONS
+
+    today = datetime.date.today()
+    start = today - datetime.timedelta(days=5 * 365)
+
+    conn = sqlite3.connect(os.path.join(work_dir, 'player.db'))
+    migrate(conn, PLAYERS_MIGRATIONS)
+    rows = []
+    for i in range(players):
+        join_date = start + datetime.timedelta(days=rng.randrange((today - start).days))
+        leave_date = leave_reason = None
+        if rng.random() < 0.2:
+            leave_date = join_date + datetime.timedelta(days=rng.randrange(1, 3 * 365))
+            leave_reason = rng.choice(LEAVE_REASONS)
+            if leave_date > today:
+                leave_date = today
+        rows.append((
+            f'Player_{i:07d}',
+            str(rng.randrange(10000000, 3999999999)),
+            f'player{i}@mail{i % 97}.example.com',
+            rng.choices(PERMISSION_GROUPS, GROUP_WEIGHTS)[0],
+            join_date.isoformat(),
+            leave_date.isoformat() if leave_date else None,
+            leave_reason,
+        ))
+        if len(rows) >= 10000:
+            conn.executemany('INSERT INTO players VALUES (?,?,?,?,?,?,?)', rows)
+            rows.clear()
+    if rows:
+        conn.executemany('INSERT INTO players VALUES (?,?,?,?,?,?,?)', rows)
+    conn.commit()
+    conn.close()
+
+    import bcrypt
+    conn = sqlite3.connect(os.path.join(work_dir, 'users.db'))
+    migrate(conn, USERS_MIGRATIONS)
+    # 一半的用户使用某个玩家的邮箱（大小写不同），用于 /members 的关联查询
+    conn.executemany(
+        'INSERT INTO users (username, email, password, is_active) VALUES (?,?,?,?)',
+        ((f'user{i}',
+          f'Player{i}@Mail{i % 97}.example.com' if i % 2 == 0 and i < players else f'user{i}@example.com',
+          sqlite3.Binary(bcrypt.hashpw(f'password{i}'.encode('utf-8'), bcrypt.gensalt(BENCH_BCRYPT_ROUNDS))),
+          0 if rng.random() < 0.05 else 1)
+         for i in range(users)))
+    conn.commit()
+    conn.close()
+
+    conn = sqlite3.connect(os.path.join(work_dir, 'settings.db'))
+    migrate(conn, SETTINGS_MIGRATIONS)
+    conn.execute('''
+        INSERT INTO settings (minecraftServerIP, mcsmApiAddress, emailServiceHost, mcsmDaemonId, emailServicePort,
+                              mcsmInstanceId, emailServiceUsername, mcsmApikey, emailServicePassword)
+        VALUES ('127.0.0.1:25565', 'http://127.0.0.1:23333', 'smtp.example.com', 'daemon', '465',
+                'instance', 'noreply@example.com', 'apikey', 'password')
+    ''')
+    conn.commit()
+    conn.close()
+
+
+# 各接口的请求构造：返回 (method, path, json_body, raw_body, headers)。
+# 覆盖 app.py 的所有接口，除了 /events（SSE 长连接）、/server/status 和 /servers/status（返回后台轮询的缓存，
+# 第一次访问会启动轮询线程）、/emails/broadcast（需要 EMAIL_QUEUE=1），以及只返回内存计数的 *-stats 接口。
+# 每种压测模式（test/server）各调用一次；run 用于区分两次运行中新建的用户和服务器
+def build_endpoints(players, users):
+    counters = {}
+    run = f'{time.monotonic_ns() % 10 ** 9:09d}'
+    settings = {
+        "minecraftServerIP": '127.0.0.1:25565', "mcsmApiAddress": 'http://127.0.0.1:23333',
+        "emailServiceHost": 'smtp.example.com', "mcsmDaemonId": 'daemon', "emailServicePort": '465',
+        "mcsmInstanceId": 'instance', "emailServiceUsername": 'noreply@example.com', "mcsmApikey": 'apikey',
+        "emailServicePassword": 'password'}
+
+    def seq(name):
+        counters[name] = counters.get(name, -1) + 1
+        return counters[name]
+
+    def player_id(i):
+        return f'Player_{i % max(players, 1):07d}'
+
+    def add_player(i):
+        return 'POST', '/players', {
+            "game_id": f'Bench_{seq("add"):07d}', "qq": "10000", "email": "bench@example.com",
+            "permission_group": "Player", "join_date": "2025-01-01"}, None, None
+
+    def delete_player(i):
+        return 'DELETE', f'/players/Bench_{seq("delete"):07d}', None, None, None
+
+    def batch_delete(i):
+        n = seq('batch_delete')
+        return 'POST', '/players/batch-delete', {
+            "game_ids": [f'Bench_{n * 10 + k:07d}' for k in range(10)]}, None, None
+
+    def import_rows(i):
+        n = seq('import')
+        body = '\n'.join(json.dumps({"game_id": f'Import_{n:05d}_{k:03d}', "permission_group": "Player"})
+                         for k in range(100))
+        return 'POST', '/players/import?mode=upsert', None, body.encode('utf-8'), {
+            'Content-Type': 'application/x-ndjson'}
+
+    def user_email(n):
+        return f'Player{n}@Mail{n % 97}.example.com' if n % 2 == 0 and n < players else f'user{n}@example.com'
+
+    def register(i):
+        n = seq('register')
+        return 'POST', '/auth/register', {
+            "username": f'bench_{run}_{n}', "email": f'bench_{run}_{n}@example.com',
+            "password": f'password{n}'}, None, None
+
+    # 删除本轮 POST /auth/register 新建的用户，从 id 最大的开始
+    def delete_user(i):
+        if 'max_user_id' not in counters:
+            conn = sqlite3.connect('users.db')
+            counters['max_user_id'] = conn.execute('SELECT MAX(id) FROM users').fetchone()[0]
+            conn.close()
+        return 'DELETE', f'/users/{counters["max_user_id"] - seq("delete_user")}', None, None, None
+
+    def refresh(i):
+        from tokens import signer
+        return 'POST', '/auth/refresh', {
+            "refresh_token": signer.issue_refresh(i % max(users, 1) + 1, 'user')}, None, None
+
+    def add_server(i):
+        n = seq('add_server')
+        return 'POST', '/servers', {"name": f'bench-{run}-{n}', "address": f'127.0.0.1:{25565 + n % 1000}'}, \
+            None, None
+
+    # 修改、删除本轮 POST /servers 新建的服务器（id 从 servers 表的最大 id 往回数）
+    def server_id(name):
+        if 'max_server_id' not in counters:
+            conn = sqlite3.connect('settings.db')
+            counters['max_server_id'] = conn.execute('SELECT MAX(id) FROM servers').fetchone()[0]
+            counters['servers_added'] = counters.get('add_server', -1) + 1
+            conn.close()
+        return counters['max_server_id'] - seq(name) % max(counters['servers_added'], 1)
+
+    return [
+        ('GET /players', lambda i: ('GET', '/players', None, None, None)),
+        ('GET /players?limit=100', lambda i: ('GET', '/players?limit=100', None, None, None)),
+        ('GET /players/search', lambda i: ('GET', f'/players/search?keyword=mail{i % 97}.', None, None, None)),
+        ('GET /players/engineer-groups', lambda i: ('GET', '/players/engineer-groups', None, None, None)),
+        ('GET /players/stats', lambda i: ('GET', '/players/stats', None, None, None)),
+        ('GET /members?limit=100', lambda i: ('GET', '/members?limit=100', None, None, None)),
+        ('GET /members?has_account=true', lambda i: ('GET', '/members?has_account=true', None, None, None)),
+        ('GET /members?banned=true', lambda i: ('GET', '/members?banned=true&permission_group=Player', None, None,
+                                                None)),
+        ('GET /users', lambda i: ('GET', '/users', None, None, None)),
+        ('GET /settings/get', lambda i: ('GET', '/settings/get', None, None, None)),
+        ('POST /auth/login', lambda i: ('POST', '/auth/login', {
+            "username": f'user{i % max(users, 1)}', "password": f'password{i % max(users, 1)}'}, None, None)),
+        ('POST /players', add_player),
+        ('PUT /players/<id>', lambda i: ('PUT', f'/players/{player_id(i)}', {
+            "qq": "10001", "email": "edited@example.com", "permission_group": "Engineer",
+            "join_date": "2025-01-01"}, None, None)),
+        ('PUT /players/<id>/permission-group', lambda i: ('PUT', f'/players/{player_id(i)}/permission-group', {
+            "permission_group": PERMISSION_GROUPS[i % len(PERMISSION_GROUPS)]}, None, None)),
+        ('POST /players/batch', lambda i: ('POST', '/players/batch', {
+            "action": "set_permission_group", "permission_group": "Engineer",
+            "game_ids": [player_id(i * 100 + k) for k in range(100)]}, None, None)),
+        ('POST /players/import', import_rows),
+        ('DELETE /players/<id>', delete_player),
+        ('POST /players/batch-delete', batch_delete),
+        ('POST /auth/register', register),
+        ('POST /auth/refresh', refresh),
+        ('PUT /users/<id>', lambda i: ('PUT', f'/users/{i % max(users, 1) + 1}', {
+            "username": f'user{i % max(users, 1)}', "email": user_email(i % max(users, 1))}, None, None)),
+        ('DELETE /users/<id>', delete_user),
+        ('POST /users/batch', lambda i: ('POST', '/users/batch', {
+            "action": ('ban', 'unban')[i % 2], "ids": [(i // 2 * 10 + k) % max(users, 1) + 1 for k in range(10)]},
+                                        None, None)),
+        ('GET /users/changes', lambda i: ('GET', '/users/changes?since=0', None, None, None)),
+        ('GET /players/changes', lambda i: ('GET', '/players/changes?since=0', None, None, None)),
+        ('POST /settings/save', lambda i: ('POST', '/settings/save', settings, None, None)),
+        ('GET /db/health', lambda i: ('GET', '/db/health', None, None, None)),
+        ('GET /servers', lambda i: ('GET', '/servers', None, None, None)),
+        ('POST /servers', add_server),
+        ('PUT /servers/<id>', lambda i: ('PUT', f'/servers/{server_id("edit_server")}', {
+            "enabled": bool(i % 2)}, None, None)),
+        ('DELETE /servers/<id>', lambda i: ('DELETE', f'/servers/{server_id("delete_server")}', None, None,
+                                            None)),
+        ('PUT /users/<id>/ban', lambda i: ('PUT', f'/users/{i % max(users, 1) + 1}/ban', None, None, None)),
+        ('PUT /users/<id>/unban', lambda i: ('PUT', f'/users/{i % max(users, 1) + 1}/unban', None, None, None)),
+    ]
+
+
+class TestClientDriver:
+    def __init__(self, flask_app):
+        self.app = flask_app
+
+    def session(self):
+        client = self.app.test_client()
+
+        def send(method, path, json_body, raw_body, headers):
+            if json_body is not None:
+                response = client.open(path, method=method, json=json_body, headers=headers)
+            else:
+                response = client.open(path, method=method, data=raw_body, headers=headers)
+            response.get_data()
+            return response.status_code
+
+        return send
+
+    def close(self):
+        pass
+
+
+# 在后台线程启动多线程 WSGI 服务器，用 keep-alive 的 HTTP 连接发送请求
+class ServerDriver:
+    def __init__(self, flask_app):
+        from werkzeug.serving import make_server
+        # 关闭每个请求的访问日志，避免输出影响测量
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self.server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def session(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+
+        def send(method, path, json_body, raw_body, headers):
+            headers = dict(headers or {})
+            body = raw_body
+            if json_body is not None:
+                body = json.dumps(json_body).encode('utf-8')
+                headers['Content-Type'] = 'application/json'
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+
+        return send
+
+    def close(self):
+        self.server.shutdown()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # nearest-rank
+    index = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+# 用 threads 个线程对一个接口发送 requests 个请求
+def run_endpoint(driver, build, requests, threads):
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+
+    def worker():
+        send = driver.session()
+        local = []
+        local_status = {}
+        while True:
+            with counter_lock:
+                i = next(counter, None)
+                if i is None:
+                    break
+                request_args = build(i)
+            start = time.perf_counter()
+            status = send(*request_args)
+            local.append((time.perf_counter() - start) * 1000)
+            local_status[status] = local_status.get(status, 0) + 1
+        with lock:
+            latencies.extend(local)
+            for status, count in local_status.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "threads": threads,
+        "seconds": round(elapsed, 4),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    work_dir = tempfile.mkdtemp(prefix='edenicland-bench-')
+    print(f'Generating {args.players} players and {args.users} users in {work_dir} ...')
+    start = time.perf_counter()
+    generate_data(work_dir, args.players, args.users, args.seed)
+    print(f'Data generated in {time.perf_counter() - start:.1f}s')
+
+    # app.py 使用相对路径打开数据库，切换到测试数据目录后再导入
+    os.environ.setdefault('BCRYPT_ROUNDS', str(BENCH_BCRYPT_ROUNDS))
+    old_cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        import app as backend
+        backend.init_users_db()
+        backend.init_settings_db()
+        backend.init_players_db()
+
+        results = {
+            "commit": git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec='seconds'),
+            "players": args.players,
+            "users": args.users,
+            "requests": args.requests,
+            "threads": args.threads,
+            "modes": {},
+        }
+        modes = ['test', 'server'] if args.mode == 'both' else [args.mode]
+        only = set(args.only or [])
+        for mode in modes:
+            driver = TestClientDriver(backend.app) if mode == 'test' else ServerDriver(backend.app)
+            mode_results = {}
+            try:
+                for name, build in build_endpoints(args.players, args.users):
+                    if only and name not in only:
+                        continue
+                    result = run_endpoint(driver, build, args.requests, args.threads)
+                    mode_results[name] = result
+                    print(f'[{mode:6}] {name:38} {result["throughput"]:>9} req/s  '
+                          f'p50 {result["p50_ms"]:>8.2f}ms  p95 {result["p95_ms"]:>8.2f}ms  '
+                          f'p99 {result["p99_ms"]:>8.2f}ms  {result["statuses"]}')
+            finally:
+                driver.close()
+            results["modes"][mode] = mode_results
+    finally:
+        os.chdir(old_cwd)
+        if not args.keep_data:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f'Results written to {args.output}')
+    return results
+
+
+# 对比玩家列表的序列化方式：原来的逐行构造字典 + jsonify，与 serializer 的 json / orjson 后端，
+# 以及 ?fields= 只输出部分字段时的耗时和响应大小。查询时间单独统计。
+def run_serialization_benchmark(args):
+    work_dir = tempfile.mkdtemp(prefix='edenicland-bench-')
+    print(f'Generating {args.players} players in {work_dir} ...')
+    generate_data(work_dir, args.players, 0, args.seed)
+    old_cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        import app as backend
+        import serializer
+        from flask import jsonify
+
+        columns = backend.PLAYER_COLUMNS
+        conn = sqlite3.connect('player.db')
+        fetch_start = time.perf_counter()
+        rows = conn.execute(f'SELECT {", ".join(columns)} FROM players').fetchall()
+        fetch_ms = (time.perf_counter() - fetch_start) * 1000
+        projected = conn.execute('SELECT game_id, permission_group FROM players').fetchall()
+        conn.close()
+        print(f'{"fetchall (all columns)":38} {fetch_ms:>9.1f}ms')
+
+        def legacy():
+            player_list = []
+            for player in rows:
+                player_list.append({
+                    "game_id": player[0],
+                    "qq": player[1],
+                    "email": player[2],
+                    "permission_group": player[3],
+                    "join_date": player[4],
+                    "leave_date": player[5]
+                })
+            return jsonify(player_list).get_data()
+
+        def with_backend(backend_name, data, data_columns):
+            def run():
+                serializer.JSON_BACKEND = backend_name
+                return serializer.rows_to_json(data, data_columns)
+            return run
+
+        cases = [('legacy dict loop + jsonify', legacy),
+                 ('serializer json', with_backend('json', rows, columns))]
+        if serializer.orjson is not None:
+            cases.append(('serializer orjson', with_backend('orjson', rows, columns)))
+            cases.append(('serializer orjson, fields=2', with_backend('orjson', projected,
+                                                                      ('game_id', 'permission_group'))))
+        else:
+            cases.append(('serializer json, fields=2', with_backend('json', projected,
+                                                                    ('game_id', 'permission_group'))))
+
+        original_backend = serializer.JSON_BACKEND
+        baseline = None
+        with backend.app.app_context():
+            for name, fn in cases:
+                timings = []
+                for _ in range(max(1, args.repeat)):
+                    start = time.perf_counter()
+                    body = fn()
+                    timings.append((time.perf_counter() - start) * 1000)
+                best = min(timings)
+                baseline = baseline or best
+                print(f'{name:38} {best:>9.1f}ms  x{baseline / best:>5.2f}  {len(body) / 1024 / 1024:>7.2f} MiB')
+        serializer.JSON_BACKEND = original_backend
+    finally:
+        os.chdir(old_cwd)
+        if not args.keep_data:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# 对比每条命令新建连接、复用连接的客户端，以及后台同步队列（含合并和失败重试）的命令吞吐量
+def run_mcsm_benchmark(args):
+    sys.path.insert(0, BASE_DIR)
+    import mcsm
+
+    latency = args.mcsm_latency / 1000
+    stub = StubMCSMServer(latency)
+    count = args.commands
+    try:
+        def naive():
+            for i in range(count):
+                client = mcsm.MCSMClient(stub.address, 'key', 'daemon', 'instance', pool_size=0)
+                client.command(f'whitelist add Player_{i}')
+
+        pooled_client = mcsm.MCSMClient(stub.address, 'key', 'daemon', 'instance')
+
+        def pooled():
+            for i in range(count):
+                pooled_client.command(f'whitelist add Player_{i}')
+
+        for name, fn in (('new connection per command', naive), ('keep-alive client', pooled)):
+            stub.reset()
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+            print(f'{name:38} {count / elapsed:>9.0f} cmd/s  connections {len(stub.connections)}')
+
+        # 后台队列：每个玩家修改 3 次权限组（合并为 1 条），每 10 个请求失败 1 次（重试）
+        stub.close()
+        stub = StubMCSMServer(latency, fail_every=10)
+
+        class FixedSettings:
+            mcsm_api_address, mcsm_apikey, mcsm_daemon_id, mcsm_instance_id = stub.address, 'key', 'daemon', 'instance'
+
+        class FixedSettingsCache:
+            def get(self):
+                return FixedSettings
+
+        mcsm.MCSM_SYNC = True
+        sync = mcsm.MCSMSync(FixedSettingsCache(), flush_interval=0.05, base_backoff=0.05)
+        start = time.perf_counter()
+        for group in ('Player', 'Engineer', 'Senior Engineer'):
+            for i in range(count):
+                sync.permission_group_changed(f'Player_{i}', group)
+        enqueue_elapsed = time.perf_counter() - start
+        while len(stub.commands) < count and time.perf_counter() - start < 120:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        stats = sync.stats()
+        print(f'{"background sync (3x dedup, 10% errors)":38} {count / elapsed:>9.0f} cmd/s  connections '
+              f'{len(stub.connections)}  enqueue {enqueue_elapsed / (3 * count) * 1e6:.1f}us/call')
+        print(f'  delivered {len(stub.commands)}/{count}, deduplicated {stats["deduplicated"]}, '
+              f'retried {stats["retried"]}, failed {stats["failed"]}, batches {stats["batches"]}')
+        correct = all(command.endswith(' senior_engineer') for command in stub.commands)
+        print(f'  only the latest group was sent: {correct}')
+    finally:
+        stub.close()
+
+
+# 本地模拟的 SMTP 服务器：支持 EHLO / AUTH PLAIN / MAIL / RCPT / DATA，每个命令延迟 latency 秒；
+# 对比每封邮件单独连接登录和后台队列（连接复用、批量领取、失败重试、限速）的发送速度
+def run_email_benchmark(args):
+    os.environ['EMAIL_QUEUE'] = '1'
+    sys.path.insert(0, BASE_DIR)
+    import smtplib
+    from email.message import EmailMessage
+    import mail_queue
+    from migrations import migrate, SETTINGS_MIGRATIONS
+
+    latency = args.email_latency / 1000
+    count = args.emails
+    work_dir = tempfile.mkdtemp(prefix='edenicland-bench-')
+    stub = StubSMTPServer(latency)
+    try:
+        start = time.perf_counter()
+        for i in range(count):
+            smtp = smtplib.SMTP('127.0.0.1', stub.port)
+            smtp.login('bot@example.com', 'secret')
+            message = EmailMessage()
+            message['From'], message['To'], message['Subject'] = 'bot@example.com', f'p{i}@example.com', 'hi'
+            message.set_content('hello')
+            smtp.send_message(message)
+            smtp.quit()
+        elapsed = time.perf_counter() - start
+        print(f'{"connect + login per message":38} {count / elapsed:>9.0f} msg/s  '
+              f'connections {stub.connections}  logins {stub.logins}')
+        stub.close()
+
+        def run_queue(name, stub, rate_limit, rate_window, messages):
+            path = tempfile.mktemp(suffix='.db', dir=work_dir)
+            conn = sqlite3.connect(path)
+            migrate(conn, SETTINGS_MIGRATIONS)
+            conn.close()
+
+            class FixedSettings:
+                email_service_host, email_service_port = '127.0.0.1', stub.port
+                email_service_username, email_service_password = 'bot@example.com', 'secret'
+
+            class FixedSettingsCache:
+                def get(self):
+                    return FixedSettings
+
+            queue = mail_queue.EmailQueue(path, FixedSettingsCache(), rate_limit=rate_limit,
+                                          rate_window=rate_window, base_backoff=0.05)
+            start = time.perf_counter()
+            queued = queue.enqueue_many(messages)
+            enqueue_ms = (time.perf_counter() - start) * 1000
+            expected = sum(1 for recipient, _, _ in messages if 'reject.example' not in recipient)
+            while len(stub.messages) < expected and time.perf_counter() - start < 120:
+                time.sleep(0.01)
+            elapsed = time.perf_counter() - start
+            stats = queue.stats()
+            print(f'{name:38} {len(stub.messages) / elapsed:>9.0f} msg/s  connections {stub.connections}  '
+                  f'logins {stub.logins}  enqueue {queued} in {enqueue_ms:.1f}ms')
+            print(f'  delivered {len(stub.messages)}/{expected}, retried {stats["retried"]}, '
+                  f'failed {stats["failed"]}, rate limited {stats["rate_limited"]}, {elapsed:.2f}s')
+
+        messages = [(f'p{i}@example.com', 'hi', 'hello') for i in range(count)]
+        stub = StubSMTPServer(latency, fail_every=10)
+        run_queue('queue (10% 451, 2 rejected)', stub, 0, 60,
+                  messages + [('a@reject.example', 'hi', 'hello'), ('b@reject.example', 'hi', 'hello')])
+        stub.close()
+        stub = StubSMTPServer(latency)
+        run_queue('queue, rate limit 50/s', stub, 50, 1, messages[:150])
+    finally:
+        stub.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# 对比每个请求直接 Server List Ping 和读取后台轮询缓存的 /server/status
+def run_server_status_benchmark(args):
+    import asyncio
+    work_dir = tempfile.mkdtemp(prefix='edenicland-bench-')
+    print(f'Generating {args.players} players in {work_dir} ...')
+    generate_data(work_dir, args.players, 0, args.seed)
+    old_cwd = os.getcwd()
+    os.chdir(work_dir)
+    sample = [f'Player_{i:07d}' for i in range(0, 12 * 7, 7)] + ['NotRegistered']
+    fake = FakeSLPServer(sample, online=57, latency=args.slp_latency / 1000)
+    try:
+        import app as backend
+        import server_status
+        conn = sqlite3.connect('settings.db')
+        conn.execute('UPDATE settings SET minecraftServerIP =?', (f'127.0.0.1:{fake.port}',))
+        conn.commit()
+        conn.close()
+        flask_app = backend.create_app({'BOOTSTRAP': 'eager'})
+        client = flask_app.test_client()
+        count = args.requests
+
+        start = time.perf_counter()
+        for _ in range(count):
+            asyncio.run(server_status.query_status('127.0.0.1', fake.port))
+        elapsed = time.perf_counter() - start
+        print(f'{"ping per request":38} {count / elapsed:>9.0f} req/s  {elapsed / count * 1000:.3f}ms/req  '
+              f'pings {fake.pings}')
+
+        client.get('/server/status')
+        while backend.server_status.get()["online"] is None:
+            time.sleep(0.01)
+        fake.pings = 0
+        start = time.perf_counter()
+        for _ in range(count):
+            body = client.get('/server/status').get_json()
+        elapsed = time.perf_counter() - start
+        print(f'{"cached /server/status":38} {count / elapsed:>9.0f} req/s  {elapsed / count * 1000:.3f}ms/req  '
+              f'pings {fake.pings}')
+        print(f'  online {body["players_online"]}/{body["players_max"]}, registered online '
+              f'{len(body["online_players"])}, unknown {body["unknown_players"]}, motd {body["motd"]!r}')
+        fake.close()
+        time.sleep(0.1)
+        asyncio.run(backend.server_status.poll_once())
+        body = client.get('/server/status').get_json()
+        print(f'  after stopping the server: online {body["online"]}, error {body["error"]!r}, stale {body["stale"]}')
+    finally:
+        fake.close()
+        os.chdir(old_cwd)
+        if not args.keep_data:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# 登记 N 个服务器（各自一个模拟 Minecraft 服务器，共用一个模拟 MCSM），对比逐个查询和并发轮询，以及读取汇总快照
+def run_fleet_benchmark(args):
+    import asyncio
+    work_dir = tempfile.mkdtemp(prefix='edenicland-bench-')
+    generate_data(work_dir, args.players, 0, args.seed)
+    old_cwd = os.getcwd()
+    os.chdir(work_dir)
+    latency = args.slp_latency / 1000
+    fakes = [FakeSLPServer([f'Player_{i * 13 + j:07d}' for j in range(5)] + [f'Guest{i}'], latency=latency)
+             for i in range(args.fleet)]
+    stub = StubMCSMServer(latency)
+    try:
+        import app as backend
+        import server_status
+        from mcsm import MCSMClient
+        conn = sqlite3.connect('settings.db')
+        conn.executemany('''
+            INSERT INTO servers (name, address, mcsm_api_address, mcsm_daemon_id, mcsm_instance_id, mcsm_apikey)
+            VALUES (?,?,?,?,?,?)
+        ''', [(f'server-{i}', f'127.0.0.1:{fake.port}', stub.address, 'daemon', f'instance-{i}', 'key')
+              for i, fake in enumerate(fakes)])
+        conn.commit()
+        conn.close()
+        flask_app = backend.create_app({'BOOTSTRAP': 'eager'})
+        client = flask_app.test_client()
+
+        start = time.perf_counter()
+        for i, fake in enumerate(fakes):
+            asyncio.run(server_status.query_status('127.0.0.1', fake.port))
+            MCSMClient(stub.address, 'key', 'daemon', f'instance-{i}').instance_info()
+        sequential = time.perf_counter() - start
+        print(f'{"sequential SLP + MCSM per server":38} {sequential * 1000:>9.1f}ms for {len(fakes)} servers')
+
+        for concurrency in (1, 4, 16, 64):
+            poller = backend.FleetStatusPoller(backend.SETTINGS_DATABASE, backend.PLAYERS_DATABASE,
+                                               concurrency=concurrency)
+            snapshot = asyncio.run(poller.poll_once())
+            print(f'{f"concurrent poll, limit {concurrency}":38} {snapshot["poll_ms"]:>9.1f}ms  '
+                  f'online {snapshot["totals"]["online"]}/{snapshot["totals"]["servers"]}')
+
+        client.get('/servers/status')
+        while backend.fleet_status.get()["checked_at"] is None:
+            time.sleep(0.01)
+        count = args.requests
+        start = time.perf_counter()
+        for _ in range(count):
+            body = client.get('/servers/status').get_json()
+        elapsed = time.perf_counter() - start
+        print(f'{"cached /servers/status":38} {elapsed / count * 1000:>9.3f}ms/req  totals {body["totals"]}')
+        first = body["servers"][0]
+        print(f'  {first["name"]}: online {first["online"]}, registered {len(first["online_players"])}, '
+              f'unknown {first["unknown_players"]}, mcsm {first["mcsm"]}')
+    finally:
+        for fake in fakes:
+            fake.close()
+        stub.close()
+        os.chdir(old_cwd)
+        if not args.keep_data:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# 对比两次结果，吞吐量下降超过阈值的接口标记为回归
+def compare(old_path, new_path, threshold):
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    print(f'{old.get("commit")} -> {new.get("commit")}')
+    regressions = 0
+    for mode, endpoints in new["modes"].items():
+        for name, result in endpoints.items():
+            before = old.get("modes", {}).get(mode, {}).get(name)
+            if not before or not before.get("throughput") or not result.get("throughput"):
+                continue
+            change = result["throughput"] / before["throughput"] - 1
+            flag = ''
+            if change < -threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            print(f'[{mode:6}] {name:38} {before["throughput"]:>9} -> {result["throughput"]:>9} req/s '
+                  f'({change:+.1%})  p99 {before["p99_ms"]:.2f} -> {result["p99_ms"]:.2f}ms{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every route in app.py')
+    parser.add_argument('--players', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--mode', choices=('test', 'server', 'both'), default='both')
+    parser.add_argument('--only', action='append', help='only run the named endpoint, e.g. "GET /players"')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--keep-data', action='store_true')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    parser.add_argument('--threshold', type=float, default=0.1, help='throughput drop counted as regression')
+    parser.add_argument('--serialization', action='store_true', help='compare player list JSON serializers')
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions per serializer (best is reported)')
+    parser.add_argument('--mcsm', action='store_true', help='measure MCSM command throughput against a local stub')
+    parser.add_argument('--commands', type=int, default=1000, help='commands per MCSM case')
+    parser.add_argument('--mcsm-latency', type=float, default=1.0, help='stub MCSM latency per request (ms)')
+    parser.add_argument('--email', action='store_true', help='measure email queue throughput against a local SMTP stub')
+    parser.add_argument('--emails', type=int, default=500, help='messages per email case')
+    parser.add_argument('--email-latency', type=float, default=1.0, help='stub SMTP latency per reply (ms)')
+    parser.add_argument('--server-status', action='store_true',
+                        help='compare pinging per request with the cached /server/status against a fake server')
+    parser.add_argument('--slp-latency', type=float, default=5.0, help='fake server response latency (ms)')
+    parser.add_argument('--fleet', type=int, default=0, metavar='N',
+                        help='register N fake servers and compare sequential and concurrent status polling')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(args.compare[0], args.compare[1], args.threshold) else 0)
+    if args.serialization:
+        run_serialization_benchmark(args)
+        return
+    if args.mcsm:
+        run_mcsm_benchmark(args)
+        return
+    if args.email:
+        run_email_benchmark(args)
+        return
+    if args.server_status:
+        run_server_status_benchmark(args)
+        return
+    if args.fleet:
+        run_fleet_benchmark(args)
+        return
+    run_benchmark(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，只在进程内保证执行一次
+    fcntl = None
+
+# 启动初始化（建表/迁移、创建管理员）：
+# create_app 在 gunicorn --preload 的主进程中执行一次即可，worker fork 后不再重复；
+# 没有预加载时每个 worker 在处理第一个请求前执行，多个进程通过文件锁排队，
+# 排在后面的进程只会看到已经完成的迁移，不会重复建表或计算 bcrypt。
+BOOTSTRAP_LOCK = os.environ.get('BOOTSTRAP_LOCK', '.bootstrap.lock')
+# BOOTSTRAP 配置：'eager' 在 create_app 中立即执行，'lazy' 在第一个请求前执行，False 不执行
+BOOTSTRAP_MODES = ('eager', 'lazy', False)
+
+# 本进程的启动耗时（毫秒）
+startup_stats = {"pid": os.getpid()}
+_done = set()
+_lock = threading.Lock()
+
+
+def _record(name, seconds):
+    startup_stats["pid"] = os.getpid()
+    startup_stats[name] = round(seconds * 1000, 3)
+
+
+# 执行初始化函数：同一进程内同一个锁文件和初始化函数只执行一次，跨进程通过 flock 互斥。
+# 同一进程中 app.py 和 app1.py 共用锁文件，但各自的初始化函数都要执行
+def run_once(lock_path, fn):
+    key = (os.path.abspath(lock_path), fn)
+    if key in _done:
+        return False
+    with _lock:
+        if key in _done:
+            return False
+        start = time.perf_counter()
+        with open(lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            acquired = time.perf_counter()
+            try:
+                fn()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        end = time.perf_counter()
+        _record('bootstrap_lock_wait_ms', acquired - start)
+        _record('bootstrap_ms', end - acquired)
+        _done.add(key)
+        return True
+
+
+# 第一个请求到达时执行初始化，完成后把 wsgi_app 换回原来的，之后的请求没有额外开销
+class LazyBootstrap:
+    def __init__(self, app, lock_path, fn):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self.lock_path = lock_path
+        self.fn = fn
+
+    def __call__(self, environ, start_response):
+        run_once(self.lock_path, self.fn)
+        self.app.wsgi_app = self.wsgi_app
+        return self.wsgi_app(environ, start_response)
+
+
+# create_app 中调用：按 mode 立即执行、推迟到第一个请求或跳过初始化，并记录创建 app 的耗时
+def apply_bootstrap(app, mode, lock_path, fn, created_at):
+    if mode not in BOOTSTRAP_MODES:
+        raise ValueError(f'Invalid BOOTSTRAP mode: {mode!r}')
+    if mode == 'eager':
+        run_once(lock_path, fn)
+    elif mode == 'lazy':
+        app.wsgi_app = LazyBootstrap(app, lock_path, fn)
+    _record('create_app_ms', time.perf_counter() - created_at)
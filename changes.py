@@ -0,0 +1,54 @@
+import sqlite3
+
+# 增量同步：返回 since 之后变更过的记录的当前状态
+DEFAULT_CHANGES_LIMIT = 500
+MAX_CHANGES_LIMIT = 5000
+
+
+def latest_seq(conn, log_table):
+    row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (log_table,)).fetchone()
+    return row[0] if row else 0
+
+
+def compacted_seq(conn, log_table):
+    row = conn.execute('SELECT compacted_seq FROM change_log_state WHERE name = ?', (log_table,)).fetchone()
+    return row[0] if row else 0
+
+
+# 读取变更：同一条记录多次变更只返回一次（按最后一次变更的 seq 排序），
+# 通过 LEFT JOIN 取得当前数据，已不存在的记录返回 delete。
+# since 为 None、早于已清理的位置或大于最新 seq 时返回 resync，客户端需要重新全量加载。
+def fetch_changes(conn, log_table, table, key_column, columns, since, limit, row_to_dict):
+    try:
+        # 先读取最新 seq 再查询变更：并发写入最多导致下次轮询重复返回，不会遗漏
+        latest = latest_seq(conn, log_table)
+        compacted = compacted_seq(conn, log_table)
+    except sqlite3.OperationalError:
+        # 数据库尚未迁移，没有变更日志
+        return None
+
+    if since is None or since < compacted or since > latest:
+        return {"resync": True, "latest_seq": latest, "next_since": latest, "has_more": False, "changes": []}
+
+    select_columns = ', '.join(f't.{column}' for column in columns)
+    rows = conn.execute(f'''
+        SELECT c.key, c.seq, t.{key_column} IS NOT NULL, {select_columns}
+        FROM (SELECT key, MAX(seq) AS seq FROM {log_table} WHERE seq > ? GROUP BY key) c
+        LEFT JOIN {table} t ON t.{key_column} = c.key
+        ORDER BY c.seq
+        LIMIT ?
+    ''', (since, limit + 1)).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    changes = []
+    for row in rows:
+        key, seq, exists = row[0], row[1], row[2]
+        if exists:
+            changes.append({"seq": seq, "op": "upsert", "key": key, "data": row_to_dict(row[3:])})
+        else:
+            changes.append({"seq": seq, "op": "delete", "key": key, "data": None})
+
+    next_since = changes[-1]["seq"] if has_more else latest
+    return {"resync": False, "latest_seq": latest, "next_since": next_since, "has_more": has_more,
+            "changes": changes}
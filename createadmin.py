@@ -1,5 +1,10 @@
+import os
 import sqlite3
 
+import bcrypt
+
+from password_hasher import DEFAULT_ROUNDS
+
 # 数据库文件路径
 DATABASE = 'users.db'
 
@@ -17,9 +22,11 @@ def create_admin(username, email, password):
             print("id 为 0 的用户已存在")
             return False
 
-        # 插入 id 为 0 的管理员用户，密码明文保存
-        cursor.execute('INSERT INTO users (id, username, email, password, is_active) VALUES (?,?,?,?,?)',
-                       (0, username, email, password, 1))
+        # 插入 id 为 0 的管理员用户，密码保存为 bcrypt 哈希（与 app.py / app1.py 相同）
+        rounds = int(os.environ.get('BCRYPT_ROUNDS', DEFAULT_ROUNDS))
+        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds))
+        cursor.execute('INSERT INTO users (id, username, email, password, is_active, role) VALUES (?,?,?,?,?,?)',
+                       (0, username, email, sqlite3.Binary(hashed_password), 1, 'admin'))
         conn.commit()
         print("id 为 0 的管理员用户创建成功")
         return True
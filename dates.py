@@ -0,0 +1,35 @@
+import datetime
+import re
+
+# 玩家的 join_date / leave_date 统一保存为 YYYY-MM-DD，可以直接按字符串比较和走索引范围查询。
+# 写入时接受常见写法：2025-01-31、2025/1/31、2025.01.31、20250131、2025年1月31日，
+# 以及带时间的 ISO 格式（只保留日期部分，时间部分必须是 HH:MM[:SS[.ffffff]][Z|±HH:MM]）。
+_TIME_SUFFIX = r'(?:[T ]\d{1,2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?(?:Z|[+-]\d{2}:?\d{2})?)?'
+_DATE_RE = re.compile(r'^(\d{4})[-/.年](\d{1,2})[-/.月](\d{1,2})日?' + _TIME_SUFFIX + '$')
+_COMPACT_DATE_RE = re.compile(r'^(\d{4})(\d{2})(\d{2})$')
+
+
+# 返回规范化的日期字符串；None 和空字符串返回 None；无法识别时抛出 ValueError
+def normalize_date(value):
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError('日期必须是字符串')
+    value = value.strip()
+    if not value:
+        return None
+    match = _DATE_RE.match(value) or _COMPACT_DATE_RE.match(value)
+    if match is None:
+        raise ValueError(f'无效的日期: {value}')
+    try:
+        return datetime.date(*(int(part) for part in match.groups())).isoformat()
+    except ValueError:
+        raise ValueError(f'无效的日期: {value}')
+
+
+# 解析 "开始,结束" 形式的日期范围（两端都包含），任一端可以为空
+def parse_date_range(value):
+    start, sep, end = value.partition(',')
+    if not sep:
+        raise ValueError(f'无效的日期范围: {value}')
+    return normalize_date(start), normalize_date(end)
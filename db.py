@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import threading
+import queue
+import time
+from contextlib import contextmanager
+
+# 连接池默认参数
+POOL_SIZE = 8
+# 等待获取连接的最长时间（秒）
+POOL_TIMEOUT = 10
+# 写锁冲突时 SQLite 内部等待的时间（毫秒）
+BUSY_TIMEOUT_MS = 5000
+# 每个连接缓存的预编译语句数量
+STATEMENT_CACHE_SIZE = 256
+
+
+# 新建连接使用的类，以及建立连接后调用的钩子 hook(conn, path)；监控模块启用时替换
+connection_factory = sqlite3.Connection
+connect_hooks = []
+
+
+class PoolExhaustedError(Exception):
+    pass
+
+
+# SQLite 连接池：WAL 模式 + busy_timeout，连接在请求之间复用
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE, timeout=POOL_TIMEOUT, busy_timeout_ms=BUSY_TIMEOUT_MS, attach=()):
+        self.path = path
+        # ((schema, 路径), ...)：每个新连接上 ATTACH 的其他数据库，用于跨库 JOIN
+        self.attach = tuple(attach)
+        self.size = size
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        # 健康指标
+        self._acquired = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._timeouts = 0
+        self._errors = 0
+        self._discarded = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            factory=connection_factory,
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        # WAL 模式下 NORMAL 已足够保证一致性，且避免每次提交都 fsync
+        conn.execute('PRAGMA synchronous=NORMAL')
+        for schema, attached_path in self.attach:
+            conn.execute(f'ATTACH DATABASE ? AS {schema}', (attached_path,))
+        for hook in connect_hooks:
+            hook(conn, self.path)
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # 连接已全部借出，等待归还
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise PoolExhaustedError(f'{self.path}: 等待数据库连接超时')
+        with self._lock:
+            self._waits += 1
+            self._wait_seconds += time.perf_counter() - start
+        return conn
+
+    def _release(self, conn):
+        try:
+            # 丢弃路由中未提交的事务，避免把脏状态带给下一个请求
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # 连接已损坏，不再放回池中
+            with self._lock:
+                self._created -= 1
+                self._discarded += 1
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            return
+        self._idle.put(conn)
+
+    # 借出一个连接，用完后自动归还
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        with self._lock:
+            self._in_use += 1
+            self._acquired += 1
+        try:
+            yield conn
+        except sqlite3.Error:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._release(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "path": self.path,
+                "attach": [schema for schema, _ in self.attach],
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "acquired": self._acquired,
+                "waits": self._waits,
+                "wait_ms_total": round(self._wait_seconds * 1000, 3),
+                "timeouts": self._timeouts,
+                "errors": self._errors,
+                "discarded": self._discarded,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# fork 之后的子进程不能使用父进程打开的连接（例如 gunicorn --preload 时主进程执行过迁移），
+# 直接丢弃而不关闭，子进程用到时重新建立
+def _reset_after_fork():
+    global _pools, _pools_lock
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# 按数据库文件路径获取（或创建）连接池；附加了其他数据库的连接单独成池
+def get_pool(path, attach=()):
+    key = (path, tuple(attach)) if attach else path
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(path, attach=attach)
+                _pools[key] = pool
+    return pool
+
+
+# 路由中使用：with get_db(PLAYERS_DATABASE) as conn: ...
+# 跨库查询：with get_db(PLAYERS_DATABASE, attach=(('users', USERS_DATABASE),)) as conn: ...
+def get_db(path, attach=()):
+    return get_pool(path, attach).connection()
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
+
+
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
@@ -0,0 +1,388 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qs
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，只能单进程运行
+    fcntl = None
+
+from db import get_db
+
+logger = logging.getLogger(__name__)
+
+# 事件推送（Server-Sent Events）：
+# 接口写入成功后调用 publish()，由一个 asyncio 事件循环线程统一分发给所有连接的客户端。
+# 每个客户端只占用一个协程和一个有界队列，不占用 Flask 的工作线程；队列满（客户端读取太慢）时直接断开。
+#
+# 多进程部署（gunicorn 多个 worker）时设置 outbox_path：publish() 把事件写入该数据库的 event_outbox 表，
+# 所有 worker 共享；只有持有 EVENTS_LOCK 文件锁的一个进程运行事件服务，定期读取新事件并分发。
+# 其他进程的后台线程阻塞在文件锁上，持有锁的进程退出后由其中一个接管。事件 id 即 outbox 的 seq。
+# 发件箱使用单独的数据库文件：写入 settings.db 会改变它的 data_version，使设置缓存在每次写入后失效。
+# 设置环境变量 EVENTS_ENABLED=1 启用；未启用时不监听端口，publish() 什么也不做
+EVENTS_ENABLED = os.environ.get('EVENTS_ENABLED', '0') == '1'
+EVENTS_DATABASE = os.environ.get('EVENTS_DATABASE', 'events.db')
+EVENTS_LOCK = os.environ.get('EVENTS_LOCK', '.events.lock')
+
+EVENTS_HOST = os.environ.get('EVENTS_HOST', '127.0.0.1')
+EVENTS_PORT = int(os.environ.get('EVENTS_PORT', '5001'))
+# 浏览器访问事件服务的地址，为空时根据请求的主机名和 EVENTS_PORT 生成（反向代理后需要设置）
+EVENTS_PUBLIC_URL = os.environ.get('EVENTS_PUBLIC_URL', '')
+# 每个客户端最多缓存的未发送事件数
+CLIENT_BUFFER_SIZE = 256
+# 最多同时连接的客户端数
+MAX_CLIENTS = 1000
+# 保留最近的事件，客户端断线重连时根据 Last-Event-ID 补发
+REPLAY_SIZE = 1024
+# 没有事件时发送注释行的间隔（秒），防止代理断开空闲连接
+HEARTBEAT_INTERVAL = 15
+# 客户端重连等待时间（毫秒）
+RETRY_MS = 3000
+# 事件服务读取 event_outbox 的间隔（秒），以及表中保留的事件数
+OUTBOX_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', '0.1'))
+OUTBOX_RETENTION = 10000
+# 事件服务端口被占用等启动失败时，等待多久再重试（秒）
+LEADER_RETRY_INTERVAL = 5
+# 读取请求头的超时（秒）和最大长度
+REQUEST_TIMEOUT = 10
+MAX_REQUEST_HEAD = 8192
+
+_RESPONSE_HEAD = (
+    b'HTTP/1.1 200 OK\r\n'
+    b'Content-Type: text/event-stream; charset=utf-8\r\n'
+    b'Cache-Control: no-cache\r\n'
+    b'Connection: keep-alive\r\n'
+    b'Access-Control-Allow-Origin: *\r\n'
+    b'X-Accel-Buffering: no\r\n'
+    b'\r\n'
+)
+
+
+def _error_response(status):
+    return f'HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'.encode('ascii')
+
+
+def _encode_payload(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def _encode_event(event_id, event_type, payload):
+    return f'id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n'.encode('utf-8')
+
+
+class _Client:
+    __slots__ = ('queue', 'writer', 'dropped')
+
+    def __init__(self, writer):
+        self.queue = asyncio.Queue(CLIENT_BUFFER_SIZE)
+        self.writer = writer
+        self.dropped = False
+
+
+class EventBroker:
+    def __init__(self):
+        self._reset()
+        # fork 之后子进程没有事件线程，也不持有文件锁
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+        # 事件表所在的数据库；为 None 时只在本进程内分发
+        self.outbox_path = None
+        # 可选的访问令牌校验函数，接收 access_token 参数，校验失败时抛出异常
+        self.authenticate = None
+        self.published = 0
+        self.delivered = 0
+        self.dropped_clients = 0
+        self.rejected_clients = 0
+        self.total_clients = 0
+        self.outbox_errors = 0
+
+    def _reset(self):
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._start_error = None
+        self._clients = set()
+        self._replay = deque(maxlen=REPLAY_SIZE)
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._leader_thread = None
+        self._lock_file = None
+        self.port = None
+
+    @property
+    def running(self):
+        return self._loop is not None
+
+    # 从任意线程发布事件。设置了 outbox_path 时写入事件表，由持有文件锁的进程分发；
+    # 否则直接交给本进程的事件循环，事件服务未启动时什么也不做。事件只编码一次，所有客户端共享同一份字节
+    def publish(self, event_type, data):
+        if self.outbox_path is not None:
+            try:
+                with get_db(self.outbox_path) as conn:
+                    conn.execute('INSERT INTO event_outbox (type, data, created_at) VALUES (?, ?, ?)',
+                                 (event_type, _encode_payload(data), time.time()))
+                    conn.commit()
+            except sqlite3.Error as e:
+                # 推送失败不影响已经完成的写入
+                self.outbox_errors += 1
+                logger.warning('Failed to write event %s: %s', event_type, e)
+            return
+        loop = self._loop
+        if loop is None:
+            return
+        with self._lock:
+            event_id = self._next_id
+            self._next_id += 1
+        message = _encode_event(event_id, event_type, _encode_payload(data))
+        try:
+            loop.call_soon_threadsafe(self._fan_out, event_id, message)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    # 在事件循环线程中执行：放入每个客户端的队列，队列已满的客户端断开
+    def _fan_out(self, event_id, message):
+        self.published += 1
+        self._replay.append((event_id, message))
+        for client in list(self._clients):
+            try:
+                client.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._drop(client)
+
+    def _drop(self, client):
+        if client.dropped:
+            return
+        client.dropped = True
+        self.dropped_clients += 1
+        self._clients.discard(client)
+        client.writer.transport.abort()
+
+    async def _read_request(self, reader):
+        # 请求头超过 MAX_REQUEST_HEAD 时 readuntil 抛出 LimitOverrunError
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), REQUEST_TIMEOUT)
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, _ = lines[0].split(' ', 2)
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        path, _, query = target.partition('?')
+        return method, path, parse_qs(query), headers
+
+    async def _handle(self, reader, writer):
+        try:
+            method, path, query, headers = await self._read_request(reader)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError,
+                ConnectionError):
+            writer.close()
+            return
+
+        if method != 'GET' or path != '/events':
+            writer.write(_error_response('404 Not Found'))
+            writer.close()
+            return
+        if self.authenticate is not None:
+            try:
+                self.authenticate(query.get('access_token', [''])[0])
+            except Exception:
+                writer.write(_error_response('401 Unauthorized'))
+                writer.close()
+                return
+        if len(self._clients) >= MAX_CLIENTS:
+            self.rejected_clients += 1
+            writer.write(_error_response('503 Service Unavailable'))
+            writer.close()
+            return
+
+        client = _Client(writer)
+        self._clients.add(client)
+        self.total_clients += 1
+        writer.write(_RESPONSE_HEAD + f'retry: {RETRY_MS}\n\n'.encode('ascii'))
+
+        # 断线重连：补发 Last-Event-ID 之后仍在保留范围内的事件
+        last_id = headers.get('last-event-id', '')
+        if last_id.isdigit():
+            last_id = int(last_id)
+            for event_id, message in self._replay:
+                if event_id > last_id:
+                    try:
+                        client.queue.put_nowait(message)
+                    except asyncio.QueueFull:
+                        break
+
+        try:
+            while not client.dropped:
+                try:
+                    message = await asyncio.wait_for(client.queue.get(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    message = b': ping\n\n'
+                else:
+                    self.delivered += 1
+                writer.write(message)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self._clients.discard(client)
+            writer.close()
+
+    def _read_outbox(self, after, limit):
+        with get_db(self.outbox_path) as conn:
+            if after is None:
+                # 启动时载入最近的事件用于断线重连补发
+                rows = conn.execute('SELECT seq, type, data FROM event_outbox ORDER BY seq DESC LIMIT ?',
+                                    (limit,)).fetchall()
+                return rows[::-1]
+            return conn.execute('SELECT seq, type, data FROM event_outbox WHERE seq > ? ORDER BY seq LIMIT ?',
+                                (after, limit)).fetchall()
+
+    def _prune_outbox(self, last_seq):
+        with get_db(self.outbox_path) as conn:
+            conn.execute('DELETE FROM event_outbox WHERE seq <= ?', (last_seq - OUTBOX_RETENTION,))
+            conn.commit()
+
+    # 在事件循环中定期读取 event_outbox 的新事件并分发（数据库操作在线程池中执行）
+    async def _tail_outbox(self):
+        loop = asyncio.get_running_loop()
+        last_seq = None
+        polls = 0
+        while True:
+            try:
+                rows = await loop.run_in_executor(None, self._read_outbox, last_seq, REPLAY_SIZE)
+                if last_seq is None:
+                    last_seq = rows[-1][0] if rows else 0
+                    self._replay.extend((seq, _encode_event(seq, event_type, payload))
+                                        for seq, event_type, payload in rows)
+                    rows = []
+                for seq, event_type, payload in rows:
+                    self._fan_out(seq, _encode_event(seq, event_type, payload))
+                    last_seq = seq
+                polls += 1
+                if polls % 1000 == 0 and last_seq > OUTBOX_RETENTION:
+                    await loop.run_in_executor(None, self._prune_outbox, last_seq)
+            except sqlite3.Error as e:
+                # 例如事件表尚未迁移；下一轮重试
+                self.outbox_errors += 1
+                logger.warning('Failed to read event outbox: %s', e)
+                rows = []
+            if not rows:
+                await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+
+    def _run(self, host, port, started):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            self._server = loop.run_until_complete(
+                asyncio.start_server(self._handle, host, port, limit=MAX_REQUEST_HEAD))
+        except OSError as e:
+            self._start_error = e
+            loop.close()
+            started.set()
+            return
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._loop = loop
+        if self.outbox_path is not None:
+            loop.create_task(self._tail_outbox())
+        started.set()
+        try:
+            loop.run_forever()
+        finally:
+            self._loop = None
+            self._server.close()
+            for client in list(self._clients):
+                client.writer.transport.abort()
+            self._clients.clear()
+            # 取消仍在等待的客户端协程和 outbox 读取任务，否则关闭事件循环后它们无法结束
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(self._server.wait_closed())
+            loop.run_until_complete(loop.shutdown_default_executor())
+            loop.close()
+
+    # 在后台线程中启动事件服务，返回实际监听的端口（port 为 0 时由系统分配）
+    def start(self, host=EVENTS_HOST, port=EVENTS_PORT):
+        if self._thread is not None:
+            return self.port
+        started = threading.Event()
+        self._start_error = None
+        self._thread = threading.Thread(target=self._run, args=(host, port, started), name='events',
+                                        daemon=True)
+        self._thread.start()
+        started.wait()
+        if self._start_error is not None:
+            self._thread = None
+            raise self._start_error
+        return self.port
+
+    # 每个进程调用一次（在处理请求的进程中，而不是 gunicorn --preload 的主进程）：
+    # 后台线程等待 EVENTS_LOCK 文件锁，拿到锁的进程启动事件服务并一直持有锁
+    def ensure_leader(self, lock_path=EVENTS_LOCK, host=EVENTS_HOST, port=EVENTS_PORT):
+        if self._leader_thread is not None:
+            return
+        with self._lock:
+            if self._leader_thread is not None:
+                return
+            self._leader_thread = threading.Thread(target=self._lead, args=(lock_path, host, port),
+                                                   name='events-leader', daemon=True)
+            self._leader_thread.start()
+
+    def _lead(self, lock_path, host, port):
+        self._lock_file = open(lock_path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        while True:
+            try:
+                self.start(host, port)
+                return
+            except OSError as e:
+                logger.warning('Failed to start event server on %s:%s: %s', host, port, e)
+                time.sleep(LEADER_RETRY_INTERVAL)
+
+    def stop(self):
+        loop, thread = self._loop, self._thread
+        if loop is None or thread is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        self._thread = None
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "port": self.port,
+            "clients": len(self._clients),
+            "total_clients": self.total_clients,
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped_clients": self.dropped_clients,
+            "rejected_clients": self.rejected_clients,
+            "outbox": self.outbox_path is not None,
+            "outbox_errors": self.outbox_errors,
+        }
+
+
+broker = EventBroker()
+
+
+def publish(event_type, data):
+    broker.publish(event_type, data)
+
+
+# 浏览器连接事件服务使用的地址
+def public_events_url(request_host):
+    if EVENTS_PUBLIC_URL:
+        return EVENTS_PUBLIC_URL
+    hostname = request_host.rsplit(':', 1)[0] if not request_host.endswith(']') else request_host
+    # 事件服务可能运行在另一个 worker 进程中，端口以配置为准
+    return f'http://{hostname}:{broker.port or EVENTS_PORT}/events'
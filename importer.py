@@ -0,0 +1,197 @@
+import csv
+import json
+import time
+
+from batch import BATCH_IDS, load_batch_ids
+from dates import normalize_date
+
+PLAYER_FIELDS = ('game_id', 'qq', 'email', 'permission_group', 'join_date', 'leave_date', 'leave_reason')
+
+# 每个事务写入的行数
+IMPORT_BATCH_SIZE = 5000
+# 错误报告最多保留的条数，超出部分只计数
+MAX_REPORTED_ERRORS = 1000
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+IMPORT_MODES = ('skip', 'upsert')
+
+_INSERT_SQL = (f'INSERT INTO players ({", ".join(PLAYER_FIELDS)}) VALUES ({", ".join("?" for _ in PLAYER_FIELDS)}) '
+               'ON CONFLICT(game_id) DO ')
+_IMPORT_SQL = {
+    'skip': _INSERT_SQL + 'NOTHING',
+    'upsert': _INSERT_SQL + 'UPDATE SET ' + ', '.join(
+        f'{field} = excluded.{field}' for field in PLAYER_FIELDS if field != 'game_id'),
+}
+
+
+class ImportReport:
+    def __init__(self):
+        self.processed = 0
+        self.written = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors = []
+        self.seconds = 0.0
+        # track_changes 时记录新增的玩家和权限组有变化的玩家：[(game_id, permission_group)]，用于同步到 MCSM
+        self.added = []
+        self.group_changed = []
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "message": message})
+
+    def to_dict(self):
+        return {
+            "processed": self.processed,
+            "written": self.written,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+            "seconds": round(self.seconds, 3),
+            "rows_per_sec": round(self.processed / self.seconds) if self.seconds > 0 else None,
+        }
+
+
+def _read_csv(text_stream):
+    reader = csv.DictReader(text_stream)
+    try:
+        fieldnames = reader.fieldnames
+    except csv.Error as e:
+        raise ValueError(f'无效的 CSV 表头: {e}')
+    if fieldnames is None:
+        return
+    unknown = [name for name in reader.fieldnames if name not in PLAYER_FIELDS]
+    if unknown:
+        raise ValueError(f'未知的列: {", ".join(unknown)}')
+    if 'game_id' not in reader.fieldnames:
+        raise ValueError('缺少 game_id 列')
+    while True:
+        # DictReader.line_num 只在读取成功后更新，出错时从底层 reader 读取行号
+        line_num = reader.reader.line_num
+        try:
+            record = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            # 例如字段超过长度限制；出错的记录计入错误报告，从下一行继续
+            yield reader.reader.line_num, None, f'CSV 格式错误: {e}'
+            if reader.reader.line_num == line_num:
+                return
+            continue
+        # DictReader 把多出来的字段放在 None 键下
+        if None in record:
+            yield reader.line_num, None, '列数与表头不一致'
+            continue
+        yield reader.line_num, {key: (value if value != '' else None) for key, value in record.items()}, None
+
+
+def _read_ndjson(text_stream):
+    for line_num, line in enumerate(text_stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_num, None, '无效的 JSON'
+            continue
+        if not isinstance(record, dict):
+            yield line_num, None, '每行必须是 JSON 对象'
+            continue
+        yield line_num, record, None
+
+
+def _validate(record, allowed_groups):
+    game_id = record.get('game_id')
+    if not isinstance(game_id, str) or not game_id.strip():
+        return None, '缺少 game_id'
+    if record.get('permission_group') not in allowed_groups:
+        return None, '无效的权限组'
+    row = []
+    for field in PLAYER_FIELDS:
+        value = record.get(field)
+        if value is not None and not isinstance(value, str):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = str(value)
+            else:
+                return None, f'{field} 类型无效'
+        if field in ('join_date', 'leave_date'):
+            try:
+                value = normalize_date(value)
+            except ValueError as e:
+                return None, f'{field}: {e}'
+        row.append(value)
+    return row, None
+
+
+# 写入前查询本批次中已存在的玩家及其权限组，与写入在同一个事务中
+def _existing_groups(conn, batch):
+    load_batch_ids(conn, (row[0] for row in batch))
+    existing = dict(conn.execute(f'SELECT game_id, permission_group FROM players WHERE game_id IN {BATCH_IDS}'))
+    conn.execute('DELETE FROM temp.batch_ids')
+    return existing
+
+
+def _track_changes(report, batch, existing, mode):
+    group_index = PLAYER_FIELDS.index('permission_group')
+    if mode == 'skip':
+        # 同一批中重复的 game_id 只有第一行写入
+        final = {}
+        for row in batch:
+            final.setdefault(row[0], row[group_index])
+    else:
+        # upsert 以最后一行为准
+        final = {row[0]: row[group_index] for row in batch}
+    for game_id, group in final.items():
+        if game_id not in existing:
+            report.added.append((game_id, group))
+        elif mode == 'upsert' and existing[game_id] != group:
+            report.group_changed.append((game_id, group))
+
+
+# 从文本流中逐行读取玩家并分批写入，整个上传不会一次读入内存。
+# mode=skip 时已存在的 game_id 跳过，mode=upsert 时覆盖。
+# track_changes 为 True 时在报告的 added / group_changed 中返回写入的玩家
+def import_players(conn, text_stream, fmt, mode, allowed_groups, batch_size=IMPORT_BATCH_SIZE, track_changes=False):
+    reader = _read_csv(text_stream) if fmt == 'csv' else _read_ndjson(text_stream)
+    sql = _IMPORT_SQL[mode]
+    report = ImportReport()
+    start = time.perf_counter()
+    batch = []
+
+    def flush():
+        existing = None
+        try:
+            if track_changes:
+                # 先取得写锁，查询到的已有玩家与写入时一致
+                conn.execute('BEGIN IMMEDIATE')
+                existing = _existing_groups(conn, batch)
+            cursor = conn.executemany(sql, batch)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        report.written += cursor.rowcount
+        report.skipped += len(batch) - cursor.rowcount
+        if existing is not None:
+            _track_changes(report, batch, existing, mode)
+        batch.clear()
+
+    try:
+        for line_num, record, error in reader:
+            report.processed += 1
+            if error is None:
+                row, error = _validate(record, allowed_groups)
+            if error is not None:
+                report.add_error(line_num, error)
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    finally:
+        report.seconds = time.perf_counter() - start
+    return report
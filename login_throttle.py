@@ -0,0 +1,247 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from db import get_db
+
+# 登录限流：按用户名和客户端 IP 分别统计滑动窗口内的登录次数，
+# 超过上限后按指数退避锁定一段时间。检查在查询数据库和 bcrypt 验证之前进行。
+LOGIN_WINDOW = int(os.environ.get('LOGIN_WINDOW', '300'))
+LOGIN_MAX_ATTEMPTS_USER = int(os.environ.get('LOGIN_MAX_ATTEMPTS_USER', '5'))
+LOGIN_MAX_ATTEMPTS_IP = int(os.environ.get('LOGIN_MAX_ATTEMPTS_IP', '20'))
+# 第一次锁定的秒数，之后每次翻倍，最长 MAX_BACKOFF
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 900.0
+# 内存中最多保存的计数器数量，超过后淘汰最久未使用的
+MAX_ENTRIES = 10000
+# 设置后计数器保存在该 SQLite 文件中，多个工作进程共享同一份限制
+LOGIN_THROTTLE_DB = os.environ.get('LOGIN_THROTTLE_DB', '')
+
+# 部署在反向代理后面时设置为代理的层数（通常为 1），按 X-Forwarded-For 取客户端 IP，
+# 否则所有请求的 remote_addr 都是代理的地址，按 IP 限流会锁住全部用户。
+# 不在代理后面时必须保持 0，否则客户端可以伪造 X-Forwarded-For 绕过限流
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', '0'))
+
+# 计数器状态：[上一窗口次数, 当前窗口次数, 当前窗口开始时间, 锁定截止时间, 连续锁定次数]
+_PREV, _CURR, _START, _LOCKED, _STRIKES = range(5)
+
+
+def _new_state(now):
+    return [0, 0, now, 0.0, 0]
+
+
+# 滑动窗口估计：上一窗口按剩余比例计入，加上当前窗口的次数
+def _roll(state, now, window):
+    elapsed = now - state[_START]
+    if elapsed >= window:
+        periods = int(elapsed // window)
+        state[_PREV] = state[_CURR] if periods == 1 else 0
+        state[_CURR] = 0
+        state[_START] += periods * window
+        elapsed = now - state[_START]
+        if state[_PREV] == 0 and state[_LOCKED] <= now:
+            # 整整一个窗口没有尝试，退避次数清零
+            state[_STRIKES] = 0
+    return state[_PREV] * (1 - elapsed / window) + state[_CURR]
+
+
+def _hit(state, now, window, limit, base_backoff, max_backoff):
+    if state[_LOCKED] > now:
+        return state[_LOCKED] - now, False
+    count = _roll(state, now, window)
+    if count >= limit:
+        backoff = min(max_backoff, base_backoff * (2 ** state[_STRIKES]))
+        state[_STRIKES] += 1
+        state[_LOCKED] = now + backoff
+        # 锁定结束后只允许再试一次，再失败则锁定时间翻倍
+        state[_PREV] = 0
+        state[_CURR] = limit - 1
+        return backoff, True
+    state[_CURR] += 1
+    return 0, False
+
+
+class _MemoryStore:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def update(self, key, now, fn):
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = _new_state(now)
+                while len(self._states) > self.max_entries:
+                    self._states.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._states.move_to_end(key)
+            return fn(state)
+
+    def delete(self, key):
+        with self._lock:
+            self._states.pop(key, None)
+
+    def __len__(self):
+        return len(self._states)
+
+
+class _SQLiteStore:
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._updates = 0
+        self._ready = False
+
+    # 第一次使用时建表：app 在导入时创建 LoginThrottle，此时不能打开数据库（可能在 fork 之前，目录也可能还没准备好）
+    def _ensure_table(self, conn):
+        if self._ready:
+            return
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS login_throttle (
+                key TEXT PRIMARY KEY,
+                prev_count INTEGER NOT NULL,
+                curr_count INTEGER NOT NULL,
+                window_start REAL NOT NULL,
+                locked_until REAL NOT NULL,
+                strikes INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_login_throttle_updated_at ON login_throttle (updated_at)')
+        conn.commit()
+        self._ready = True
+
+    # 读取、修改、写回在同一个 BEGIN IMMEDIATE 事务中完成，多进程并发时不会丢失计数
+    def update(self, key, now, fn):
+        with get_db(self.path) as conn:
+            self._ensure_table(conn)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT prev_count, curr_count, window_start, locked_until, strikes '
+                                   'FROM login_throttle WHERE key = ?', (key,)).fetchone()
+                state = list(row) if row else _new_state(now)
+                result = fn(state)
+                conn.execute('INSERT OR REPLACE INTO login_throttle VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (key, *state, now))
+                self._updates += 1
+                if self._updates % 1000 == 0:
+                    self._evict(conn)
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+        return result
+
+    # 超过 max_entries 时删除最久未更新的记录
+    def _evict(self, conn):
+        cursor = conn.execute('''
+            DELETE FROM login_throttle WHERE updated_at <= (
+                SELECT updated_at FROM login_throttle ORDER BY updated_at DESC LIMIT 1 OFFSET ?
+            )
+        ''', (self.max_entries,))
+        self.evictions += cursor.rowcount
+
+    def delete(self, key):
+        with get_db(self.path) as conn:
+            self._ensure_table(conn)
+            conn.execute('DELETE FROM login_throttle WHERE key = ?', (key,))
+            conn.commit()
+
+    def __len__(self):
+        with get_db(self.path) as conn:
+            self._ensure_table(conn)
+            return conn.execute('SELECT COUNT(*) FROM login_throttle').fetchone()[0]
+
+
+class LoginThrottle:
+    def __init__(self, window=LOGIN_WINDOW, max_attempts_user=LOGIN_MAX_ATTEMPTS_USER,
+                 max_attempts_ip=LOGIN_MAX_ATTEMPTS_IP, base_backoff=BASE_BACKOFF, max_backoff=MAX_BACKOFF,
+                 max_entries=MAX_ENTRIES, store_path=LOGIN_THROTTLE_DB):
+        self.window = window
+        self.max_attempts_user = max_attempts_user
+        self.max_attempts_ip = max_attempts_ip
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._store = _SQLiteStore(store_path, max_entries) if store_path else _MemoryStore(max_entries)
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.rejected_user = 0
+        self.rejected_ip = 0
+        self.lockouts = 0
+
+    def _check_key(self, key, limit, now):
+        def fn(state):
+            return _hit(state, now, self.window, limit, self.base_backoff, self.max_backoff)
+        return self._store.update(key, now, fn)
+
+    # 记录一次登录尝试，返回需要等待的秒数；0 表示允许继续验证密码。
+    # 每次尝试都会计数（不只是失败），并发的撞库请求在验证密码之前就会被拦住
+    def check(self, username, ip):
+        now = time.time()
+        with self._lock:
+            self.checks += 1
+        if ip:
+            retry_after, locked = self._check_key(f'ip:{ip}', self.max_attempts_ip, now)
+            if retry_after:
+                with self._lock:
+                    self.rejected_ip += 1
+                    self.lockouts += locked
+                return retry_after
+        if username:
+            retry_after, locked = self._check_key(f'user:{str(username).lower()}', self.max_attempts_user, now)
+            if retry_after:
+                with self._lock:
+                    self.rejected_user += 1
+                    self.lockouts += locked
+                return retry_after
+        return 0
+
+    # 登录成功：清除该用户名的计数，IP 的计数退回一次
+    def record_success(self, username, ip):
+        if username:
+            self._store.delete(f'user:{str(username).lower()}')
+        if ip:
+            def fn(state):
+                state[_CURR] = max(0, state[_CURR] - 1)
+            self._store.update(f'ip:{ip}', time.time(), fn)
+
+    def stats(self):
+        with self._lock:
+            counters = {
+                "checks": self.checks,
+                "rejected_user": self.rejected_user,
+                "rejected_ip": self.rejected_ip,
+                "lockouts": self.lockouts,
+            }
+        counters.update({
+            "entries": len(self._store),
+            "evictions": self._store.evictions,
+            "shared": isinstance(self._store, _SQLiteStore),
+            "window": self.window,
+            "max_attempts_user": self.max_attempts_user,
+            "max_attempts_ip": self.max_attempts_ip,
+        })
+        return counters
+
+
+# Retry-After 响应头（整数秒，向上取整）
+def retry_after_header(seconds):
+    return {'Retry-After': str(max(1, math.ceil(seconds)))}
+
+
+# 在 app 上信任 trusted 层反向代理设置的 X-Forwarded-* 请求头，request.remote_addr 为真实客户端地址
+def init_proxy_fix(app, trusted=None):
+    if trusted is None:
+        trusted = TRUSTED_PROXIES
+    if trusted > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted, x_proto=trusted, x_host=trusted)
+    return trusted > 0
@@ -0,0 +1,351 @@
+import os
+import re
+import smtplib
+import ssl
+import threading
+import time
+from email.message import EmailMessage
+
+from db import get_db
+
+# 邮件发送队列：待发送的邮件保存在 settings.db 的 email_queue 表中（见 migrations.py），重启后继续发送。
+# 请求中只插入一行，由后台线程批量发送：SMTP 连接登录一次后保持打开，按服务商配额限速，
+# 临时错误（4xx、连接断开）按指数退避重试，5xx 视为永久失败。
+# 多个进程可以同时运行发送线程，领取邮件时在写事务中修改 next_attempt_at，同一封邮件不会被两个进程同时发送；
+# 进程在发送途中退出时，领取超过 EMAIL_LEASE 秒的邮件会被重新发送；一批邮件发送时间较长时，
+# 发送线程在租期快到时延长本批剩余邮件的租期，避免其他进程重复发送。
+# 设置环境变量 EMAIL_QUEUE=1 启用；SMTP 服务器、端口、用户名和密码从设置中读取。
+EMAIL_QUEUE = os.environ.get('EMAIL_QUEUE', '0') == '1'
+# 发件人地址，默认使用 SMTP 用户名
+EMAIL_FROM = os.environ.get('EMAIL_FROM', '')
+# 每批领取的邮件数
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', '50'))
+# 限速：EMAIL_RATE_WINDOW 秒内最多发送 EMAIL_RATE_LIMIT 封（所有进程合计，重试也计入），0 表示不限制
+EMAIL_RATE_LIMIT = int(os.environ.get('EMAIL_RATE_LIMIT', '60'))
+EMAIL_RATE_WINDOW = float(os.environ.get('EMAIL_RATE_WINDOW', '60'))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', '8'))
+# 第 n 次失败后等待 BASE_BACKOFF * 2^(n-1) 秒，最长 MAX_BACKOFF
+BASE_BACKOFF = 30.0
+MAX_BACKOFF = 3600.0
+EMAIL_LEASE = 300.0
+# SMTP 连接空闲这么久后主动关闭（秒），服务商通常会断开长时间空闲的连接
+EMAIL_IDLE_TIMEOUT = 60.0
+EMAIL_SMTP_TIMEOUT = 30.0
+# 剩余租期少于一封邮件最长的发送时间（发送超时后重新连接再发送一次）时延长租期
+LEASE_MARGIN = 2 * EMAIL_SMTP_TIMEOUT
+# 队列为空时最长的检查间隔（秒），用于发现其他进程加入的邮件
+EMAIL_POLL_INTERVAL = 5.0
+# 已发送的邮件保留的天数
+EMAIL_RETENTION_DAYS = 7
+DEFAULT_SMTP_PORT = 587
+
+_EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+
+class EmailConfigError(Exception):
+    pass
+
+
+# 返回 (是否临时错误, 错误信息)
+def _classify(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return any(code < 500 for code in codes), f'收件人被拒绝: {error.recipients}'
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        # 用户名或密码错误，修改设置后可以重试
+        return True, f'SMTP 登录失败: {error.smtp_code} {error.smtp_error!r}'
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code < 500, f'SMTP {error.smtp_code} {error.smtp_error!r}'
+    return True, f'{type(error).__name__}: {error}'
+
+
+class EmailQueue:
+    def __init__(self, path, settings_cache, batch_size=EMAIL_BATCH_SIZE, rate_limit=EMAIL_RATE_LIMIT,
+                 rate_window=EMAIL_RATE_WINDOW, max_attempts=EMAIL_MAX_ATTEMPTS,
+                 base_backoff=BASE_BACKOFF, max_backoff=MAX_BACKOFF):
+        self.path = path
+        self.settings_cache = settings_cache
+        self.batch_size = batch_size
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._reset()
+        # fork 之后子进程没有发送线程和 SMTP 连接，重新开始
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+        # 本进程的统计
+        self.enqueued = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.smtp_connections = 0
+        self.rate_limited = 0
+        self.lease_extensions = 0
+        self.last_error = None
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._smtp = None
+        self._smtp_key = None
+        self._smtp_used_at = 0.0
+        self._purged_at = 0.0
+
+    def ensure_started(self):
+        if self._thread is None and EMAIL_QUEUE:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='email-queue', daemon=True)
+                    self._thread.start()
+
+    # 加入多封邮件 [(收件人, 标题, 正文), ...]，在一个事务中写入，返回加入的数量；地址无效的邮件跳过
+    def enqueue_many(self, messages):
+        if not EMAIL_QUEUE:
+            return 0
+        now = time.time()
+        rows = [(recipient.strip(), subject, body, now, now) for recipient, subject, body in messages
+                if isinstance(recipient, str) and _EMAIL_RE.match(recipient.strip())]
+        if rows:
+            with get_db(self.path) as conn:
+                conn.executemany('''
+                    INSERT INTO email_queue (recipient, subject, body, next_attempt_at, created_at)
+                    VALUES (?,?,?,?,?)
+                ''', rows)
+                conn.commit()
+            with self._lock:
+                self.enqueued += len(rows)
+            self.ensure_started()
+            self._wakeup.set()
+        return len(rows)
+
+    def enqueue(self, recipient, subject, body):
+        return self.enqueue_many([(recipient, subject, body)])
+
+    # 给某个权限组的所有玩家发送同一封邮件，同一地址只发送一次
+    def enqueue_permission_group(self, players_path, permission_group, subject, body):
+        if not EMAIL_QUEUE:
+            return 0
+        with get_db(players_path) as conn:
+            recipients = [row[0] for row in conn.execute('''
+                SELECT DISTINCT lower(trim(email)) FROM players
+                WHERE permission_group =? AND email IS NOT NULL AND email != ''
+            ''', (permission_group,))]
+        return self.enqueue_many((recipient, subject, body) for recipient in recipients)
+
+    # 领取到期的邮件：在同一个写事务中检查限速并把 next_attempt_at 推迟 EMAIL_LEASE 秒
+    def _claim(self, conn, now):
+        limit = self.batch_size
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if self.rate_limit:
+                used = conn.execute('SELECT COUNT(*) FROM email_queue WHERE claimed_at > ?',
+                                    (now - self.rate_window,)).fetchone()[0]
+                limit = min(limit, self.rate_limit - used)
+            if limit <= 0:
+                rows = []
+            else:
+                rows = conn.execute('''
+                    UPDATE email_queue SET attempts = attempts + 1, claimed_at = :now, next_attempt_at = :lease
+                    WHERE id IN (
+                        SELECT id FROM email_queue WHERE status = 'pending' AND next_attempt_at <= :now
+                        ORDER BY next_attempt_at, id LIMIT :limit
+                    )
+                    RETURNING id, recipient, subject, body, attempts
+                ''', {"now": now, "lease": now + EMAIL_LEASE, "limit": limit}).fetchall()
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return rows, limit <= 0
+
+    # 把本批尚未发送的邮件的租期延长 EMAIL_LEASE 秒；claimed_at 不同说明已被其他进程重新领取，不再修改
+    def _extend_lease(self, conn, rows, claimed_at):
+        lease_until = time.time() + EMAIL_LEASE
+        conn.executemany("UPDATE email_queue SET next_attempt_at =? WHERE id =? AND claimed_at =? AND status = 'pending'",
+                         [(lease_until, row[0], claimed_at) for row in rows])
+        conn.commit()
+        with self._lock:
+            self.lease_extensions += 1
+        return lease_until
+
+    # 下一次需要检查队列的时间
+    def _next_wakeup(self, conn, now, rate_limited):
+        if rate_limited:
+            # 窗口内最早的一次领取过期后才有空余配额
+            oldest = conn.execute('SELECT MIN(claimed_at) FROM email_queue WHERE claimed_at > ?',
+                                  (now - self.rate_window,)).fetchone()[0]
+            return (oldest or now) + self.rate_window
+        due = conn.execute("SELECT MIN(next_attempt_at) FROM email_queue WHERE status = 'pending'").fetchone()[0]
+        return min(due if due is not None else float('inf'), now + EMAIL_POLL_INTERVAL)
+
+    def _settings_key(self):
+        settings = self.settings_cache.get()
+        if settings is None or not settings.email_service_host:
+            raise EmailConfigError('未设置邮件服务器')
+        if not (EMAIL_FROM or settings.email_service_username):
+            # 发件人地址默认使用 SMTP 用户名，两者都为空时 From 为空，服务器会拒收或被判为垃圾邮件
+            raise EmailConfigError('未设置发件人地址（EMAIL_FROM 或 SMTP 用户名）')
+        return (settings.email_service_host, settings.email_service_port or DEFAULT_SMTP_PORT,
+                settings.email_service_username, settings.email_service_password)
+
+    def _close_smtp(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self._smtp.close()
+            self._smtp = None
+
+    # 返回已登录的 SMTP 连接；设置修改后重新连接
+    def _get_smtp(self):
+        key = self._settings_key()
+        if self._smtp is not None and key != self._smtp_key:
+            self._close_smtp()
+        if self._smtp is None:
+            host, port, username, password = key
+            if port == smtplib.SMTP_SSL_PORT:
+                smtp = smtplib.SMTP_SSL(host, port, timeout=EMAIL_SMTP_TIMEOUT,
+                                        context=ssl.create_default_context())
+            else:
+                smtp = smtplib.SMTP(host, port, timeout=EMAIL_SMTP_TIMEOUT)
+            try:
+                if port != smtplib.SMTP_SSL_PORT:
+                    smtp.ehlo()
+                    if smtp.has_extn('starttls'):
+                        smtp.starttls(context=ssl.create_default_context())
+                        smtp.ehlo()
+                if username and password:
+                    smtp.login(username, password)
+            except BaseException:
+                smtp.close()
+                raise
+            with self._lock:
+                self.smtp_connections += 1
+            self._smtp, self._smtp_key = smtp, key
+        return self._smtp
+
+    def _build_message(self, recipient, subject, body):
+        message = EmailMessage()
+        message['From'] = EMAIL_FROM or self._smtp_key[2]
+        message['To'] = recipient
+        message['Subject'] = subject
+        message.set_content(body)
+        return message
+
+    # 发送一封邮件，返回 None（成功）或 (是否临时错误, 错误信息, 是否连接失败)；连接断开时重新连接一次
+    def _send_one(self, recipient, subject, body):
+        for retry in (False, True):
+            try:
+                smtp = self._get_smtp()
+            except EmailConfigError as e:
+                return True, str(e), True
+            except (smtplib.SMTPException, OSError) as e:
+                self._close_smtp()
+                return _classify(e) + (True,)
+            try:
+                smtp.send_message(self._build_message(recipient, subject, body))
+                self._smtp_used_at = time.monotonic()
+                return None
+            except smtplib.SMTPServerDisconnected as e:
+                # 连接被服务器关闭（例如空闲超时），丢弃连接后重试一次
+                self._close_smtp()
+                if retry:
+                    return _classify(e) + (False,)
+            except smtplib.SMTPException as e:
+                # SMTPException 是 OSError 的子类，必须在 OSError 之前处理
+                return _classify(e) + (False,)
+            except OSError as e:
+                self._close_smtp()
+                if retry:
+                    return _classify(e) + (False,)
+
+    def _send_batch(self, conn, rows, claimed_at):
+        updates = []
+        connect_error = None
+        lease_until = claimed_at + EMAIL_LEASE
+        for index, (message_id, recipient, subject, body, attempts) in enumerate(rows):
+            if connect_error is None and time.time() > lease_until - LEASE_MARGIN:
+                lease_until = self._extend_lease(conn, rows[index:], claimed_at)
+            # 无法连接或登录时本批剩余的邮件不再尝试，按同样的错误处理
+            error = connect_error or self._send_one(recipient, subject, body)
+            if error is None:
+                updates.append(('sent', time.time(), None, None, message_id))
+                continue
+            transient, text, connect_failed = error
+            if connect_failed:
+                connect_error = error
+            self.last_error = text
+            if transient and attempts < self.max_attempts:
+                delay = min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1))
+                updates.append(('pending', None, time.time() + delay, text, message_id))
+            else:
+                updates.append(('failed', None, None, text, message_id))
+        conn.executemany('''
+            UPDATE email_queue SET status =?, sent_at =?, next_attempt_at = COALESCE(?, next_attempt_at), last_error =?
+            WHERE id =?
+        ''', updates)
+        conn.commit()
+        with self._lock:
+            for status, _, _, _, _ in updates:
+                if status == 'sent':
+                    self.sent += 1
+                elif status == 'failed':
+                    self.failed += 1
+                else:
+                    self.retried += 1
+
+    def _purge(self, conn, now):
+        if now - self._purged_at < 3600:
+            return
+        self._purged_at = now
+        conn.execute("DELETE FROM email_queue WHERE status = 'sent' AND sent_at < ?",
+                     (now - EMAIL_RETENTION_DAYS * 86400,))
+        conn.commit()
+
+    def _run(self):
+        while True:
+            rate_limited = False
+            try:
+                with get_db(self.path) as conn:
+                    now = time.time()
+                    rows, rate_limited = self._claim(conn, now)
+                    if rows:
+                        self._send_batch(conn, rows, now)
+                        continue
+                    if rate_limited:
+                        with self._lock:
+                            self.rate_limited += 1
+                    self._purge(conn, now)
+                    wake_at = self._next_wakeup(conn, now, rate_limited)
+            except Exception as e:
+                self.last_error = f'{type(e).__name__}: {e}'
+                wake_at = time.time() + EMAIL_POLL_INTERVAL
+            if self._smtp is not None and time.monotonic() - self._smtp_used_at > EMAIL_IDLE_TIMEOUT:
+                self._close_smtp()
+            timeout = max(0.0, min(wake_at - time.time(), EMAIL_IDLE_TIMEOUT))
+            # 限速期间新加入的邮件不需要立即处理
+            if rate_limited:
+                time.sleep(timeout)
+            else:
+                self._wakeup.wait(timeout)
+                self._wakeup.clear()
+
+    def stats(self):
+        with get_db(self.path) as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM email_queue GROUP BY status').fetchall())
+        with self._lock:
+            return {
+                "enabled": EMAIL_QUEUE,
+                "queue": {status: counts.get(status, 0) for status in ('pending', 'sent', 'failed')},
+                "enqueued": self.enqueued,
+                "sent": self.sent,
+                "retried": self.retried,
+                "failed": self.failed,
+                "smtp_connections": self.smtp_connections,
+                "rate_limited": self.rate_limited,
+                "lease_extensions": self.lease_extensions,
+                "last_error": self.last_error,
+            }
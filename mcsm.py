@@ -0,0 +1,316 @@
+import http.client
+import json
+import os
+import queue
+import re
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+# MCSManager 同步：玩家添加/删除、权限组修改后，把对应的控制台命令（白名单、权限组）推送到 MCSM 实例。
+# 请求中只把命令放进内存队列，由后台线程合并后发送：同一玩家的同类命令只保留最新的一条，
+# 发送失败按指数退避重试。HTTP 连接保持 keep-alive 并在发送线程之间复用。
+# 设置环境变量 MCSM_SYNC=1 启用；MCSM 地址、守护进程 ID、实例 ID 和 API 密钥从设置中读取。
+MCSM_SYNC = os.environ.get('MCSM_SYNC', '0') == '1'
+# 收到第一条命令后等待多久再发送（秒），期间到达的命令合并到同一批
+MCSM_FLUSH_INTERVAL = float(os.environ.get('MCSM_FLUSH_INTERVAL', '0.2'))
+# 并发发送的线程数，也是保留的空闲连接数
+MCSM_POOL_SIZE = int(os.environ.get('MCSM_POOL_SIZE', '4'))
+MCSM_TIMEOUT = float(os.environ.get('MCSM_TIMEOUT', '10'))
+# 每条命令最多尝试的次数；第 n 次失败后等待 BASE_BACKOFF * 2^(n-1) 秒，最长 MAX_BACKOFF
+MCSM_MAX_ATTEMPTS = int(os.environ.get('MCSM_MAX_ATTEMPTS', '6'))
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+# 控制台命令模板；权限组名转换为小写并用下划线代替空格，例如 Graduate Engineer -> graduate_engineer
+WHITELIST_ADD_COMMAND = os.environ.get('MCSM_WHITELIST_ADD_COMMAND', 'whitelist add {game_id}')
+WHITELIST_REMOVE_COMMAND = os.environ.get('MCSM_WHITELIST_REMOVE_COMMAND', 'whitelist remove {game_id}')
+GROUP_COMMAND = os.environ.get('MCSM_GROUP_COMMAND', 'lp user {game_id} parent set {group}')
+
+# MCSM 实例状态码
+INSTANCE_STATES = {-1: 'busy', 0: 'stopped', 1: 'stopping', 2: 'starting', 3: 'running'}
+
+# 只为这样的游戏 ID 生成命令，避免空格、换行等字符被拼进控制台命令
+_GAME_ID_RE = re.compile(r'^[A-Za-z0-9_.\-]{1,32}$')
+
+
+class MCSMError(Exception):
+    pass
+
+
+def group_name(permission_group):
+    return permission_group.strip().lower().replace(' ', '_')
+
+
+# MCSM 实例控制台接口的客户端，连接在调用之间复用
+class MCSMClient:
+    def __init__(self, address, apikey, daemon_id, instance_id, pool_size=MCSM_POOL_SIZE, timeout=MCSM_TIMEOUT):
+        parts = urllib.parse.urlsplit(address if '://' in address else 'http://' + address)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise MCSMError(f'无效的 MCSM 地址: {address}')
+        self.key = (address, apikey, daemon_id, instance_id)
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip('/')
+        self.apikey = apikey
+        self.daemon_id = daemon_id
+        self.instance_id = instance_id
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def _connect(self):
+        with self._lock:
+            self.connections += 1
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _release(self, conn):
+        if self._idle.qsize() < self.pool_size:
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    # 调用 MCSM 的实例接口，返回响应的 data 字段；失败时抛出 MCSMError
+    def _get(self, endpoint, params):
+        # MCSM 9 使用 remote_uuid，MCSM 10 使用 daemonId，两个参数都带上
+        query = urllib.parse.urlencode({
+            'uuid': self.instance_id, 'daemonId': self.daemon_id, 'remote_uuid': self.daemon_id,
+            'apikey': self.apikey, **params,
+        })
+        path = f'{self.base_path}{endpoint}?{query}'
+        headers = {'X-Requested-With': 'XMLHttpRequest', 'Accept': 'application/json'}
+        with self._lock:
+            self.requests += 1
+        while True:
+            try:
+                conn, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                conn, reused = self._connect(), False
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                if reused:
+                    # 服务器可能已经关闭了空闲连接，换一个连接重试
+                    continue
+                raise MCSMError(f'请求 MCSM 失败: {e}')
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            break
+
+        if response.status != 200:
+            raise MCSMError(f'MCSM 返回 HTTP {response.status}')
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            raise MCSMError('MCSM 返回的不是 JSON')
+        if payload.get('status') != 200:
+            raise MCSMError(f'MCSM 返回错误: {payload.get("data")}')
+        return payload.get('data')
+
+    # 在实例控制台执行一条命令
+    def command(self, command):
+        return self._get('/api/protected_instance/command', {'command': command})
+
+    # 实例的运行状态和资源占用
+    def instance_info(self):
+        data = self._get('/api/instance', {})
+        if not isinstance(data, dict):
+            raise MCSMError('MCSM 返回的实例信息无效')
+        process = data.get('processInfo') or {}
+        info = data.get('info') or {}
+        return {
+            "status": INSTANCE_STATES.get(data.get('status'), 'unknown'),
+            "cpu": process.get('cpu'),
+            "memory": process.get('memory'),
+            "current_players": info.get('currentPlayers'),
+            "max_players": info.get('maxPlayers'),
+        }
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def stats(self):
+        return {"requests": self.requests, "connections": self.connections, "idle": self._idle.qsize()}
+
+
+# 后台命令队列。pending 以 (类型, 游戏 ID) 为键，新命令覆盖尚未发送的旧命令
+class MCSMSync:
+    def __init__(self, settings_cache, flush_interval=MCSM_FLUSH_INTERVAL, workers=MCSM_POOL_SIZE,
+                 max_attempts=MCSM_MAX_ATTEMPTS, base_backoff=BASE_BACKOFF, max_backoff=MAX_BACKOFF):
+        self.settings_cache = settings_cache
+        self.flush_interval = flush_interval
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._reset()
+        # fork 之后子进程没有发送线程，重新开始
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+        # 统计
+        self.enqueued = 0
+        self.deduplicated = 0
+        self.invalid = 0
+        self.batches = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.unconfigured = 0
+        self.last_error = None
+
+    def _reset(self):
+        # {key: [命令, 已尝试次数, 最早发送时间]}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._executor = None
+        self._client = None
+
+    def _enqueue(self, kind, game_id, command):
+        with self._lock:
+            if (kind, game_id) in self._pending:
+                self.deduplicated += 1
+            self._pending[(kind, game_id)] = [command, 0, 0.0]
+            self.enqueued += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='mcsm-sync', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def _valid(self, game_id):
+        if isinstance(game_id, str) and _GAME_ID_RE.match(game_id):
+            return True
+        with self._lock:
+            self.invalid += 1
+        return False
+
+    # 以下方法在写入数据库成功后调用，只修改内存队列，不会阻塞请求
+    def player_added(self, game_id, permission_group=None):
+        if not MCSM_SYNC or not self._valid(game_id):
+            return
+        self._enqueue('whitelist', game_id, WHITELIST_ADD_COMMAND.format(game_id=game_id))
+        if permission_group:
+            self.permission_group_changed(game_id, permission_group)
+
+    def player_removed(self, game_id):
+        if not MCSM_SYNC or not self._valid(game_id):
+            return
+        with self._lock:
+            # 玩家已删除，尚未发送的权限组命令不再需要
+            if self._pending.pop(('group', game_id), None) is not None:
+                self.deduplicated += 1
+        self._enqueue('whitelist', game_id, WHITELIST_REMOVE_COMMAND.format(game_id=game_id))
+
+    def permission_group_changed(self, game_id, permission_group):
+        if not MCSM_SYNC or not self._valid(game_id):
+            return
+        self._enqueue('group', game_id, GROUP_COMMAND.format(game_id=game_id, group=group_name(permission_group)))
+
+    # 设置修改后重新建立客户端
+    def _get_client(self):
+        settings = self.settings_cache.get()
+        if settings is None or not (settings.mcsm_api_address and settings.mcsm_apikey and settings.mcsm_instance_id):
+            return None
+        key = (settings.mcsm_api_address, settings.mcsm_apikey, settings.mcsm_daemon_id, settings.mcsm_instance_id)
+        if self._client is None or self._client.key != key:
+            if self._client is not None:
+                self._client.close()
+            self._client = MCSMClient(*key, pool_size=self.workers)
+        return self._client
+
+    def _take_due(self, now):
+        with self._lock:
+            due = [(key, entry) for key, entry in self._pending.items() if entry[2] <= now]
+            for key, _ in due:
+                del self._pending[key]
+            next_due = min((entry[2] for entry in self._pending.values()), default=None)
+        return due, next_due
+
+    def _run(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='mcsm-send')
+        next_due = None
+        while True:
+            timeout = None if next_due is None else max(0.0, next_due - time.monotonic())
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+            # 等待一小段时间，让同一批操作产生的命令合并发送
+            time.sleep(self.flush_interval)
+            due, next_due = self._take_due(time.monotonic())
+            if due:
+                self._flush(due)
+                with self._lock:
+                    next_due = min((entry[2] for entry in self._pending.values()), default=None)
+
+    def _flush(self, due):
+        try:
+            client = self._get_client()
+        except MCSMError as e:
+            client = None
+            self.last_error = str(e)
+        if client is None:
+            with self._lock:
+                self.unconfigured += len(due)
+            return
+
+        # 先等所有命令发送完成再加锁：请求线程入队时需要同一把锁，不能等待 MCSM 的响应
+        results = list(self._executor.map(lambda item: self._send(client, item[1][0]), due))
+        now = time.monotonic()
+        with self._lock:
+            self.batches += 1
+            for (key, entry), error in zip(due, results):
+                if error is None:
+                    self.sent += 1
+                    continue
+                self.last_error = error
+                entry[1] += 1
+                if entry[1] >= self.max_attempts:
+                    self.failed += 1
+                elif key not in self._pending:
+                    # 重试期间如果有同一玩家的新命令，以新命令为准
+                    entry[2] = now + min(self.max_backoff, self.base_backoff * 2 ** (entry[1] - 1))
+                    self._pending[key] = entry
+                    self.retried += 1
+
+    @staticmethod
+    def _send(client, command):
+        try:
+            client.command(command)
+        except MCSMError as e:
+            return str(e)
+        return None
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "enabled": MCSM_SYNC,
+                "pending": len(self._pending),
+                "enqueued": self.enqueued,
+                "deduplicated": self.deduplicated,
+                "invalid": self.invalid,
+                "batches": self.batches,
+                "sent": self.sent,
+                "retried": self.retried,
+                "failed": self.failed,
+                "unconfigured": self.unconfigured,
+                "last_error": self.last_error,
+            }
+        if self._client is not None:
+            stats["client"] = self._client.stats()
+        return stats
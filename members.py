@@ -0,0 +1,74 @@
+# 成员视图：players.db 中的玩家与 users.db 中的面板账号按邮箱关联。
+# users.db 以 users 为名 ATTACH 到 players.db 的连接上，一条 SQL 完成 JOIN、过滤和 keyset 分页；
+# 两边都有 lower(trim(email)) 表达式索引，关联条件必须写成同样的表达式才能走索引。
+# users 上的索引是唯一索引，每个玩家最多关联一个账号，因此 keyset 分页可以只用 game_id 作为键。
+USERS_SCHEMA = 'users'
+
+MEMBER_SORT_FIELDS = ('game_id', 'join_date', 'leave_date', 'permission_group')
+
+# 排序/游标用到的列只存在于 players 表，不加表名前缀也没有歧义，行字典的键与列名一致
+_MEMBER_COLUMNS = '''
+    SELECT p.game_id, p.qq, p.email, p.permission_group, p.join_date, p.leave_date,
+           u.id, u.username, u.is_active
+'''
+_EMAIL_MATCH = "lower(trim(u.email)) = lower(trim(p.email)) AND trim(p.email) != ''"
+# 默认按 players 的排序索引扫描，每个玩家用 idx_users_email_norm 查找账号，取到一页即可停止
+MEMBER_SELECT = f'{_MEMBER_COLUMNS} FROM players AS p LEFT JOIN {USERS_SCHEMA}.users AS u ON {_EMAIL_MATCH}'
+# banned=true 时被封禁的账号很少，从 users 表出发（CROSS JOIN 固定连接顺序），
+# 用 idx_players_email_norm 查找玩家，再对少量结果排序；否则要扫描大量玩家才能凑够一页
+MEMBER_BANNED_SELECT = f'{_MEMBER_COLUMNS} FROM {USERS_SCHEMA}.users AS u CROSS JOIN players AS p ON {_EMAIL_MATCH}'
+
+_BOOLEAN_ARGS = {'true': True, '1': True, 'false': False, '0': False}
+
+
+def members_attach(users_path):
+    return ((USERS_SCHEMA, users_path),)
+
+
+def _parse_bool(args, name):
+    value = args.get(name)
+    if value is None:
+        return None
+    if value not in _BOOLEAN_ARGS:
+        raise ValueError(f'无效的 {name}')
+    return _BOOLEAN_ARGS[value]
+
+
+# 解析 /members 的过滤参数，返回 (select_sql, conditions, params)：
+#   permission_group=<组名>  has_account=true|false  banned=true|false（有账号且被封禁 / 有账号且未封禁）
+def parse_member_filters(args, permission_groups):
+    select_sql = MEMBER_SELECT
+    conditions = []
+    params = []
+    permission_group = args.get('permission_group')
+    if permission_group is not None:
+        if permission_group not in permission_groups:
+            raise ValueError('无效的权限组')
+        conditions.append('p.permission_group = ?')
+        params.append(permission_group)
+    has_account = _parse_bool(args, 'has_account')
+    if has_account is not None:
+        conditions.append('u.id IS NOT NULL' if has_account else 'u.id IS NULL')
+    banned = _parse_bool(args, 'banned')
+    if banned is not None:
+        conditions.append('u.is_active = ?')
+        params.append(0 if banned else 1)
+        if banned:
+            select_sql = MEMBER_BANNED_SELECT
+    return select_sql, conditions, params
+
+
+def member_row_to_dict(row):
+    return {
+        "game_id": row[0],
+        "qq": row[1],
+        "email": row[2],
+        "permission_group": row[3],
+        "join_date": row[4],
+        "leave_date": row[5],
+        "account": None if row[6] is None else {
+            "id": row[6],
+            "username": row[7],
+            "is_banned": not row[8],
+        },
+    }
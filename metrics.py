@@ -0,0 +1,267 @@
+import bisect
+import os
+import sqlite3
+import threading
+import time
+
+from flask import Response, request
+
+import db
+
+# 监控开关：未启用时不注册任何钩子，连接也不做包装，没有额外开销
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+# 超过该耗时（毫秒）的请求写入慢请求日志，0 表示关闭
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '0'))
+
+# 直方图分桶（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 当前线程正在处理的路由，用于给 SQL 指标打标签
+_current = threading.local()
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = [(labels, list(s[0]), s[1], s[2]) for labels, s in self._series.items()]
+        for labels, counts, count, total in sorted(items):
+            base = _format_labels(self.label_names, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names, labels, le=bound)} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.label_names, labels, le="+Inf")} {count}')
+            lines.append(f'{self.name}_sum{base} {total}')
+            lines.append(f'{self.name}_count{base} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f'{self.name}{_format_labels(self.label_names, labels)} {value}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, le=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+request_duration = Histogram('http_request_duration_seconds', 'Request latency by route', ('method', 'route'))
+requests_total = Counter('http_requests_total', 'Requests by route and status', ('method', 'route', 'status'))
+slow_requests_total = Counter('http_slow_requests_total', 'Requests slower than SLOW_REQUEST_MS', ('method', 'route'))
+statement_duration = Histogram('sqlite_statement_duration_seconds', 'SQL execution time by route',
+                               ('route', 'database', 'kind'))
+statements_total = Counter('sqlite_statements_total',
+                           'Statements reported by the sqlite3 trace callback, including trigger bodies',
+                           ('route', 'database'))
+rows_returned_total = Counter('sqlite_rows_returned_total', 'Rows fetched by route', ('route', 'database'))
+lock_errors_total = Counter('sqlite_lock_errors_total', 'Statements that failed with database is locked/busy',
+                            ('route', 'database'))
+
+ALL_METRICS = (request_duration, requests_total, slow_requests_total, statement_duration, statements_total,
+               rows_returned_total, lock_errors_total)
+
+
+def current_route():
+    return getattr(_current, 'route', None) or 'none'
+
+
+
+_statement_kinds = {}
+
+
+# 语句类型（SELECT/INSERT/...），按 SQL 文本缓存，避免每次重新解析
+def _statement_kind(sql):
+    kind = _statement_kinds.get(sql)
+    if kind is None:
+        word = sql.lstrip().split(None, 1)
+        kind = word[0].upper() if word else ''
+        if len(_statement_kinds) < 4096:
+            _statement_kinds[sql] = kind
+    return kind
+
+
+_cursor_execute = sqlite3.Cursor.execute
+_cursor_executemany = sqlite3.Cursor.executemany
+_cursor_fetchone = sqlite3.Cursor.fetchone
+_cursor_fetchmany = sqlite3.Cursor.fetchmany
+_cursor_fetchall = sqlite3.Cursor.fetchall
+
+
+# 带计时的游标：记录执行时间、返回的行数和锁冲突
+class InstrumentedCursor(sqlite3.Cursor):
+    def _timed(self, method, sql, args):
+        start = time.perf_counter()
+        try:
+            return method(self, sql, *args)
+        except sqlite3.OperationalError as e:
+            message = str(e)
+            if 'locked' in message or 'busy' in message:
+                lock_errors_total.inc((current_route(), self.connection.metrics_database))
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            statement_duration.observe((current_route(), self.connection.metrics_database, _statement_kind(sql)),
+                                       elapsed)
+
+    def execute(self, sql, *args):
+        return self._timed(_cursor_execute, sql, args)
+
+    def executemany(self, sql, *args):
+        return self._timed(_cursor_executemany, sql, args)
+
+    def _count(self, rows):
+        rows_returned_total.inc((current_route(), self.connection.metrics_database), rows)
+
+    def fetchone(self):
+        row = _cursor_fetchone(self)
+        if row is not None:
+            self._count(1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = _cursor_fetchmany(self, *args, **kwargs)
+        if rows:
+            self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = _cursor_fetchall(self)
+        if rows:
+            self._count(len(rows))
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        self.metrics_database = os.path.basename(str(database))
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+
+def _on_connect(conn, path):
+    database = conn.metrics_database
+
+    def trace(statement):
+        statements_total.inc((current_route(), database))
+
+    conn.set_trace_callback(trace)
+
+
+def _observe_request(app, method, route, status, elapsed):
+    request_duration.observe((method, route), elapsed)
+    requests_total.inc((method, route, str(status)))
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        slow_requests_total.inc((method, route))
+        app.logger.warning('Slow request: %s %s %.1fms (%s)', method, request.full_path, elapsed * 1000, status)
+
+
+# 包装 full_dispatch_request 计时（包括 after_request 处理），
+# 比注册 before/after_request 钩子少了 Flask 每个钩子的调度开销
+def _instrument_dispatch(app):
+    full_dispatch_request = app.full_dispatch_request
+
+    def instrumented_full_dispatch_request():
+        start = time.perf_counter()
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        _current.route = route
+        status = 500
+        try:
+            response = full_dispatch_request()
+            status = response.status_code
+            return response
+        finally:
+            _observe_request(app, request.method, route, status, time.perf_counter() - start)
+            _current.route = None
+
+    app.full_dispatch_request = instrumented_full_dispatch_request
+
+
+def _pool_gauges():
+    lines = []
+    for name, key in (('db_pool_connections', 'created'), ('db_pool_in_use', 'in_use'),
+                      ('db_pool_waits_total', 'waits'), ('db_pool_timeouts_total', 'timeouts')):
+        metric_type = 'counter' if name.endswith('_total') else 'gauge'
+        lines.append(f'# TYPE {name} {metric_type}')
+        for stats in db.pool_stats():
+            # 同一个数据库可能有多个连接池（例如 /members 在 player.db 上 ATTACH users.db），用 attach 区分
+            labels = (f'database="{_escape(os.path.basename(stats["path"]))}",'
+                      f'attach="{_escape(",".join(stats["attach"]))}"')
+            lines.append(f'{name}{{{labels}}} {stats[key]}')
+    return lines
+
+
+def render_metrics():
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    lines.extend(_pool_gauges())
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+# 在 app 上启用监控：请求计时、SQL 计时和 /metrics 接口
+def init_metrics(app, enabled=None):
+    if enabled is None:
+        enabled = METRICS_ENABLED
+    if not enabled:
+        return False
+    db.connection_factory = InstrumentedConnection
+    if _on_connect not in db.connect_hooks:
+        db.connect_hooks.append(_on_connect)
+    _instrument_dispatch(app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view, methods=['GET'])
+    return True
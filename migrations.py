@@ -0,0 +1,444 @@
+import logging
+import os
+import sqlite3
+
+from dates import normalize_date
+from player_stats import populate_player_stats
+from search import create_players_fts
+from password_hasher import DEFAULT_ROUNDS, hash_cost
+
+logger = logging.getLogger(__name__)
+
+# 数据库结构迁移：每个数据库的版本号保存在 PRAGMA user_version 中，
+# 启动时按顺序执行版本号更大的迁移。每个迁移是一条 SQL 或一个接收连接的函数。
+
+
+def _column_names(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+# 被替换为占位地址的原始邮箱保存在 user_email_conflicts 中，管理员核对后可以手动改回
+def _record_email_conflicts(conn, rows):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_email_conflicts (
+            user_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            email TEXT NOT NULL,
+            replaced_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+    ''')
+    conn.executemany('INSERT INTO user_email_conflicts (user_id, username, email) VALUES (?, ?, ?)', rows)
+
+
+# 旧版 app1.py 创建的 users 表以 username 为主键、没有 id 列，转换为统一结构
+def _unify_legacy_users_table(conn):
+    if 'id' in _column_names(conn, 'users'):
+        return
+    conn.execute('''
+        CREATE TABLE users_unified (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            is_active INTEGER NOT NULL DEFAULT 1
+        )
+    ''')
+    # 旧表的 email 允许为空，也没有唯一约束。空邮箱和重复邮箱（忽略大小写和首尾空格，按 rowid 保留第一个）
+    # 都用 username 补一个不会重复的占位地址，重复的原始邮箱记录在 user_email_conflicts 中，由管理员事后修正
+    conn.execute('''
+        CREATE TEMP TABLE users_legacy AS
+        SELECT username, email, password, is_active,
+               ROW_NUMBER() OVER (PARTITION BY lower(trim(email)) ORDER BY rowid) AS email_rank
+        FROM users
+    ''')
+    for username, email in conn.execute(
+            "SELECT username, email FROM users_legacy WHERE email_rank > 1 AND trim(COALESCE(email, '')) != ''"):
+        logger.warning('Legacy user %r shares email %r with an earlier user; replaced with %s@localhost',
+                       username, email, username)
+    conn.execute('''
+        INSERT INTO users_unified (username, email, password, is_active)
+        SELECT username,
+               CASE WHEN email_rank = 1 AND trim(COALESCE(email, '')) != '' THEN email
+                    ELSE username || '@localhost' END,
+               COALESCE(password, ''),
+               COALESCE(is_active, 1)
+        FROM users_legacy
+    ''')
+    _record_email_conflicts(conn, conn.execute('''
+        SELECT u.id, l.username, l.email FROM temp.users_legacy l JOIN users_unified u ON u.username = l.username
+        WHERE l.email_rank > 1 AND trim(COALESCE(l.email, '')) != ''
+    ''').fetchall())
+    conn.execute('DROP TABLE temp.users_legacy')
+    conn.execute('DROP TABLE users')
+    conn.execute('ALTER TABLE users_unified RENAME TO users')
+
+
+# 邮箱忽略大小写和首尾空格后唯一：/members 按 lower(trim(email)) 关联账号，每个玩家最多对应一个账号，
+# 分页游标以 game_id 为键才不会漏行。已有的重复邮箱按 id 保留第一个，其余替换为占位地址，
+# 原始邮箱保存在 user_email_conflicts 中
+def _unique_user_email(conn):
+    duplicates = conn.execute('''
+        SELECT id, username, email FROM (
+            SELECT id, username, email,
+                   ROW_NUMBER() OVER (PARTITION BY lower(trim(email)) ORDER BY id) AS email_rank
+            FROM users
+        ) WHERE email_rank > 1
+    ''').fetchall()
+    for user_id, username, email in duplicates:
+        logger.warning('User %r shares email %r with an earlier user; replaced with %s@localhost',
+                       username, email, username)
+        conn.execute("UPDATE users SET email = username || '@localhost' WHERE id = ?", (user_id,))
+    _record_email_conflicts(conn, duplicates)
+    conn.execute('DROP INDEX IF EXISTS idx_users_email_norm')
+    conn.execute('CREATE UNIQUE INDEX idx_users_email_norm ON users (lower(trim(email)))')
+
+
+# app.py 和 createadmin.py 以前保存明文密码，app1.py 保存 bcrypt 哈希；统一为 bcrypt。
+# 每个明文密码需要一次 bcrypt 计算（默认 cost 下约 0.2 秒），只在迁移时执行一次。
+# 空密码保留为空，无法通过任何密码校验
+def _hash_plaintext_passwords(conn):
+    import bcrypt
+    rounds = int(os.environ.get('BCRYPT_ROUNDS', DEFAULT_ROUNDS))
+    rows = conn.execute("SELECT id, password FROM users WHERE password IS NOT NULL AND password != ''").fetchall()
+    for user_id, password in rows:
+        if hash_cost(password) is not None:
+            continue
+        if isinstance(password, str):
+            password = password.encode('utf-8')
+        conn.execute('UPDATE users SET password = ? WHERE id = ?',
+                     (sqlite3.Binary(bcrypt.hashpw(password, bcrypt.gensalt(rounds))), user_id))
+
+
+def _add_users_role(conn):
+    if 'role' not in _column_names(conn, 'users'):
+        conn.execute("ALTER TABLE users ADD COLUMN role TEXT NOT NULL DEFAULT 'user'")
+    conn.execute("UPDATE users SET role = 'admin' WHERE id = 0 OR username = 'admin'")
+
+
+# 每张表一个变更计数器，由触发器在增删改时加一，用于生成 ETag
+def _add_table_version(table):
+    def step(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS table_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.execute('INSERT OR IGNORE INTO table_versions (name, version) VALUES (?, 0)', (table,))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+                END
+            ''')
+    return step
+
+
+# 变更日志保留的行数，超出部分由触发器每 1000 条清理一次
+CHANGE_LOG_RETENTION = 100000
+
+
+# 变更日志：触发器把每次增删改的主键写入 log_table，seq 单调递增（AUTOINCREMENT 不会复用）。
+# change_log_state.compacted_seq 记录已清理到的位置，客户端的 since 小于它时需要全量同步。
+def _add_change_log(table, key_column, log_table):
+    def step(conn):
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {log_table} (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                key NOT NULL,
+                op TEXT NOT NULL,
+                changed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS change_log_state (
+                name TEXT PRIMARY KEY,
+                compacted_seq INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.execute('INSERT OR IGNORE INTO change_log_state (name, compacted_seq) VALUES (?, 0)', (log_table,))
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_changes_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {log_table} (key, op) VALUES (new.{key_column}, 'insert');
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_changes_update AFTER UPDATE ON {table} BEGIN
+                INSERT INTO {log_table} (key, op) VALUES (new.{key_column}, 'update');
+                INSERT INTO {log_table} (key, op) SELECT old.{key_column}, 'delete'
+                    WHERE old.{key_column} IS NOT new.{key_column};
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_changes_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {log_table} (key, op) VALUES (old.{key_column}, 'delete');
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {log_table}_compact AFTER INSERT ON {log_table}
+            WHEN new.seq % 1000 = 0 AND new.seq > {CHANGE_LOG_RETENTION} BEGIN
+                DELETE FROM {log_table} WHERE seq <= new.seq - {CHANGE_LOG_RETENTION};
+                UPDATE change_log_state SET compacted_seq = MAX(compacted_seq, new.seq - {CHANGE_LOG_RETENTION})
+                    WHERE name = '{log_table}';
+            END
+        ''')
+    return step
+
+
+# 统计汇总表：各权限组人数（没有权限组记为 ''），按日期的加入/离开人数。
+# 触发器在增删改时对旧值减一、新值加一，计数为 0 的行保留（读取时过滤），避免反复删除插入。
+def _add_player_stats(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS player_stats_groups (
+            permission_group TEXT PRIMARY KEY,
+            members INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS player_stats_dates (
+            kind TEXT NOT NULL,
+            day TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (kind, day)
+        ) WITHOUT ROWID
+    ''')
+
+    def add(prefix, sign):
+        return f'''
+            INSERT INTO player_stats_groups (permission_group, members)
+                VALUES (COALESCE({prefix}.permission_group, ''), {sign}1)
+                ON CONFLICT (permission_group) DO UPDATE SET members = members {sign} 1;
+            INSERT INTO player_stats_dates (kind, day, count)
+                SELECT 'join', {prefix}.join_date, {sign}1 WHERE {prefix}.join_date IS NOT NULL AND {prefix}.join_date != ''
+                ON CONFLICT (kind, day) DO UPDATE SET count = count {sign} 1;
+            INSERT INTO player_stats_dates (kind, day, count)
+                SELECT 'leave', {prefix}.leave_date, {sign}1 WHERE {prefix}.leave_date IS NOT NULL AND {prefix}.leave_date != ''
+                ON CONFLICT (kind, day) DO UPDATE SET count = count {sign} 1;
+        '''
+
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS players_stats_insert AFTER INSERT ON players BEGIN
+            {add('new', '+')}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS players_stats_delete AFTER DELETE ON players BEGIN
+            {add('old', '-')}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS players_stats_update AFTER UPDATE OF permission_group, join_date, leave_date ON players
+        WHEN old.permission_group IS NOT new.permission_group OR old.join_date IS NOT new.join_date
+            OR old.leave_date IS NOT new.leave_date
+        BEGIN
+            {add('old', '-')}
+            {add('new', '+')}
+        END
+    ''')
+    populate_player_stats(conn)
+
+
+# 把已有的 join_date / leave_date 转换为 YYYY-MM-DD。无法识别的值置为 NULL，
+# 原值记录在 player_date_backfill_errors 中，由管理员手动修正
+def _normalize_player_dates(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS player_date_backfill_errors (
+            game_id TEXT NOT NULL,
+            field TEXT NOT NULL,
+            value TEXT
+        )
+    ''')
+    rows = conn.execute('SELECT game_id, join_date, leave_date FROM players '
+                        'WHERE join_date IS NOT NULL OR leave_date IS NOT NULL').fetchall()
+    updates = []
+    errors = []
+    for game_id, join_date, leave_date in rows:
+        normalized = []
+        for field, value in (('join_date', join_date), ('leave_date', leave_date)):
+            try:
+                normalized.append(normalize_date(value))
+            except ValueError:
+                errors.append((game_id, field, str(value)))
+                normalized.append(None)
+        if normalized != [join_date, leave_date]:
+            updates.append((*normalized, game_id))
+    conn.executemany('UPDATE players SET join_date = ?, leave_date = ? WHERE game_id = ?', updates)
+    conn.executemany('INSERT INTO player_date_backfill_errors (game_id, field, value) VALUES (?, ?, ?)', errors)
+
+    # 之后写入的日期必须已经是规范格式（接口写入前会先调用 normalize_date）
+    condition = '''
+        (new.join_date IS NOT NULL AND new.join_date IS NOT date(new.join_date))
+        OR (new.leave_date IS NOT NULL AND new.leave_date IS NOT date(new.leave_date))
+    '''
+    for event in ('INSERT', 'UPDATE OF join_date, leave_date'):
+        name = event.split()[0].lower()
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS players_dates_check_{name} BEFORE {event} ON players
+            WHEN {condition} BEGIN
+                SELECT RAISE(ABORT, 'join_date and leave_date must be YYYY-MM-DD');
+            END
+        ''')
+
+
+# 邮件发送队列（mail_queue.py）。待发送的邮件 status 为 pending，按 next_attempt_at 领取；
+# claimed_at 记录最近一次领取时间，用于限速
+def _add_email_queue(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS email_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            claimed_at REAL,
+            created_at REAL NOT NULL,
+            sent_at REAL,
+            last_error TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_email_queue_due ON email_queue (next_attempt_at) WHERE status = 'pending'")
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_email_queue_claimed_at ON email_queue (claimed_at)')
+
+
+# 服务器登记表（server_registry.py），每行一个 Minecraft 服务器地址和对应的 MCSM 实例；
+# 已保存的设置作为第一个服务器导入
+def _add_server_registry(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS servers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            address TEXT NOT NULL DEFAULT '',
+            mcsm_api_address TEXT NOT NULL DEFAULT '',
+            mcsm_daemon_id TEXT NOT NULL DEFAULT '',
+            mcsm_instance_id TEXT NOT NULL DEFAULT '',
+            mcsm_apikey TEXT NOT NULL DEFAULT '',
+            enabled INTEGER NOT NULL DEFAULT 1
+        )
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO servers (name, address, mcsm_api_address, mcsm_daemon_id, mcsm_instance_id, mcsm_apikey)
+        SELECT 'default', minecraftServerIP, mcsmApiAddress, mcsmDaemonId, mcsmInstanceId, mcsmApikey
+        FROM settings WHERE minecraftServerIP != '' OR mcsmInstanceId != ''
+        ORDER BY id LIMIT 1
+    ''')
+
+
+# 事件推送的发件箱（events.py，保存在 EVENTS_DATABASE 中）：各 worker 进程写入，运行事件服务的进程按 seq 读取并分发
+def _add_event_outbox(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS event_outbox (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            data TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+
+
+USERS_MIGRATIONS = [
+    (1, '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            is_active INTEGER NOT NULL DEFAULT 1
+        )
+    '''),
+    (2, _unify_legacy_users_table),
+    (3, _add_table_version('users')),
+    (4, _add_change_log('users', 'id', 'user_changes')),
+    # 访问令牌中携带的角色；createadmin.py 创建的 id 0 和 app1.py 创建的 admin 账号为管理员
+    (5, _add_users_role),
+    # /members 按规范化的邮箱关联 players 表
+    (6, 'CREATE INDEX IF NOT EXISTS idx_users_email_norm ON users (lower(trim(email)))'),
+    (7, _hash_plaintext_passwords),
+    (8, _unique_user_email),
+]
+
+SETTINGS_MIGRATIONS = [
+    (1, '''
+        CREATE TABLE IF NOT EXISTS settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            minecraftServerIP TEXT NOT NULL,
+            mcsmApiAddress TEXT NOT NULL,
+            emailServiceHost TEXT NOT NULL,
+            mcsmDaemonId TEXT NOT NULL,
+            emailServicePort TEXT NOT NULL,
+            mcsmInstanceId TEXT NOT NULL,
+            emailServiceUsername TEXT NOT NULL,
+            mcsmApikey TEXT NOT NULL,
+            emailServicePassword TEXT NOT NULL
+        )
+    '''),
+    (2, _add_email_queue),
+    (3, _add_server_registry),
+    (4, _add_event_outbox),
+    # 发件箱移到单独的数据库（EVENTS_MIGRATIONS），写入事件不再使设置缓存失效
+    (5, 'DROP TABLE IF EXISTS event_outbox'),
+]
+
+PLAYERS_MIGRATIONS = [
+    (1, '''
+        CREATE TABLE IF NOT EXISTS players (
+            game_id TEXT PRIMARY KEY,
+            qq TEXT,
+            email TEXT,
+            permission_group TEXT CHECK(permission_group IN ('Player', 'Graduate Engineer', 'Engineer', 'Senior Engineer', 'Admin')),
+            join_date TEXT,
+            leave_date TEXT,
+            leave_reason TEXT
+        )
+    '''),
+    # /players/engineer-groups 按权限组过滤，按邮箱/QQ 精确查找，按加入日期排序
+    (2, 'CREATE INDEX IF NOT EXISTS idx_players_permission_group ON players (permission_group, game_id)'),
+    (3, 'CREATE INDEX IF NOT EXISTS idx_players_email ON players (email)'),
+    (4, 'CREATE INDEX IF NOT EXISTS idx_players_qq ON players (qq)'),
+    (5, 'CREATE INDEX IF NOT EXISTS idx_players_join_date ON players (join_date, game_id)'),
+    (6, _add_table_version('players')),
+    (7, _add_change_log('players', 'game_id', 'player_changes')),
+    (8, _add_player_stats),
+    # 日期规范化后 join_date / leave_date 的范围条件可以直接走索引
+    (9, _normalize_player_dates),
+    (10, 'CREATE INDEX IF NOT EXISTS idx_players_leave_date ON players (leave_date, game_id)'),
+    # /members 按规范化的邮箱关联 users 表（两个方向都可以走索引）
+    (11, 'CREATE INDEX IF NOT EXISTS idx_players_email_norm ON players (lower(trim(email)))'),
+    # /players/search 的 FTS5 trigram 索引，以 players_fts_keys 的整数主键作为 rowid（替换旧的外部内容索引）
+    (12, create_players_fts),
+]
+
+EVENTS_MIGRATIONS = [
+    (1, _add_event_outbox),
+]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+# 执行尚未应用的迁移，返回迁移后的版本号。
+# 每个迁移在单独的 BEGIN IMMEDIATE 事务中执行，多个进程同时启动时会排队，
+# 拿到写锁后重新读取版本号，已执行过的迁移不会重复执行。
+def migrate(conn, migrations):
+    for version, step in migrations:
+        if schema_version(conn) >= version:
+            continue
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            if callable(step):
+                step(conn)
+            else:
+                conn.execute(step)
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+    return schema_version(conn)
@@ -0,0 +1,178 @@
+import base64
+import binascii
+import json
+
+from flask import Response
+
+from db import get_db
+from serializer import dumps, projector
+
+# 分页默认参数
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# 流式输出时每次从游标读取的行数
+STREAM_BATCH_SIZE = 500
+STREAM_FORMATS = ('ndjson', 'json')
+PAGE_ARG_NAMES = ('limit', 'after', 'sort', 'order', 'stream')
+
+
+class PageArgs:
+    def __init__(self, limit, after, sort, order, stream):
+        self.limit = limit
+        self.after = after
+        self.sort = sort
+        self.order = order
+        self.stream = stream
+
+
+# 游标内容为 [排序列的值, 主键]，编码为 URL 安全的 base64
+def encode_cursor(sort_value, key_value):
+    raw = json.dumps([sort_value, key_value], ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        value = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, binascii.Error):
+        raise ValueError('无效的分页游标')
+    if not isinstance(value, list) or len(value) != 2:
+        raise ValueError('无效的分页游标')
+    return value
+
+
+# 解析分页参数；没有任何分页参数时返回 None，调用方保持原来的完整数组返回
+def parse_page_args(args, sort_fields):
+    if not any(name in args for name in PAGE_ARG_NAMES):
+        return None
+
+    stream = args.get('stream')
+    if stream is not None and stream not in STREAM_FORMATS:
+        raise ValueError('无效的流式格式')
+
+    limit = args.get('limit')
+    if limit is None:
+        # 流式模式默认不限制行数
+        limit = None if stream else DEFAULT_PAGE_SIZE
+    else:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError('无效的 limit')
+        if limit < 1:
+            raise ValueError('无效的 limit')
+        if not stream:
+            limit = min(limit, MAX_PAGE_SIZE)
+
+    sort = args.get('sort', sort_fields[0])
+    if sort not in sort_fields:
+        raise ValueError('无效的排序字段')
+
+    order = args.get('order', 'asc')
+    if order not in ('asc', 'desc'):
+        raise ValueError('无效的排序方向')
+
+    after = args.get('after')
+    if after is not None:
+        after = decode_cursor(after)
+
+    return PageArgs(limit, after, sort, order, stream)
+
+
+# 生成 keyset 条件：(sort, key) 严格位于游标之后。
+# SQLite 升序时 NULL 排在最前，降序时排在最后，需要单独处理可为空的排序列。
+def _keyset_condition(page, key_field):
+    sort_value, key_value = page.after
+    sort = page.sort
+    if sort == key_field:
+        op = '>' if page.order == 'asc' else '<'
+        return f'{key_field} {op} ?', [key_value]
+
+    if page.order == 'asc':
+        if sort_value is None:
+            return f'(({sort} IS NULL AND {key_field} > ?) OR {sort} IS NOT NULL)', [key_value]
+        return f'({sort} > ? OR ({sort} = ? AND {key_field} > ?))', [sort_value, sort_value, key_value]
+
+    if sort_value is None:
+        return f'({sort} IS NULL AND {key_field} < ?)', [key_value]
+    return (f'({sort} < ? OR ({sort} = ? AND {key_field} < ?) OR {sort} IS NULL)',
+            [sort_value, sort_value, key_value])
+
+
+def build_keyset_query(select_sql, conditions, params, page, key_field, extra=0):
+    conditions = list(conditions)
+    params = list(params)
+    if page.after is not None:
+        condition, condition_params = _keyset_condition(page, key_field)
+        conditions.append(condition)
+        params.extend(condition_params)
+
+    sql = select_sql
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    direction = 'ASC' if page.order == 'asc' else 'DESC'
+    if page.sort == key_field:
+        sql += f' ORDER BY {key_field} {direction}'
+    else:
+        sql += f' ORDER BY {page.sort} {direction}, {key_field} {direction}'
+    if page.limit is not None:
+        sql += ' LIMIT ?'
+        params.append(page.limit + extra)
+    return sql, params
+
+
+# 按批次从游标读取并逐行输出，整个结果集不会同时驻留内存
+def stream_rows(path, sql, params, row_to_dict, fmt, attach=()):
+    def generate():
+        with get_db(path, attach) as conn:
+            cursor = conn.execute(sql, params)
+            if fmt == 'json':
+                yield b'['
+            first = True
+            while True:
+                rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+                if not rows:
+                    break
+                parts = [dumps(row_to_dict(row)) for row in rows]
+                if fmt == 'ndjson':
+                    yield b'\n'.join(parts) + b'\n'
+                else:
+                    yield (b'' if first else b',') + b','.join(parts)
+                first = False
+            if fmt == 'json':
+                yield b']'
+
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+    return Response(generate(), mimetype=mimetype)
+
+
+# 执行分页查询（或流式输出），返回 Flask 响应。
+# fields 为要输出的字段，游标仍然根据完整的行生成；attach 传给 get_db，用于跨库查询
+def paginate(path, select_sql, conditions, params, page, key_field, row_to_dict, fields=None, attach=()):
+    project = projector(fields)
+    if page.stream:
+        sql, sql_params = build_keyset_query(select_sql, conditions, params, page, key_field)
+        if project is not None:
+            full_row_to_dict = row_to_dict
+
+            def row_to_dict(row):
+                return project(full_row_to_dict(row))
+        return stream_rows(path, sql, sql_params, row_to_dict, page.stream, attach)
+
+    # 多取一行用于判断是否还有下一页
+    sql, sql_params = build_keyset_query(select_sql, conditions, params, page, key_field, extra=1)
+    with get_db(path, attach) as conn:
+        rows = conn.execute(sql, sql_params).fetchall()
+
+    has_more = len(rows) > page.limit
+    items = [row_to_dict(row) for row in rows[:page.limit]]
+    next_after = None
+    if has_more:
+        last = items[-1]
+        next_after = encode_cursor(last[page.sort], last[key_field])
+    if project is not None:
+        items = [project(item) for item in items]
+
+    body = dumps({"items": items, "next_after": next_after, "has_more": has_more})
+    return Response(body, status=200, mimetype='application/json')
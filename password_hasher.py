@@ -0,0 +1,139 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+DEFAULT_ROUNDS = 12
+# 同时进行哈希计算的线程数，bcrypt 计算期间会释放 GIL
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+# 每个线程允许排队的任务数，超过后直接拒绝
+DEFAULT_QUEUE_PER_WORKER = 4
+# 等待单个哈希任务完成的最长时间（秒）
+DEFAULT_TIMEOUT = 10
+
+_BCRYPT_COST_RE = re.compile(rb'^\$2[abxy]?\$(\d{2})\$')
+
+
+class HasherBusyError(Exception):
+    pass
+
+
+# 任务已提交但在 timeout 内没有完成（线程池积压），调用方同样按繁忙处理
+class HasherTimeoutError(HasherBusyError):
+    pass
+
+
+def _to_bytes(value):
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return bytes(value)
+
+
+# 读取哈希中的 cost，非 bcrypt 格式返回 None
+def hash_cost(hashed):
+    match = _BCRYPT_COST_RE.match(_to_bytes(hashed))
+    return int(match.group(1)) if match else None
+
+
+# 有界的 bcrypt 线程池：限制同时占用的 CPU，排队过多时快速失败而不是拖慢其他接口
+class PasswordHasher:
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=DEFAULT_WORKERS,
+                 max_pending=None, timeout=DEFAULT_TIMEOUT):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending if max_pending is not None else workers * DEFAULT_QUEUE_PER_WORKER
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(workers + self.max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.completed = 0
+        self.rehashed = 0
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusyError('Password hashing queue is full')
+        with self._lock:
+            self._pending += 1
+
+        def run():
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    self.completed += 1
+                self._slots.release()
+
+        try:
+            return self._executor.submit(run)
+        except RuntimeError:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+            raise HasherBusyError('Password hasher is shut down')
+
+    # bcrypt 在第一次计算时才导入，导入本模块（以及 app1.py、migrations.py）不加载 bcrypt 扩展
+    def _hashpw(self, password):
+        import bcrypt
+        return bcrypt.hashpw(_to_bytes(password), bcrypt.gensalt(self.rounds))
+
+    @staticmethod
+    def _checkpw(password, hashed):
+        import bcrypt
+        try:
+            return bcrypt.checkpw(_to_bytes(password), _to_bytes(hashed))
+        except ValueError:
+            # 数据库中不是合法的 bcrypt 哈希
+            return False
+
+    def _wait(self, future):
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise HasherTimeoutError('Password hashing timed out')
+
+    # 计算密码哈希，队列已满时抛出 HasherBusyError，超时抛出 HasherTimeoutError
+    def hash(self, password):
+        return self._wait(self._submit(self._hashpw, password))
+
+    # 校验密码，队列已满时抛出 HasherBusyError，超时抛出 HasherTimeoutError
+    def verify(self, password, hashed):
+        return self._wait(self._submit(self._checkpw, password, hashed))
+
+    # 已保存的哈希 cost 与当前配置不同，需要在登录成功后升级
+    def needs_rehash(self, hashed):
+        return hash_cost(hashed) != self.rounds
+
+    # 在后台重新计算哈希并通过 callback 保存；队列繁忙时跳过，下次登录再升级
+    def rehash_async(self, password, callback):
+        def rehash():
+            new_hash = self._hashpw(password)
+            callback(new_hash)
+            with self._lock:
+                self.rehashed += 1
+
+        try:
+            self._submit(rehash)
+        except HasherBusyError:
+            return False
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rounds": self.rounds,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "rehashed": self.rehashed,
+            }
@@ -0,0 +1,131 @@
+import argparse
+import datetime
+import sqlite3
+import sys
+
+# 玩家统计：各权限组人数、按日期的加入/离开人数保存在汇总表中，由 players 上的触发器增量维护
+# （见 migrations.py 的 _add_player_stats），读取时不扫描 players。
+# INSERT OR REPLACE 删除旧行时不触发 DELETE 触发器，会使汇总表偏离；接口和导入都不使用它，
+# 手动用 sqlite3 修改过 players 后用本脚本重建。
+# 用法：python player_stats.py --db player.db          重新计算汇总表，并输出与全表扫描不一致的项
+#      python player_stats.py --db player.db --check  只校验，不修改；不一致时退出码为 1
+
+# 全表扫描的统计结果，重建和校验共用
+FULL_SCAN_GROUPS_SQL = '''
+    SELECT COALESCE(permission_group, ''), COUNT(*) FROM players GROUP BY 1
+'''
+FULL_SCAN_DATES_SQL = '''
+    SELECT 'join', join_date, COUNT(*) FROM players
+    WHERE join_date IS NOT NULL AND join_date != '' GROUP BY join_date
+    UNION ALL
+    SELECT 'leave', leave_date, COUNT(*) FROM players
+    WHERE leave_date IS NOT NULL AND leave_date != '' GROUP BY leave_date
+'''
+
+
+def _stored_counts(conn):
+    groups = {row[0]: row[1] for row in conn.execute(
+        'SELECT permission_group, members FROM player_stats_groups WHERE members != 0')}
+    dates = {(row[0], row[1]): row[2] for row in conn.execute(
+        'SELECT kind, day, count FROM player_stats_dates WHERE count != 0')}
+    return groups, dates
+
+
+def _scanned_counts(conn):
+    groups = {row[0]: row[1] for row in conn.execute(FULL_SCAN_GROUPS_SQL)}
+    dates = {(row[0], row[1]): row[2] for row in conn.execute(FULL_SCAN_DATES_SQL)}
+    return groups, dates
+
+
+def _diff(name, stored, scanned):
+    mismatches = []
+    for key in sorted(set(stored) | set(scanned), key=repr):
+        if stored.get(key, 0) != scanned.get(key, 0):
+            mismatches.append({"table": name, "key": list(key) if isinstance(key, tuple) else key,
+                               "stored": stored.get(key, 0), "actual": scanned.get(key, 0)})
+    return mismatches
+
+
+# 对比汇总表和全表扫描的结果，返回不一致的项
+def verify_player_stats(conn):
+    stored_groups, stored_dates = _stored_counts(conn)
+    scanned_groups, scanned_dates = _scanned_counts(conn)
+    return _diff('player_stats_groups', stored_groups, scanned_groups) + \
+        _diff('player_stats_dates', stored_dates, scanned_dates)
+
+
+# 写入全表扫描的结果（调用方负责事务）
+def populate_player_stats(conn):
+    conn.execute('DELETE FROM player_stats_groups')
+    conn.execute('DELETE FROM player_stats_dates')
+    conn.execute(f'INSERT INTO player_stats_groups (permission_group, members) {FULL_SCAN_GROUPS_SQL}')
+    conn.execute(f'INSERT INTO player_stats_dates (kind, day, count) {FULL_SCAN_DATES_SQL}')
+
+
+# 在一个写事务中校验并重建汇总表，返回重建前不一致的项
+def rebuild_player_stats(conn):
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        mismatches = verify_player_stats(conn)
+        populate_player_stats(conn)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return mismatches
+
+
+# 读取统计结果。离开日期晚于 today 的玩家仍算在职，按日期汇总表求和，与玩家总数无关
+def read_player_stats(conn, today=None):
+    today = (today or datetime.date.today()).isoformat()
+    groups = {row[0]: row[1] for row in conn.execute(
+        'SELECT permission_group, members FROM player_stats_groups WHERE members != 0 ORDER BY permission_group')}
+    months = {"join": {}, "leave": {}}
+    for kind, month, count in conn.execute('''
+        SELECT kind, substr(day, 1, 7) AS month, SUM(count) FROM player_stats_dates
+        WHERE count != 0 GROUP BY kind, month ORDER BY month
+    '''):
+        months[kind][month] = count
+    departed = conn.execute("SELECT COALESCE(SUM(count), 0) FROM player_stats_dates WHERE kind = 'leave' AND day <= ?",
+                            (today,)).fetchone()[0]
+    total = sum(groups.values())
+    return {
+        "total": total,
+        "active": total - departed,
+        "departed": departed,
+        # 没有权限组的玩家 permission_group 为 null
+        "permission_groups": [{"permission_group": group or None, "members": count}
+                              for group, count in groups.items()],
+        "joins_per_month": months["join"],
+        "leaves_per_month": months["leave"],
+        "as_of": today,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild and verify the player statistics tables')
+    parser.add_argument('--db', default='player.db')
+    parser.add_argument('--check', action='store_true', help='only compare with a full scan, do not rewrite')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.check:
+            mismatches = verify_player_stats(conn)
+        else:
+            mismatches = rebuild_player_stats(conn)
+    finally:
+        conn.close()
+
+    for item in mismatches:
+        print(f'{item["table"]} {item["key"]}: stored {item["stored"]}, actual {item["actual"]}')
+    action = 'checked' if args.check else 'rebuilt'
+    print(f'{action}: {len(mismatches)} mismatch(es)')
+    if args.check and mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
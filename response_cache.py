@@ -0,0 +1,133 @@
+import functools
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import Response, make_response, request
+
+from db import get_db
+
+# 最多缓存的响应数量（不同的路径 + 查询参数各占一项）
+MAX_CACHED_RESPONSES = 256
+# 所有缓存响应体的总字节数上限，超过时淘汰最久未使用的项
+MAX_CACHED_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# 单个响应体超过这个大小时不缓存（只返回 ETag），避免少数大列表占满缓存
+MAX_CACHED_BODY_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BODY_BYTES', 8 * 1024 * 1024))
+
+
+# 读取表的变更计数器（由触发器维护），表不存在时返回 None
+def get_table_version(path, table):
+    try:
+        with get_db(path) as conn:
+            row = conn.execute('SELECT version FROM table_versions WHERE name = ?', (table,)).fetchone()
+    except sqlite3.OperationalError:
+        # 数据库尚未迁移
+        return None
+    return row[0] if row else None
+
+
+# 序列化后的响应体缓存，按表版本判断是否过期
+class ResponseCache:
+    def __init__(self, max_entries=MAX_CACHED_RESPONSES, max_bytes=MAX_CACHED_BYTES,
+                 max_body_bytes=MAX_CACHED_BODY_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_body_bytes = max_body_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.too_large = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def put(self, key, version, body, mimetype):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            if len(body) > self.max_body_bytes:
+                self.too_large += 1
+                return
+            self._entries[key] = (version, body, mimetype)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "too_large": self.too_large,
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+            }
+
+
+response_cache = ResponseCache()
+
+
+def _make_etag(table, version, key):
+    return f'{table}-{version}-{zlib.crc32(key.encode("utf-8")):08x}'
+
+
+# 列表接口的条件 GET：
+# ETag 由表版本和请求路径生成，If-None-Match 命中时直接返回 304，不读取任何行；
+# 否则优先返回缓存的响应体。任何写入都会让表版本加一，缓存随之失效。
+def conditional_get(path, table):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            version = get_table_version(path, table)
+            if version is None:
+                return view(*args, **kwargs)
+
+            key = request.full_path
+            etag = _make_etag(table, version, key)
+            if request.if_none_match.contains(etag):
+                response_cache.record_not_modified()
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            cached = response_cache.get(key, version)
+            if cached is not None:
+                body, mimetype = cached
+                response = Response(body, status=200, mimetype=mimetype)
+                response.set_etag(etag)
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                # 流式响应和按游标翻页的响应（每个游标一项，很少被重复请求）只返回 ETag，不缓存响应体
+                if 'after' not in request.args:
+                    response_cache.put(key, version, response.get_data(), response.mimetype)
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,115 @@
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# trigram 分词器至少需要 3 个字符才能使用索引，更短的关键词退回 LIKE 扫描
+MIN_FTS_KEYWORD_LENGTH = 3
+
+PLAYER_SEARCH_COLUMNS = 'p.game_id, p.qq, p.email, p.permission_group, p.join_date, p.leave_date'
+
+# players 以 TEXT 为主键，隐式 rowid 在 VACUUM 后可能变化，不能作为全文索引的关联键。
+# players_fts_keys 为每个游戏 ID 分配一个 INTEGER PRIMARY KEY（VACUUM 不会改变），作为 players_fts 的 rowid；
+# players_fts 自己保存 game_id/qq/email，查询结果按 game_id（主键索引）关联回 players。
+PLAYERS_FTS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS players_fts_keys (
+        id INTEGER PRIMARY KEY,
+        game_id TEXT UNIQUE NOT NULL
+    )
+    ''',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS players_fts USING fts5(
+        game_id, qq, email,
+        tokenize='trigram'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS players_fts_insert AFTER INSERT ON players BEGIN
+        INSERT OR IGNORE INTO players_fts_keys (game_id) VALUES (new.game_id);
+        INSERT INTO players_fts (rowid, game_id, qq, email)
+        SELECT id, new.game_id, new.qq, new.email FROM players_fts_keys WHERE game_id = new.game_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS players_fts_delete AFTER DELETE ON players BEGIN
+        DELETE FROM players_fts WHERE rowid = (SELECT id FROM players_fts_keys WHERE game_id = old.game_id);
+        DELETE FROM players_fts_keys WHERE game_id = old.game_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS players_fts_update AFTER UPDATE OF game_id, qq, email ON players BEGIN
+        UPDATE players_fts_keys SET game_id = new.game_id WHERE game_id = old.game_id;
+        UPDATE players_fts SET game_id = new.game_id, qq = new.qq, email = new.email
+        WHERE rowid = (SELECT id FROM players_fts_keys WHERE game_id = new.game_id);
+    END
+    ''',
+]
+
+# 早期版本创建的外部内容索引（content='players'，按 players 的隐式 rowid 关联）
+_LEGACY_FTS_OBJECTS = [
+    'DROP TRIGGER IF EXISTS players_fts_insert',
+    'DROP TRIGGER IF EXISTS players_fts_delete',
+    'DROP TRIGGER IF EXISTS players_fts_update',
+    'DROP TABLE IF EXISTS players_fts',
+]
+
+
+# 迁移中调用（已在事务中）：创建全文索引及同步触发器，并从 players 全量构建。
+# SQLite 版本过旧（< 3.34）或未编译 FTS5 时不创建，搜索退回 LIKE 扫描
+def create_players_fts(conn):
+    for statement in _LEGACY_FTS_OBJECTS:
+        conn.execute(statement)
+    try:
+        conn.execute('SAVEPOINT players_fts')
+        for statement in PLAYERS_FTS_SCHEMA:
+            conn.execute(statement)
+        conn.execute('INSERT OR IGNORE INTO players_fts_keys (game_id) SELECT game_id FROM players')
+        conn.execute('''
+            INSERT INTO players_fts (rowid, game_id, qq, email)
+            SELECT k.id, p.game_id, p.qq, p.email FROM players p JOIN players_fts_keys k ON k.game_id = p.game_id
+        ''')
+        conn.execute('RELEASE players_fts')
+    except sqlite3.OperationalError as e:
+        conn.execute('ROLLBACK TO players_fts')
+        conn.execute('RELEASE players_fts')
+        logger.warning('Full-text search unavailable: %s', e)
+        return False
+    return True
+
+
+# 查询时检查索引是否存在（迁移可能因 SQLite 不支持 FTS5 而跳过）
+def fts_available(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'players_fts'").fetchone() is not None
+
+
+def _fts_phrase(keyword):
+    # 整个关键词作为一个短语，trigram 下等价于子串匹配
+    return '"' + keyword.replace('"', '""') + '"'
+
+
+# 搜索玩家：按相关度排序（游戏 ID 完全相同的排在最前），limit 为 None 时返回全部匹配
+# columns 为要返回的 players 列，默认为 PLAYER_SEARCH_COLUMNS
+def search_players(conn, keyword, limit=None, offset=0, columns=None):
+    keyword = keyword or ''
+    select_columns = ', '.join(f'p.{column}' for column in columns) if columns else PLAYER_SEARCH_COLUMNS
+    sql_limit = -1 if limit is None else limit
+
+    if len(keyword) >= MIN_FTS_KEYWORD_LENGTH and fts_available(conn):
+        return conn.execute(f'''
+            SELECT {select_columns}
+            FROM players_fts JOIN players p ON p.game_id = players_fts.game_id
+            WHERE players_fts MATCH ?
+            ORDER BY p.game_id = ? COLLATE NOCASE DESC, players_fts.rank, p.game_id
+            LIMIT ? OFFSET ?
+        ''', (_fts_phrase(keyword), keyword, sql_limit, offset)).fetchall()
+
+    pattern = f'%{keyword}%'
+    return conn.execute(f'''
+        SELECT {select_columns}
+        FROM players p
+        WHERE p.game_id LIKE ? OR p.qq LIKE ? OR p.email LIKE ?
+        ORDER BY p.game_id = ? COLLATE NOCASE DESC, p.game_id
+        LIMIT ? OFFSET ?
+    ''', (pattern, pattern, pattern, keyword, sql_limit, offset)).fetchall()
@@ -0,0 +1,50 @@
+import json
+import os
+
+from flask import Response
+
+# 列表接口共用的 JSON 序列化：查询结果（元组）按列名直接编码为 JSON 字节。
+# 安装了 orjson 时使用 orjson，否则使用标准库 json；可通过 JSON_BACKEND=json 强制使用标准库。
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'orjson' if orjson is not None else 'json')
+if JSON_BACKEND == 'orjson' and orjson is None:
+    JSON_BACKEND = 'json'
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def dumps(obj):
+    if JSON_BACKEND == 'orjson':
+        return orjson.dumps(obj)
+    return _encoder.encode(obj).encode('utf-8')
+
+
+# 解析 ?fields=a,b，返回要输出的列（保持请求中的顺序）；没有该参数时返回全部列
+def parse_fields(args, columns):
+    value = args.get('fields')
+    if not value:
+        return columns
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    if not fields or any(field not in columns for field in fields):
+        raise ValueError('无效的字段')
+    return fields
+
+
+# 返回把行字典裁剪为只包含 fields（按 fields 的顺序）的函数，供分页和流式输出使用；fields 为 None 时不裁剪
+def projector(fields):
+    if fields is None:
+        return None
+    return lambda item: {field: item[field] for field in fields}
+
+
+def rows_to_json(rows, columns):
+    return dumps([dict(zip(columns, row)) for row in rows])
+
+
+# 查询结果直接生成响应，rows 的列顺序与 columns 一致
+def json_rows_response(rows, columns, status=200):
+    return Response(rows_to_json(rows, columns), status=status, mimetype='application/json')
@@ -0,0 +1,238 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db import get_db
+from mcsm import MCSMClient, MCSMError
+from server_status import (SERVER_STATUS_INTERVAL, SERVER_STATUS_TTL, SERVER_STATUS_TIMEOUT, StatusError,
+                           match_players, query_status)
+from settings_cache import DEFAULT_MINECRAFT_PORT, parse_server_address
+
+# 服务器登记表（settings.db 的 servers 表）：多个 Minecraft 服务器和 MCSM 实例。
+# 后台 asyncio 线程并发查询所有启用的服务器（Server List Ping + MCSM 实例信息），同时进行的查询数不超过
+# SERVER_POLL_CONCURRENCY；结果汇总为一个快照缓存在内存中，/servers/status 一次返回全部服务器的状态。
+SERVER_POLL_CONCURRENCY = int(os.environ.get('SERVER_POLL_CONCURRENCY', '16'))
+
+# 可写入的字段；mcsm_apikey 不在列表接口中返回
+SERVER_FIELDS = ('name', 'address', 'mcsm_api_address', 'mcsm_daemon_id', 'mcsm_instance_id', 'mcsm_apikey',
+                 'enabled')
+_SELECT_SERVERS = f'SELECT id, {", ".join(SERVER_FIELDS)} FROM servers'
+
+
+def server_row_to_dict(row):
+    server = dict(zip(('id',) + SERVER_FIELDS, row))
+    server['mcsm_apikey_set'] = bool(server.pop('mcsm_apikey'))
+    server['enabled'] = bool(server['enabled'])
+    return server
+
+
+# 校验请求中的服务器字段，返回要写入的值；partial 为 True 时只校验出现的字段（修改接口）
+def validate_server(data, partial=False):
+    values = {}
+    for field in SERVER_FIELDS:
+        if field not in data:
+            continue
+        value = data[field]
+        if field == 'enabled':
+            if not isinstance(value, bool):
+                raise ValueError('enabled 必须是布尔值')
+            value = int(value)
+        elif value is None:
+            value = ''
+        elif not isinstance(value, str):
+            raise ValueError(f'{field} 必须是字符串')
+        else:
+            value = value.strip()
+        values[field] = value
+    if not partial and not values.get('name'):
+        raise ValueError('服务器名称不能为空')
+    if partial and 'name' in values and not values['name']:
+        raise ValueError('服务器名称不能为空')
+    if values.get('address') and parse_server_address(values['address'], DEFAULT_MINECRAFT_PORT)[0] is None:
+        raise ValueError('无效的服务器地址')
+    if values.get('mcsm_api_address'):
+        values['mcsm_api_address'] = values['mcsm_api_address'].rstrip('/')
+    return values
+
+
+# /settings/save 中调用（与设置在同一个事务中）：设置里的服务器地址和 MCSM 实例同步到登记表的 default 行。
+# 与迁移导入时的规则相同，设置中没有服务器时不新建 default 行
+def sync_default_server(conn, address, mcsm_api_address, mcsm_daemon_id, mcsm_instance_id, mcsm_apikey):
+    values = [value.strip() if isinstance(value, str) else ''
+              for value in (address, mcsm_api_address, mcsm_daemon_id, mcsm_instance_id, mcsm_apikey)]
+    values[1] = values[1].rstrip('/')
+    updated = conn.execute('''
+        UPDATE servers SET address =?, mcsm_api_address =?, mcsm_daemon_id =?, mcsm_instance_id =?, mcsm_apikey =?
+        WHERE name = 'default'
+    ''', values).rowcount
+    if not updated and (values[0] or values[3]):
+        conn.execute('''
+            INSERT INTO servers (name, address, mcsm_api_address, mcsm_daemon_id, mcsm_instance_id, mcsm_apikey)
+            VALUES ('default', ?, ?, ?, ?, ?)
+        ''', values)
+
+
+class FleetStatusPoller:
+    def __init__(self, settings_path, players_path, interval=SERVER_STATUS_INTERVAL, ttl=SERVER_STATUS_TTL,
+                 timeout=SERVER_STATUS_TIMEOUT, concurrency=SERVER_POLL_CONCURRENCY):
+        self.settings_path = settings_path
+        self.players_path = players_path
+        self.interval = interval
+        self.ttl = ttl
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self._reset()
+        # fork 之后子进程没有轮询线程，第一次访问时重新启动
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+        self.polls = 0
+        self.failures = 0
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loop = None
+        self._refresh = None
+        self._snapshot = None
+        self._executor = None
+        # {(地址, apikey, daemon, instance): MCSMClient}，连接在轮询之间复用
+        self._clients = {}
+
+    def ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='fleet-status', daemon=True)
+                    self._thread.start()
+
+    # 登记表修改后调用，立即重新查询而不等到下一个周期
+    def refresh(self):
+        loop, event = self._loop, self._refresh
+        if loop is not None and event is not None:
+            loop.call_soon_threadsafe(event.set)
+
+    def _run(self):
+        asyncio.run(self._poll_forever())
+
+    async def _poll_forever(self):
+        self._loop = asyncio.get_running_loop()
+        self._refresh = asyncio.Event()
+        while True:
+            self._refresh.clear()
+            try:
+                await self.poll_once()
+            except Exception as e:
+                # 例如 servers 表尚未创建：保留上一次成功的结果（checked_at 不变，超过 TTL 后标记为 stale），
+                # 还没有成功过时返回空的服务器列表
+                self.failures += 1
+                previous = self._snapshot or {"servers": [], "totals": None, "checked_at": None, "poll_ms": None}
+                self._snapshot = {**previous, "error": f'{type(e).__name__}: {e}'}
+            try:
+                await asyncio.wait_for(self._refresh.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _load_servers(self):
+        with get_db(self.settings_path) as conn:
+            return [dict(zip(('id',) + SERVER_FIELDS, row))
+                    for row in conn.execute(f'{_SELECT_SERVERS} WHERE enabled = 1 ORDER BY id')]
+
+    def _client(self, server):
+        key = (server['mcsm_api_address'], server['mcsm_apikey'], server['mcsm_daemon_id'],
+               server['mcsm_instance_id'])
+        client = self._clients.get(key)
+        if client is None:
+            client = MCSMClient(*key, pool_size=1, timeout=self.timeout)
+            self._clients[key] = client
+        return client
+
+    async def _query_minecraft(self, server):
+        host, port = parse_server_address(server['address'], DEFAULT_MINECRAFT_PORT)
+        try:
+            return await query_status(host, port, self.timeout)
+        except StatusError as e:
+            return {"online": False, "error": str(e)}
+
+    async def _query_mcsm(self, server):
+        try:
+            # MCSMClient 是同步客户端，在与并发上限同样大小的线程池中执行（默认线程池在单核机器上只有 5 个线程）
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._client(server).instance_info)
+        except MCSMError as e:
+            return {"status": 'unknown', "error": str(e)}
+
+    async def _query_server(self, server, semaphore):
+        async with semaphore:
+            tasks = []
+            if server['address']:
+                tasks.append(self._query_minecraft(server))
+            if server['mcsm_api_address'] and server['mcsm_instance_id']:
+                tasks.append(self._query_mcsm(server))
+            results = await asyncio.gather(*tasks)
+        status = {"id": server['id'], "name": server['name'], "address": server['address'],
+                  "online": None, "mcsm": None}
+        if server['address']:
+            status.update(results.pop(0))
+        if server['mcsm_api_address'] and server['mcsm_instance_id']:
+            status["mcsm"] = results.pop(0)
+        return status
+
+    # 并发查询所有启用的服务器并替换缓存的快照
+    async def poll_once(self):
+        started = time.perf_counter()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='fleet-mcsm')
+        servers = await asyncio.to_thread(self._load_servers)
+        # 删除不再使用的 MCSM 客户端
+        keys = {(s['mcsm_api_address'], s['mcsm_apikey'], s['mcsm_daemon_id'], s['mcsm_instance_id'])
+                for s in servers}
+        for key in list(self._clients):
+            if key not in keys:
+                self._clients.pop(key).close()
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        statuses = await asyncio.gather(*(self._query_server(server, semaphore) for server in servers))
+
+        # 所有服务器的在线样本一次查询 players 表
+        names = sorted({name for status in statuses for name in status.get('sample') or ()})
+        if names:
+            with get_db(self.players_path) as conn:
+                known, _ = match_players(conn, names)
+            groups = {player['game_id']: player['permission_group'] for player in known}
+        else:
+            groups = {}
+        for status in statuses:
+            sample = status.pop('sample', None) or []
+            status['online_players'] = [{"game_id": name, "permission_group": groups[name]}
+                                        for name in sample if name in groups]
+            status['unknown_players'] = [name for name in sample if name not in groups]
+
+        online = [status for status in statuses if status.get('online')]
+        self.polls += 1
+        self._snapshot = {
+            "servers": statuses,
+            "totals": {
+                "servers": len(statuses),
+                "online": len(online),
+                "players_online": sum(status.get('players_online') or 0 for status in online),
+                "players_max": sum(status.get('players_max') or 0 for status in online),
+            },
+            "checked_at": time.time(),
+            "poll_ms": round((time.perf_counter() - started) * 1000, 3),
+            "error": None,
+        }
+        return self._snapshot
+
+    # 返回缓存的快照，不等待网络
+    def get(self):
+        self.ensure_started()
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"servers": [], "totals": None, "checked_at": None, "stale": True}
+        checked_at = snapshot.get("checked_at")
+        return {**snapshot, "stale": checked_at is None or time.time() - checked_at > self.ttl}
+
+    def stats(self):
+        return {"running": self._thread is not None, "polls": self.polls, "failures": self.failures,
+                "interval": self.interval, "concurrency": self.concurrency, "mcsm_clients": len(self._clients)}
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import os
+import struct
+import threading
+import time
+
+from db import get_db
+
+# Minecraft 服务器状态：后台 asyncio 线程定期用 Server List Ping 协议查询 minecraftServerIP，
+# 结果缓存在内存中，/server/status 直接返回缓存，不在请求中访问网络。
+# 在线玩家名单（服务器只返回一部分样本）与 players 表关联，得到在线的已登记玩家。
+# 轮询间隔（秒）；超过 TTL 没有成功查询时，缓存结果标记为 stale
+SERVER_STATUS_INTERVAL = float(os.environ.get('SERVER_STATUS_INTERVAL', '15'))
+SERVER_STATUS_TTL = float(os.environ.get('SERVER_STATUS_TTL', '60'))
+# 单次查询的超时（秒）
+SERVER_STATUS_TIMEOUT = float(os.environ.get('SERVER_STATUS_TIMEOUT', '5'))
+# 握手中填写的协议版本，-1 表示由服务器返回自己的版本
+PROTOCOL_VERSION = -1
+# 状态响应的最大长度（包含服务器图标）
+MAX_RESPONSE_SIZE = 1 << 20
+
+
+class StatusError(Exception):
+    pass
+
+
+def _varint(value):
+    value &= 0xFFFFFFFF
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _packet(packet_id, payload=b''):
+    body = _varint(packet_id) + payload
+    return _varint(len(body)) + body
+
+
+def _string(value):
+    data = value.encode('utf-8')
+    return _varint(len(data)) + data
+
+
+async def _read_varint(reader):
+    value = 0
+    for shift in range(0, 35, 7):
+        byte = (await reader.readexactly(1))[0]
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value
+    raise StatusError('无效的 VarInt')
+
+
+def _parse_varint(data, offset):
+    value = 0
+    for shift in range(0, 35, 7):
+        if offset >= len(data):
+            break
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+    raise StatusError('无效的 VarInt')
+
+
+# MOTD 可能是字符串或聊天组件（{"text": ..., "extra": [...]}），转换为纯文本
+def _flatten_text(component):
+    if isinstance(component, str):
+        return component
+    if isinstance(component, list):
+        return ''.join(_flatten_text(part) for part in component)
+    if isinstance(component, dict):
+        return _flatten_text(component.get('text', '')) + _flatten_text(component.get('extra', []))
+    return ''
+
+
+def _parse_status(payload, latency_ms):
+    players = payload.get('players') or {}
+    version = payload.get('version') or {}
+    return {
+        "online": True,
+        "version": version.get('name'),
+        "protocol": version.get('protocol'),
+        "motd": _flatten_text(payload.get('description', '')),
+        "players_online": players.get('online'),
+        "players_max": players.get('max'),
+        "sample": [player.get('name') for player in players.get('sample') or [] if player.get('name')],
+        "latency_ms": latency_ms,
+    }
+
+
+# 对一个服务器执行一次 Server List Ping（1.7+ 协议），返回解析后的状态；失败时抛出 StatusError
+async def query_status(host, port, timeout=SERVER_STATUS_TIMEOUT):
+    async def query():
+        start = time.perf_counter()
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            handshake = _varint(PROTOCOL_VERSION) + _string(host) + struct.pack('>H', port) + _varint(1)
+            writer.write(_packet(0x00, handshake) + _packet(0x00))
+            await writer.drain()
+            length = await _read_varint(reader)
+            if not 0 < length <= MAX_RESPONSE_SIZE:
+                raise StatusError(f'无效的响应长度: {length}')
+            data = await reader.readexactly(length)
+            latency_ms = round((time.perf_counter() - start) * 1000, 3)
+        finally:
+            writer.close()
+        packet_id, offset = _parse_varint(data, 0)
+        if packet_id != 0x00:
+            raise StatusError(f'无效的响应类型: {packet_id}')
+        size, offset = _parse_varint(data, offset)
+        try:
+            payload = json.loads(data[offset:offset + size].decode('utf-8'))
+        except ValueError:
+            raise StatusError('无效的状态 JSON')
+        if not isinstance(payload, dict):
+            raise StatusError('无效的状态 JSON')
+        return _parse_status(payload, latency_ms)
+
+    try:
+        return await asyncio.wait_for(query(), timeout)
+    except asyncio.TimeoutError:
+        raise StatusError('连接超时')
+    except (OSError, asyncio.IncompleteReadError) as e:
+        raise StatusError(f'连接失败: {e}')
+
+
+# 按游戏 ID 查找在线样本中的已登记玩家，返回 (已登记, 未登记的名字)
+def match_players(conn, names):
+    if not names:
+        return [], []
+    placeholders = ','.join('?' * len(names))
+    rows = conn.execute(f'SELECT game_id, permission_group FROM players WHERE game_id IN ({placeholders})',
+                        names).fetchall()
+    known = {row[0] for row in rows}
+    return ([{"game_id": game_id, "permission_group": group} for game_id, group in rows],
+            [name for name in names if name not in known])
+
+
+class ServerStatusPoller:
+    def __init__(self, settings_cache, players_path, interval=SERVER_STATUS_INTERVAL, ttl=SERVER_STATUS_TTL,
+                 timeout=SERVER_STATUS_TIMEOUT):
+        self.settings_cache = settings_cache
+        self.players_path = players_path
+        self.interval = interval
+        self.ttl = ttl
+        self.timeout = timeout
+        self._reset()
+        # fork 之后子进程没有轮询线程，第一次访问时重新启动
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+        self.polls = 0
+        self.failures = 0
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._snapshot = None
+
+    def ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='server-status', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        asyncio.run(self._poll_forever())
+
+    async def _poll_forever(self):
+        while True:
+            started = time.monotonic()
+            try:
+                await self.poll_once()
+            except Exception as e:
+                # 例如 players 表尚未创建；下一轮继续
+                self.failures += 1
+                self._snapshot = {**(self._snapshot or {}), "error": f'{type(e).__name__}: {e}'}
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    # 查询一次并更新缓存；服务器不可达时 online 为 False，updated_at 保留最后一次成功的时间
+    async def poll_once(self):
+        settings = self.settings_cache.get()
+        now = time.time()
+        self.polls += 1
+        if settings is None or not settings.minecraft_server_host:
+            self._snapshot = {"online": None, "error": '未设置服务器地址', "checked_at": now, "updated_at": None}
+            return self._snapshot
+        address = f'{settings.minecraft_server_host}:{settings.minecraft_server_port}'
+        try:
+            status = await query_status(settings.minecraft_server_host, settings.minecraft_server_port, self.timeout)
+        except StatusError as e:
+            self.failures += 1
+            previous = self._snapshot or {}
+            self._snapshot = {"address": address, "online": False, "error": str(e), "checked_at": now,
+                              "updated_at": previous.get("updated_at")}
+            return self._snapshot
+        with get_db(self.players_path) as conn:
+            known, unknown = match_players(conn, status["sample"])
+        self._snapshot = {**status, "address": address, "online_players": known, "unknown_players": unknown,
+                          "error": None, "checked_at": now, "updated_at": now}
+        return self._snapshot
+
+    # 返回缓存的状态，不等待网络；尚未查询过时 online 为 None
+    def get(self):
+        self.ensure_started()
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"online": None, "error": None, "checked_at": None, "updated_at": None, "stale": True}
+        updated_at = snapshot.get("updated_at")
+        return {**snapshot, "stale": updated_at is None or time.time() - updated_at > self.ttl}
+
+    def stats(self):
+        return {"running": self._thread is not None, "polls": self.polls, "failures": self.failures,
+                "interval": self.interval, "ttl": self.ttl}
@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import threading
+
+from db import BUSY_TIMEOUT_MS
+
+# /settings/get 返回的字段，顺序与 settings 表一致
+SETTINGS_FIELDS = (
+    'minecraftServerIP',
+    'mcsmApiAddress',
+    'emailServiceHost',
+    'mcsmDaemonId',
+    'emailServicePort',
+    'mcsmInstanceId',
+    'emailServiceUsername',
+    'mcsmApikey',
+    'emailServicePassword',
+)
+
+DEFAULT_MINECRAFT_PORT = 25565
+
+
+def _parse_port(value):
+    try:
+        port = int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+    if 0 < port < 65536:
+        return port
+    return None
+
+
+# 解析 "host"、"host:port" 或 "[ipv6]:port" 形式的服务器地址
+def parse_server_address(value, default_port):
+    if not value:
+        return None, None
+    value = str(value).strip()
+    if value.startswith('['):
+        host, _, rest = value[1:].partition(']')
+        port = _parse_port(rest[1:]) if rest.startswith(':') else None
+        return host, port or default_port
+    if value.count(':') == 1:
+        host, _, port = value.partition(':')
+        return host, _parse_port(port) or default_port
+    return value, default_port
+
+
+# 解析后的设置对象，热点代码直接读取属性，不再查询和转换
+class Settings:
+    __slots__ = (
+        'id', 'raw',
+        'minecraft_server_ip', 'minecraft_server_host', 'minecraft_server_port',
+        'mcsm_api_address', 'mcsm_daemon_id', 'mcsm_instance_id', 'mcsm_apikey',
+        'email_service_host', 'email_service_port', 'email_service_username', 'email_service_password',
+    )
+
+    def __init__(self, row_id, raw):
+        self.id = row_id
+        self.raw = raw
+        self.minecraft_server_ip = raw['minecraftServerIP']
+        self.minecraft_server_host, self.minecraft_server_port = parse_server_address(
+            raw['minecraftServerIP'], DEFAULT_MINECRAFT_PORT)
+        self.mcsm_api_address = (raw['mcsmApiAddress'] or '').rstrip('/')
+        self.mcsm_daemon_id = raw['mcsmDaemonId']
+        self.mcsm_instance_id = raw['mcsmInstanceId']
+        self.mcsm_apikey = raw['mcsmApikey']
+        self.email_service_host = raw['emailServiceHost']
+        self.email_service_port = _parse_port(raw['emailServicePort'])
+        self.email_service_username = raw['emailServiceUsername']
+        self.email_service_password = raw['emailServicePassword']
+
+    # 与数据库中保存的原始值一致，供 /settings/get 返回
+    def to_dict(self):
+        return dict(self.raw)
+
+
+# 设置读缓存：用一个专用连接上的 PRAGMA data_version 判断数据是否被其他连接（包括其他进程）修改过
+class SettingsCache:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._version = None
+        self._settings = None
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def _connection(self):
+        # fork 之后的子进程不能继续使用父进程的连接
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+            self._pid = os.getpid()
+            self._loaded = False
+        return self._conn
+
+    def _load(self, conn):
+        try:
+            cursor = conn.execute(
+                f'SELECT id, {", ".join(SETTINGS_FIELDS)} FROM settings ORDER BY id LIMIT 1')
+        except sqlite3.OperationalError:
+            # settings 表尚未创建
+            return None
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return Settings(row[0], dict(zip(SETTINGS_FIELDS, row[1:])))
+
+    # 返回 Settings 对象，尚未保存过设置时返回 None
+    def get(self):
+        with self._lock:
+            conn = self._connection()
+            version = conn.execute('PRAGMA data_version').fetchone()[0]
+            if self._loaded and version == self._version:
+                self.hits += 1
+                return self._settings
+            self.misses += 1
+            self._settings = self._load(conn)
+            self._version = version
+            self._loaded = True
+            return self._settings
+
+    # 本进程保存设置后立即调用，下一次 get 必定重新读取
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "data_version": self._version}
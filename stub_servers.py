@@ -0,0 +1,194 @@
+# 本地模拟的外部服务（MCSM 控制台、SMTP 服务器、Minecraft Server List Ping），
+# 供 tests/ 中的测试和 benchmark.py 的压测共用，不依赖真实的服务。
+import json
+import threading
+import time
+
+
+# 本地模拟的 MCSM 控制台接口：记录收到的命令，每 fail_every 个请求返回一次 500，每个请求延迟 latency 秒
+class StubMCSMServer:
+    def __init__(self, latency=0.0, fail_every=0):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qs, urlsplit
+        stub = self
+        self.commands = []
+        self.requests = 0
+        self.connections = set()
+        self.lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # 响应头和响应体分两次写出，不关闭 Nagle 时 keep-alive 连接每个请求会多等一个延迟 ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                query = parse_qs(urlsplit(self.path).query)
+                with stub.lock:
+                    stub.requests += 1
+                    stub.connections.add(self.client_address)
+                    failed = fail_every and stub.requests % fail_every == 0
+                    if not failed:
+                        stub.commands.append(query.get('command', [''])[0])
+                if latency:
+                    time.sleep(latency)
+                status = 500 if failed else 200
+                data = True
+                if urlsplit(self.path).path.endswith('/api/instance'):
+                    data = {"status": 3, "processInfo": {"cpu": 12.5, "memory": 2 << 30},
+                            "info": {"currentPlayers": 3, "maxPlayers": 100}}
+                body = json.dumps({"status": status, "data": None if failed else data}).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        # 默认的 listen backlog 只有 5，并发连接较多时会丢弃 SYN，客户端要等 1 秒重传
+        ThreadingHTTPServer.request_queue_size = 128
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.address = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def reset(self):
+        with self.lock:
+            self.commands = []
+            self.requests = 0
+            self.connections = set()
+
+    def close(self):
+        self.server.shutdown()
+
+
+# 每 fail_every 封邮件返回一次 451（临时错误），收件人域名为 reject.example 时返回 550
+class StubSMTPServer:
+    def __init__(self, latency=0.0, fail_every=0):
+        import socketserver
+        stub = self
+        self.messages = []
+        self.connections = 0
+        self.logins = 0
+        self.data_commands = 0
+        self.lock = threading.Lock()
+
+        class Handler(socketserver.StreamRequestHandler):
+            disable_nagle_algorithm = True
+
+            def reply(self, line):
+                if latency:
+                    time.sleep(latency)
+                self.wfile.write(line.encode() + b'\r\n')
+
+            def handle(self):
+                with stub.lock:
+                    stub.connections += 1
+                self.reply('220 stub ESMTP')
+                recipients = []
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode().strip()
+                    verb = command.split(' ', 1)[0].upper()
+                    if verb in ('EHLO', 'HELO'):
+                        self.wfile.write(b'250-stub\r\n')
+                        self.reply('250 AUTH PLAIN')
+                    elif verb == 'AUTH':
+                        with stub.lock:
+                            stub.logins += 1
+                        self.reply('235 ok')
+                    elif verb == 'MAIL':
+                        recipients = []
+                        self.reply('250 ok')
+                    elif verb == 'RCPT':
+                        if 'reject.example' in command:
+                            self.reply('550 no such user')
+                        else:
+                            recipients.append(command)
+                            self.reply('250 ok')
+                    elif verb == 'DATA':
+                        self.reply('354 go ahead')
+                        while self.rfile.readline() not in (b'.\r\n', b''):
+                            pass
+                        with stub.lock:
+                            stub.data_commands += 1
+                            failed = fail_every and stub.data_commands % fail_every == 0
+                            if not failed:
+                                stub.messages.extend(recipients)
+                        self.reply('451 try again later' if failed else '250 queued')
+                    elif verb == 'QUIT':
+                        self.reply('221 bye')
+                        return
+                    else:
+                        self.reply('250 ok')
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+
+# 本地模拟的 Minecraft 服务器，只实现 Server List Ping：收到握手和状态请求后延迟 latency 秒返回状态 JSON
+class FakeSLPServer:
+    def __init__(self, sample, online=None, latency=0.0, motd='EdenicLand'):
+        import asyncio
+        from server_status import _packet, _string, _read_varint
+        self.pings = 0
+        status = {
+            "version": {"name": "1.20.4", "protocol": 765},
+            "players": {"max": 100, "online": len(sample) if online is None else online,
+                        "sample": [{"name": name, "id": f'00000000-0000-0000-0000-{i:012d}'}
+                                   for i, name in enumerate(sample)]},
+            "description": {"text": motd, "extra": [{"text": " server"}]},
+        }
+        response = _packet(0x00, _string(json.dumps(status)))
+
+        async def handle(reader, writer):
+            try:
+                for _ in range(2):
+                    length = await _read_varint(reader)
+                    await reader.readexactly(length)
+                self.pings += 1
+                if latency:
+                    await asyncio.sleep(latency)
+                writer.write(response)
+                await writer.drain()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        started = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.server = self.loop.run_until_complete(asyncio.start_server(handle, '127.0.0.1', 0))
+            self.port = self.server.sockets[0].getsockname()[1]
+            started.set()
+            self.loop.run_forever()
+            # 停止后关闭监听，取消仍在等待的连接，之后的连接会被拒绝
+            self.server.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
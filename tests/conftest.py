@@ -0,0 +1,91 @@
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 测试中计算 bcrypt 用最低的 cost
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+
+from stub_servers import FakeSLPServer, StubMCSMServer, StubSMTPServer  # noqa: E402
+
+CHECKED_IN_DATABASES = ('users.db', 'player.db', 'settings.db')
+
+
+# 仓库中 users.db / player.db / settings.db 的副本，测试不会修改原文件
+@pytest.fixture
+def db_copies(tmp_path):
+    for name in CHECKED_IN_DATABASES:
+        shutil.copy(os.path.join(ROOT, name), tmp_path / name)
+    return tmp_path
+
+
+@pytest.fixture
+def connect():
+    connections = []
+
+    def open_db(path):
+        conn = sqlite3.connect(str(path))
+        connections.append(conn)
+        return conn
+
+    yield open_db
+    for conn in connections:
+        conn.close()
+
+
+# 连接池按路径缓存在进程中，每个测试结束后关闭，下一个测试的临时目录使用新的连接池
+@pytest.fixture(autouse=True)
+def close_pools():
+    yield
+    from db import close_all_pools
+    close_all_pools()
+
+
+# 轮询等待后台线程达到某个状态
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+# 代替 settings_cache.SettingsCache：get() 返回带有给定属性的设置对象
+def fake_settings_cache(**values):
+    settings = SimpleNamespace(**values)
+    return SimpleNamespace(get=lambda: settings)
+
+
+# 创建模拟服务器的工厂，测试结束后统一关闭
+def _server_factory(server_class):
+    servers = []
+
+    def create(*args, **kwargs):
+        server = server_class(*args, **kwargs)
+        servers.append(server)
+        return server
+
+    yield create
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture
+def mcsm_stub_factory():
+    yield from _server_factory(StubMCSMServer)
+
+
+@pytest.fixture
+def smtp_stub_factory():
+    yield from _server_factory(StubSMTPServer)
+
+
+@pytest.fixture
+def slp_fake_factory():
+    yield from _server_factory(FakeSLPServer)
@@ -0,0 +1,53 @@
+import pytest
+from flask import Flask, jsonify
+
+import tokens
+
+MESSAGES = {"missing": "missing", "invalid": "invalid", "forbidden": "forbidden"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(tokens, 'TOKEN_SECRET', 'test-secret')
+    app = Flask(__name__)
+    tokens.init_auth(app, ('login',), MESSAGES, enabled=True, admin_endpoints=('settings',))
+
+    @app.route('/login', methods=['POST'])
+    def login():
+        return jsonify({}), 200
+
+    @app.route('/players', methods=['GET', 'POST'])
+    def players():
+        return jsonify({}), 200
+
+    @app.route('/settings', methods=['GET'])
+    def settings():
+        return jsonify({}), 200
+
+    return app.test_client()
+
+
+def _auth(role):
+    return {'Authorization': 'Bearer ' + tokens.signer.issue_access(1, role)}
+
+
+def test_public_endpoint_needs_no_token(client):
+    assert client.post('/login').status_code == 200
+    assert client.get('/players').status_code == 401
+
+
+def test_user_can_read_but_not_write(client):
+    assert client.get('/players', headers=_auth('user')).status_code == 200
+    assert client.post('/players', headers=_auth('user')).status_code == 403
+    assert client.post('/players', headers=_auth('admin')).status_code == 200
+
+
+def test_admin_endpoints_reject_user_reads(client):
+    assert client.get('/settings', headers=_auth('user')).status_code == 403
+    assert client.get('/settings', headers=_auth('admin')).status_code == 200
+
+
+def test_auth_requires_token_secret(monkeypatch):
+    monkeypatch.setattr(tokens, 'TOKEN_SECRET', '')
+    with pytest.raises(RuntimeError):
+        tokens.init_auth(Flask(__name__), (), MESSAGES, enabled=True)
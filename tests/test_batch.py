@@ -0,0 +1,59 @@
+import sqlite3
+
+import pytest
+
+from batch import BATCH_IDS, load_batch_ids, run_batch, run_batch_returning, validate_ids
+
+
+@pytest.fixture
+def conn(tmp_path, connect):
+    conn = connect(tmp_path / 'player.db')
+    conn.execute('CREATE TABLE players (game_id TEXT PRIMARY KEY, permission_group TEXT NOT NULL)')
+    conn.executemany('INSERT INTO players VALUES (?, ?)', [(f'p{i}', 'Player') for i in range(50000)])
+    conn.commit()
+    return conn
+
+
+def test_batch_is_not_limited_by_bound_parameters(conn):
+    # 远超 SQLite 默认的 32766 个绑定参数
+    ids = [f'p{i}' for i in range(40000)] + ['p0', 'missing']
+    requested, affected = run_batch(
+        conn, f"UPDATE players SET permission_group = ? WHERE game_id IN {BATCH_IDS}", ('Engineer',), ids)
+    assert (requested, affected) == (40001, 40000)
+    assert conn.execute("SELECT COUNT(*) FROM players WHERE permission_group = 'Engineer'").fetchone()[0] == 40000
+    # 执行后临时表被清空，不会影响连接的下一次使用
+    assert conn.execute('SELECT COUNT(*) FROM temp.batch_ids').fetchone()[0] == 0
+
+
+def test_batch_returning_lists_affected_rows(conn):
+    requested, deleted = run_batch_returning(
+        conn, f'DELETE FROM players WHERE game_id IN {BATCH_IDS} RETURNING game_id', (), ['p1', 'p2', 'nobody'])
+    assert requested == 3
+    assert sorted(deleted) == ['p1', 'p2']
+    assert conn.execute('SELECT COUNT(*) FROM players').fetchone()[0] == 49998
+
+
+def test_failed_batch_is_rolled_back(conn):
+    with pytest.raises(sqlite3.IntegrityError):
+        run_batch(conn, f'UPDATE players SET permission_group = NULL WHERE game_id IN {BATCH_IDS}', (),
+                  ['p1', 'p2'])
+    assert not conn.in_transaction
+    assert conn.execute("SELECT COUNT(*) FROM players WHERE permission_group = 'Player'").fetchone()[0] == 50000
+
+
+def test_reused_connection_starts_with_an_empty_batch(conn):
+    load_batch_ids(conn, ['p1', 'p2', 'p3'])
+    conn.commit()
+    assert load_batch_ids(conn, ['p4']) == 1
+
+
+@pytest.mark.parametrize('ids, id_type, valid', [
+    ([1, 2], int, True),
+    ([1, True], int, False),
+    (['a', 'b'], str, True),
+    (['a', 1], str, False),
+    ('a', str, False),
+    ([], int, True),
+])
+def test_validate_ids(ids, id_type, valid):
+    assert validate_ids(ids, id_type) is valid
@@ -0,0 +1,40 @@
+import pytest
+
+import bootstrap
+from bootstrap import run_once
+
+
+def test_run_once_per_lock_and_function(tmp_path, monkeypatch):
+    monkeypatch.setattr(bootstrap, '_done', set())
+    lock_path = str(tmp_path / '.bootstrap.lock')
+    calls = []
+
+    def init_app():
+        calls.append('app')
+
+    def init_app1():
+        calls.append('app1')
+
+    assert run_once(lock_path, init_app) is True
+    assert run_once(lock_path, init_app) is False
+    # 共用锁文件的另一个初始化函数仍然执行
+    assert run_once(lock_path, init_app1) is True
+    assert run_once(str(tmp_path / 'other.lock'), init_app) is True
+    assert calls == ['app', 'app1', 'app']
+    assert 'bootstrap_ms' in bootstrap.startup_stats
+
+
+def test_failed_bootstrap_is_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(bootstrap, '_done', set())
+    lock_path = str(tmp_path / '.bootstrap.lock')
+    attempts = []
+
+    def init():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError('database is locked')
+
+    with pytest.raises(RuntimeError):
+        run_once(lock_path, init)
+    assert run_once(lock_path, init) is True
+    assert len(attempts) == 2
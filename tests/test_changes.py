@@ -0,0 +1,90 @@
+import pytest
+
+import migrations
+from changes import fetch_changes
+from migrations import migrate, PLAYERS_MIGRATIONS
+
+COLUMNS = ('game_id', 'permission_group')
+
+
+def _row_to_dict(row):
+    return {"game_id": row[0], "permission_group": row[1]}
+
+
+def _changes(conn, since, limit=100):
+    return fetch_changes(conn, 'player_changes', 'players', 'game_id', COLUMNS, since, limit, _row_to_dict)
+
+
+@pytest.fixture
+def conn(tmp_path, connect):
+    conn = connect(tmp_path / 'player.db')
+    migrate(conn, PLAYERS_MIGRATIONS)
+    return conn
+
+
+def _insert(conn, *game_ids):
+    conn.executemany("INSERT INTO players (game_id, permission_group) VALUES (?, 'Player')",
+                     [(game_id,) for game_id in game_ids])
+    conn.commit()
+
+
+def test_missing_since_asks_for_a_resync(conn):
+    _insert(conn, 'Steve')
+    feed = _changes(conn, None)
+    assert feed['resync'] is True
+    assert feed['next_since'] == feed['latest_seq'] == 1
+    # 超过最新 seq 的 since 同样需要重新全量加载
+    assert _changes(conn, 99)['resync'] is True
+
+
+def test_changes_are_collapsed_to_the_current_row(conn):
+    _insert(conn, 'Steve', 'Alex')
+    since = _changes(conn, None)['next_since']
+
+    conn.execute("UPDATE players SET permission_group = 'Engineer' WHERE game_id = 'Steve'")
+    conn.execute("UPDATE players SET permission_group = 'Admin' WHERE game_id = 'Steve'")
+    conn.execute("DELETE FROM players WHERE game_id = 'Alex'")
+    _insert(conn, 'Herobrine')
+    feed = _changes(conn, since)
+
+    assert feed['resync'] is False
+    assert [(change['op'], change['key']) for change in feed['changes']] == [
+        ('upsert', 'Steve'), ('delete', 'Alex'), ('upsert', 'Herobrine')]
+    assert feed['changes'][0]['data'] == {'game_id': 'Steve', 'permission_group': 'Admin'}
+    assert feed['changes'][1]['data'] is None
+    assert feed['next_since'] == feed['latest_seq']
+    assert _changes(conn, feed['next_since'])['changes'] == []
+
+
+def test_renamed_key_is_reported_as_delete_and_upsert(conn):
+    _insert(conn, 'Steve')
+    since = _changes(conn, None)['next_since']
+    conn.execute("UPDATE players SET game_id = 'Notch' WHERE game_id = 'Steve'")
+    conn.commit()
+    ops = {change['key']: change['op'] for change in _changes(conn, since)['changes']}
+    assert ops == {'Notch': 'upsert', 'Steve': 'delete'}
+
+
+def test_changes_are_paged_by_seq(conn):
+    _insert(conn, *[f'p{i}' for i in range(7)])
+    since, keys = 0, []
+    while True:
+        feed = _changes(conn, since, limit=3)
+        keys.extend(change['key'] for change in feed['changes'])
+        since = feed['next_since']
+        if not feed['has_more']:
+            break
+    assert keys == [f'p{i}' for i in range(7)]
+    assert since == 7
+
+
+def test_compacted_log_asks_for_a_resync(tmp_path, connect, monkeypatch):
+    monkeypatch.setattr(migrations, 'CHANGE_LOG_RETENTION', 500)
+    conn = connect(tmp_path / 'player.db')
+    migrate(conn, PLAYERS_MIGRATIONS)
+    _insert(conn, *[f'p{i}' for i in range(1000)])
+
+    assert _changes(conn, 100)['resync'] is True
+    feed = _changes(conn, 500, limit=1000)
+    assert feed['resync'] is False
+    assert len(feed['changes']) == 500
@@ -0,0 +1,25 @@
+import pytest
+
+from dates import normalize_date, parse_date_range
+
+
+@pytest.mark.parametrize('value', [
+    '2025-01-31', '2025/1/31', '2025.01.31', '20250131', '2025年1月31日', ' 2025-01-31 ',
+    '2025-01-31T08:30', '2025-01-31 08:30:15', '2025-01-31T08:30:15.123456Z', '2025-01-31T08:30:15+08:00',
+])
+def test_accepted_formats(value):
+    assert normalize_date(value) == '2025-01-31'
+
+
+@pytest.mark.parametrize('value', [
+    '2025-01-31 garbage', '2025-01-31T', '2025-01-31 8', '2025-01-31T08:30junk', '2025-02-30', '31/01/2025',
+])
+def test_rejected_values(value):
+    with pytest.raises(ValueError):
+        normalize_date(value)
+
+
+def test_empty_values():
+    assert normalize_date(None) is None
+    assert normalize_date('  ') is None
+    assert parse_date_range('2025-01-01,') == ('2025-01-01', None)
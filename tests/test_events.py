@@ -0,0 +1,124 @@
+import socket
+import sqlite3
+
+import pytest
+
+import events
+from conftest import wait_for
+from events import EventBroker
+from migrations import migrate, EVENTS_MIGRATIONS
+
+
+@pytest.fixture
+def broker_factory(tmp_path, monkeypatch):
+    monkeypatch.setattr(events, 'OUTBOX_POLL_INTERVAL', 0.01)
+    brokers = []
+
+    def create(outbox=True):
+        broker = EventBroker()
+        if outbox:
+            broker.outbox_path = str(tmp_path / 'events.db')
+            with sqlite3.connect(broker.outbox_path) as conn:
+                migrate(conn, EVENTS_MIGRATIONS)
+        broker.start('127.0.0.1', 0)
+        brokers.append(broker)
+        return broker
+
+    yield create
+    for broker in brokers:
+        broker.stop()
+
+
+class _SSEClient:
+    def __init__(self, port, path='/events', headers=()):
+        self.sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+        head = f'GET {path} HTTP/1.1\r\nHost: localhost\r\n' + ''.join(f'{h}\r\n' for h in headers) + '\r\n'
+        self.sock.sendall(head.encode())
+        self.buffer = b''
+
+    def read_until(self, marker):
+        while marker not in self.buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                break
+            self.buffer += data
+        return self.buffer.decode()
+
+    def close(self):
+        self.sock.close()
+
+
+def test_outbox_events_are_delivered_in_order(broker_factory):
+    broker = broker_factory()
+    client = _SSEClient(broker.port)
+    assert 'text/event-stream' in client.read_until(b'retry:')
+    wait_for(lambda: broker.stats()['clients'] == 1)
+
+    broker.publish('player.added', {"game_id": "史蒂夫"})
+    broker.publish('player.removed', {"game_id": "Alex"})
+    body = client.read_until(b'player.removed').split('\r\n\r\n', 1)[1]
+    assert 'id: 1\nevent: player.added\ndata: {"game_id":"史蒂夫"}\n\n' in body
+    assert body.index('player.added') < body.index('player.removed')
+    client.close()
+
+    # 断线重连时按 Last-Event-ID 补发之后的事件
+    client = _SSEClient(broker.port, headers=['Last-Event-ID: 1'])
+    body = client.read_until(b'player.removed')
+    assert 'id: 2\nevent: player.removed' in body
+    assert 'player.added' not in body
+    client.close()
+    assert broker.stats()['delivered'] == 3
+
+
+def test_events_are_delivered_without_outbox(broker_factory):
+    broker = broker_factory(outbox=False)
+    client = _SSEClient(broker.port)
+    client.read_until(b'retry:')
+    wait_for(lambda: broker.stats()['clients'] == 1)
+    broker.publish('ban.changed', {"id": 1})
+    assert 'event: ban.changed' in client.read_until(b'ban.changed')
+    client.close()
+
+
+def test_outbox_write_failure_is_counted(tmp_path):
+    broker = EventBroker()
+    # 事件表尚未迁移
+    broker.outbox_path = str(tmp_path / 'events.db')
+    broker.publish('player.added', {})
+    assert broker.stats()['outbox_errors'] == 1
+
+
+def test_unknown_path_and_rejected_token(broker_factory):
+    broker = broker_factory(outbox=False)
+    client = _SSEClient(broker.port, path='/other')
+    assert client.read_until(b'\r\n\r\n').startswith('HTTP/1.1 404')
+    client.close()
+
+    def authenticate(token):
+        if token != 'good':
+            raise ValueError('invalid token')
+
+    broker.authenticate = authenticate
+    client = _SSEClient(broker.port, path='/events?access_token=bad')
+    assert client.read_until(b'\r\n\r\n').startswith('HTTP/1.1 401')
+    client.close()
+    client = _SSEClient(broker.port, path='/events?access_token=good')
+    assert client.read_until(b'retry:').startswith('HTTP/1.1 200')
+    client.close()
+
+
+def test_slow_client_is_dropped(broker_factory, monkeypatch):
+    monkeypatch.setattr(events, 'CLIENT_BUFFER_SIZE', 2)
+    broker = broker_factory(outbox=False)
+    client = _SSEClient(broker.port)
+    client.read_until(b'retry:')
+    wait_for(lambda: broker.stats()['clients'] == 1)
+
+    # 不读取数据，直到发送缓冲区和客户端队列都被填满
+    for _ in range(5000):
+        broker.publish('player.added', {"padding": 'x' * 1024})
+        if broker.stats()['dropped_clients']:
+            break
+    wait_for(lambda: broker.stats()['dropped_clients'] == 1)
+    assert broker.stats()['clients'] == 0
+    client.close()
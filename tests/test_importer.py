@@ -0,0 +1,43 @@
+import io
+
+from importer import import_players
+from migrations import migrate, PLAYERS_MIGRATIONS
+
+GROUPS = ('Player', 'Graduate Engineer', 'Engineer', 'Senior Engineer', 'Admin')
+
+
+def _players_db(tmp_path, connect):
+    conn = connect(tmp_path / 'player.db')
+    migrate(conn, PLAYERS_MIGRATIONS)
+    conn.executemany("INSERT INTO players (game_id, permission_group) VALUES (?, ?)",
+                     [('Steve', 'Player'), ('Alex', 'Engineer')])
+    conn.commit()
+    return conn
+
+
+CSV = 'game_id,permission_group\nSteve,Admin\nAlex,Engineer\nHerobrine,Player\nHerobrine,Admin\n'
+
+
+def test_upsert_tracks_added_and_group_changes(tmp_path, connect):
+    conn = _players_db(tmp_path, connect)
+    report = import_players(conn, io.StringIO(CSV), 'csv', 'upsert', GROUPS, track_changes=True)
+    assert report.added == [('Herobrine', 'Admin')]
+    assert report.group_changed == [('Steve', 'Admin')]
+    assert dict(conn.execute('SELECT game_id, permission_group FROM players')) == {
+        'Steve': 'Admin', 'Alex': 'Engineer', 'Herobrine': 'Admin'}
+
+
+def test_skip_tracks_only_new_players(tmp_path, connect):
+    conn = _players_db(tmp_path, connect)
+    report = import_players(conn, io.StringIO(CSV), 'csv', 'skip', GROUPS, batch_size=2, track_changes=True)
+    assert report.written == 1
+    assert report.added == [('Herobrine', 'Player')]
+    assert report.group_changed == []
+
+
+def test_malformed_csv_record_is_reported(tmp_path, connect):
+    conn = _players_db(tmp_path, connect)
+    text = 'game_id,permission_group\n"unterminated,Player\n'
+    report = import_players(conn, io.StringIO(text), 'csv', 'skip', GROUPS)
+    assert report.failed == 1
+    assert report.added == []
@@ -0,0 +1,48 @@
+import os
+
+from flask import Flask, request
+
+from login_throttle import LoginThrottle, init_proxy_fix
+
+
+def _app(trusted):
+    app = Flask(__name__)
+    init_proxy_fix(app, trusted)
+
+    @app.route('/ip')
+    def ip():
+        return request.remote_addr
+
+    return app.test_client()
+
+
+def test_forwarded_for_ignored_without_trusted_proxies():
+    client = _app(0)
+    response = client.get('/ip', headers={'X-Forwarded-For': '203.0.113.7'}, environ_base={'REMOTE_ADDR': '10.0.0.1'})
+    assert response.text == '10.0.0.1'
+
+
+def test_trusted_proxy_sets_client_address():
+    client = _app(1)
+    response = client.get('/ip', headers={'X-Forwarded-For': '198.51.100.1, 203.0.113.7'},
+                          environ_base={'REMOTE_ADDR': '10.0.0.1'})
+    # 只信任最后一层代理追加的地址
+    assert response.text == '203.0.113.7'
+
+
+def test_shared_store_is_created_on_first_use(tmp_path):
+    path = str(tmp_path / 'throttle.db')
+    first = LoginThrottle(max_attempts_user=2, store_path=path)
+    # 导入 app 时创建 LoginThrottle，不打开数据库
+    assert not os.path.exists(path)
+
+    assert first.check('Steve', '10.0.0.1') == 0
+    assert os.path.exists(path)
+    # 另一个进程（另一个实例）看到同一份计数
+    second = LoginThrottle(max_attempts_user=2, store_path=path)
+    assert second.check('steve', '10.0.0.2') == 0
+    assert second.check('STEVE', '10.0.0.3') > 0
+    assert first.stats()['entries'] == 4
+
+    first.record_success('Steve', '10.0.0.1')
+    assert second.check('Steve', '10.0.0.4') == 0
@@ -0,0 +1,104 @@
+import sqlite3
+import time
+
+import pytest
+
+import mail_queue
+from conftest import fake_settings_cache, wait_for
+from migrations import migrate, SETTINGS_MIGRATIONS
+
+
+@pytest.fixture
+def queue_factory(tmp_path, monkeypatch):
+    monkeypatch.setattr(mail_queue, 'EMAIL_QUEUE', True)
+    monkeypatch.setattr(mail_queue, 'EMAIL_FROM', '')
+    path = str(tmp_path / 'settings.db')
+    conn = sqlite3.connect(path)
+    migrate(conn, SETTINGS_MIGRATIONS)
+    conn.close()
+
+    def create(stub, username='bot@example.com', **kwargs):
+        settings_cache = fake_settings_cache(email_service_host='127.0.0.1', email_service_port=stub.port,
+                                             email_service_username=username, email_service_password='secret')
+        kwargs.setdefault('rate_limit', 0)
+        kwargs.setdefault('base_backoff', 0.05)
+        return mail_queue.EmailQueue(path, settings_cache, **kwargs)
+
+    return create
+
+
+def _messages(count):
+    return [(f'p{i}@example.com', 'hi', 'hello') for i in range(count)]
+
+
+def test_messages_share_one_login(smtp_stub_factory, queue_factory):
+    stub = smtp_stub_factory()
+    queue = queue_factory(stub)
+    assert queue.enqueue_many(_messages(5) + [('not an address', 'hi', 'hello')]) == 5
+
+    wait_for(lambda: queue.stats()['sent'] == 5)
+    assert len(stub.messages) == 5
+    assert stub.connections == 1
+    assert stub.logins == 1
+
+
+def test_transient_error_is_retried(smtp_stub_factory, queue_factory):
+    # 每 2 封邮件的 DATA 返回一次 451
+    stub = smtp_stub_factory(fail_every=2)
+    queue = queue_factory(stub)
+    queue.enqueue_many(_messages(2))
+
+    wait_for(lambda: queue.stats()['sent'] == 2)
+    stats = queue.stats()
+    assert stats['retried'] >= 1
+    assert stats['failed'] == 0
+    assert stats['queue']['sent'] == 2
+    assert '451' in stats['last_error']
+
+
+def test_permanent_error_fails_without_retry(smtp_stub_factory, queue_factory):
+    stub = smtp_stub_factory()
+    queue = queue_factory(stub)
+    queue.enqueue_many([('nobody@reject.example', 'hi', 'hello'), ('p1@example.com', 'hi', 'hello')])
+
+    wait_for(lambda: queue.stats()['failed'] == 1 and queue.stats()['sent'] == 1)
+    assert queue.stats()['retried'] == 0
+    assert queue.stats()['queue'] == {'pending': 0, 'sent': 1, 'failed': 1}
+
+
+def test_rate_limit_spreads_sending_over_windows(smtp_stub_factory, queue_factory):
+    stub = smtp_stub_factory()
+    queue = queue_factory(stub, rate_limit=3, rate_window=1)
+    start = time.monotonic()
+    queue.enqueue_many(_messages(6))
+
+    wait_for(lambda: len(stub.messages) == 3)
+    time.sleep(0.3)
+    assert len(stub.messages) == 3
+    wait_for(lambda: len(stub.messages) == 6)
+    assert time.monotonic() - start >= 1
+    assert queue.stats()['rate_limited'] >= 1
+
+
+def test_missing_sender_is_a_configuration_error(smtp_stub_factory, queue_factory):
+    stub = smtp_stub_factory()
+    queue = queue_factory(stub, username='')
+    queue.enqueue('p1@example.com', 'hi', 'hello')
+
+    wait_for(lambda: queue.stats()['last_error'] is not None)
+    assert '发件人' in queue.stats()['last_error']
+    assert stub.connections == 0
+    assert queue.stats()['queue']['pending'] == 1
+
+
+def test_lease_is_extended_during_a_slow_batch(smtp_stub_factory, queue_factory, monkeypatch):
+    monkeypatch.setattr(mail_queue, 'EMAIL_LEASE', 0.5)
+    monkeypatch.setattr(mail_queue, 'LEASE_MARGIN', 0.4)
+    # 每封邮件约 6 次往返，每次 20 毫秒
+    stub = smtp_stub_factory(latency=0.02)
+    queue = queue_factory(stub)
+    queue.enqueue_many(_messages(4))
+
+    wait_for(lambda: queue.stats()['sent'] == 4)
+    assert queue.stats()['lease_extensions'] >= 1
+    assert sorted(stub.messages) == sorted(set(stub.messages))
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+import mcsm
+from conftest import fake_settings_cache, wait_for
+
+
+def _sync(monkeypatch, stub, **kwargs):
+    monkeypatch.setattr(mcsm, 'MCSM_SYNC', True)
+    settings_cache = fake_settings_cache(mcsm_api_address=stub.address, mcsm_apikey='key',
+                                         mcsm_daemon_id='daemon', mcsm_instance_id='instance')
+    return mcsm.MCSMSync(settings_cache, **kwargs)
+
+
+def test_pending_commands_are_deduplicated(monkeypatch, mcsm_stub_factory):
+    stub = mcsm_stub_factory()
+    sync = _sync(monkeypatch, stub, flush_interval=0.2)
+    for group in ('Player', 'Engineer', 'Senior Engineer'):
+        sync.permission_group_changed('Steve', group)
+    sync.player_added('Alex', 'Player')
+
+    wait_for(lambda: sync.stats()['sent'] == 3)
+    assert sorted(stub.commands) == ['lp user Alex parent set player', 'lp user Steve parent set senior_engineer',
+                                     'whitelist add Alex']
+    assert sync.stats()['deduplicated'] == 2
+
+
+def test_removing_a_player_drops_its_pending_group_command(monkeypatch, mcsm_stub_factory):
+    stub = mcsm_stub_factory()
+    sync = _sync(monkeypatch, stub, flush_interval=0.2)
+    sync.player_added('Steve', 'Engineer')
+    sync.player_removed('Steve')
+
+    wait_for(lambda: sync.stats()['sent'] == 1)
+    assert stub.commands == ['whitelist remove Steve']
+
+
+def test_invalid_game_ids_are_not_sent(monkeypatch, mcsm_stub_factory):
+    stub = mcsm_stub_factory()
+    sync = _sync(monkeypatch, stub, flush_interval=0.01)
+    sync.player_added('bad id\nop me')
+    assert sync.stats()['invalid'] == 1
+    assert sync.stats()['enqueued'] == 0
+
+
+def test_failed_command_is_retried_after_backoff(monkeypatch, mcsm_stub_factory):
+    # 第一个请求失败，第二个成功
+    stub = mcsm_stub_factory(fail_every=2)
+    stub.requests = 1
+    sync = _sync(monkeypatch, stub, flush_interval=0.01, base_backoff=0.3)
+    start = time.monotonic()
+    sync.player_removed('Steve')
+
+    wait_for(lambda: sync.stats()['sent'] == 1)
+    assert time.monotonic() - start >= 0.3
+    assert stub.commands == ['whitelist remove Steve']
+    stats = sync.stats()
+    assert stats['retried'] == 1
+    assert stats['failed'] == 0
+    assert 'HTTP 500' in stats['last_error']
+
+
+def test_command_fails_after_max_attempts(monkeypatch, mcsm_stub_factory):
+    stub = mcsm_stub_factory(fail_every=1)
+    sync = _sync(monkeypatch, stub, flush_interval=0.01, base_backoff=0.01, max_attempts=3)
+    sync.player_removed('Steve')
+
+    wait_for(lambda: sync.stats()['failed'] == 1)
+    assert stub.requests == 3
+    assert stub.commands == []
+    assert sync.stats()['pending'] == 0
+
+
+def test_disabled_sync_enqueues_nothing(monkeypatch, mcsm_stub_factory):
+    stub = mcsm_stub_factory()
+    sync = _sync(monkeypatch, stub)
+    monkeypatch.setattr(mcsm, 'MCSM_SYNC', False)
+    sync.player_added('Steve', 'Player')
+    assert sync.stats()['enqueued'] == 0
+
+
+def test_enqueue_does_not_wait_for_a_slow_server(monkeypatch, mcsm_stub_factory):
+    stub = mcsm_stub_factory(latency=1.0)
+    sync = _sync(monkeypatch, stub, flush_interval=0.01)
+    sync.player_added('Steve')
+    wait_for(lambda: stub.requests == 1)
+
+    # 第一条命令仍在等待 MCSM 响应时，入队应立即返回
+    start = time.monotonic()
+    sync.player_added('Alex')
+    assert time.monotonic() - start < 0.2
+    wait_for(lambda: sync.stats()['sent'] == 2)
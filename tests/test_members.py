@@ -0,0 +1,97 @@
+import json
+import sqlite3
+
+import pytest
+
+from members import MEMBER_SORT_FIELDS, members_attach, member_row_to_dict, parse_member_filters
+from migrations import migrate, USERS_MIGRATIONS, PLAYERS_MIGRATIONS
+from pagination import paginate, parse_page_args
+
+PERMISSION_GROUPS = ('Player', 'Graduate Engineer', 'Engineer', 'Senior Engineer', 'Admin')
+
+
+@pytest.fixture
+def member_dbs(tmp_path):
+    players, users = str(tmp_path / 'player.db'), str(tmp_path / 'users.db')
+    with sqlite3.connect(users) as conn:
+        migrate(conn, USERS_MIGRATIONS)
+        conn.executemany('INSERT INTO users (username, email, password, is_active) VALUES (?, ?, ?, ?)', [
+            ('alice', 'Alice@Example.com', '', 1),
+            ('bob', 'bob@example.com', '', 0),
+            ('erin', 'erin@example.com', '', 0),
+        ])
+    with sqlite3.connect(players) as conn:
+        migrate(conn, PLAYERS_MIGRATIONS)
+        conn.executemany('INSERT INTO players (game_id, qq, email, permission_group, join_date) VALUES (?, ?, ?, ?, ?)', [
+            ('Alice', '1', ' alice@example.com', 'Admin', '2023-01-01'),
+            ('Bob', '2', 'BOB@example.com', 'Player', '2023-02-01'),
+            ('Carol', '3', 'carol@example.com', 'Player', None),
+            ('Dave', '4', '', 'Engineer', '2023-03-01'),
+            ('Erin', '5', 'erin@example.com', 'Player', '2023-04-01'),
+        ])
+    return players, users
+
+
+# 与 app.py 的 /members 路由相同的调用方式
+def _members(member_dbs, args):
+    players, users = member_dbs
+    page = parse_page_args(args, MEMBER_SORT_FIELDS)
+    select_sql, conditions, params = parse_member_filters(args, PERMISSION_GROUPS)
+    response = paginate(players, select_sql, conditions, params, page, 'game_id', member_row_to_dict,
+                        attach=members_attach(users))
+    return json.loads(response.get_data())
+
+
+def _all_pages(member_dbs, args):
+    items = []
+    after = None
+    while True:
+        body = _members(member_dbs, {**args, **({'after': after} if after else {})})
+        items.extend(body['items'])
+        if not body['has_more']:
+            return items
+        after = body['next_after']
+
+
+def test_members_join_accounts_by_normalized_email(member_dbs):
+    items = {item['game_id']: item for item in _members(member_dbs, {'limit': '10'})['items']}
+
+    assert list(items) == ['Alice', 'Bob', 'Carol', 'Dave', 'Erin']
+    assert items['Alice']['account'] == {'id': 1, 'username': 'alice', 'is_banned': False}
+    assert items['Bob']['account'] == {'id': 2, 'username': 'bob', 'is_banned': True}
+    assert items['Carol']['account'] is None
+    # 空邮箱不会关联到任何账号
+    assert items['Dave']['account'] is None
+
+
+@pytest.mark.parametrize('args, expected', [
+    ({'permission_group': 'Player'}, ['Bob', 'Carol', 'Erin']),
+    ({'has_account': 'true'}, ['Alice', 'Bob', 'Erin']),
+    ({'has_account': 'false'}, ['Carol', 'Dave']),
+    ({'banned': 'true'}, ['Bob', 'Erin']),
+    ({'banned': 'false'}, ['Alice']),
+    ({'banned': '1', 'permission_group': 'Player'}, ['Bob', 'Erin']),
+])
+def test_members_filters(member_dbs, args, expected):
+    items = _members(member_dbs, {'limit': '10', **args})['items']
+    assert [item['game_id'] for item in items] == expected
+
+
+def test_members_invalid_filters_are_rejected():
+    with pytest.raises(ValueError):
+        parse_member_filters({'permission_group': 'Owner'}, PERMISSION_GROUPS)
+    with pytest.raises(ValueError):
+        parse_member_filters({'banned': 'yes'}, PERMISSION_GROUPS)
+
+
+@pytest.mark.parametrize('args', [
+    {},
+    {'order': 'desc'},
+    {'sort': 'join_date'},
+    {'sort': 'join_date', 'order': 'desc'},
+    {'banned': 'true', 'sort': 'join_date', 'order': 'desc'},
+])
+def test_members_keyset_pages_cover_every_row_once(member_dbs, args):
+    expected = [item['game_id'] for item in _members(member_dbs, {'limit': '10', **args})['items']]
+    paged = [item['game_id'] for item in _all_pages(member_dbs, {'limit': '2', **args})]
+    assert paged == expected
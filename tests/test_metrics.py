@@ -0,0 +1,19 @@
+import sqlite3
+
+from db import get_db
+from metrics import render_metrics
+
+
+def test_pool_series_are_unique_per_attach(tmp_path):
+    players, users = str(tmp_path / 'player.db'), str(tmp_path / 'users.db')
+    sqlite3.connect(users).close()
+    with get_db(players) as conn:
+        conn.execute('SELECT 1')
+    with get_db(players, (('users', users),)) as conn:
+        conn.execute('SELECT 1 FROM users.sqlite_master')
+
+    samples = [line.rsplit(' ', 1)[0] for line in render_metrics().splitlines()
+               if line.startswith('db_pool_') and 'player.db' in line]
+    assert len(samples) == len(set(samples))
+    assert 'db_pool_connections{database="player.db",attach=""}' in samples
+    assert 'db_pool_connections{database="player.db",attach="users"}' in samples
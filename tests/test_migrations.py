@@ -0,0 +1,129 @@
+import sqlite3
+
+import bcrypt
+import pytest
+
+from migrations import (migrate, schema_version, USERS_MIGRATIONS, SETTINGS_MIGRATIONS, PLAYERS_MIGRATIONS,
+                        EVENTS_MIGRATIONS)
+
+
+def _latest(migrations):
+    return migrations[-1][0]
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def _names(conn, kind):
+    return {row[0] for row in conn.execute('SELECT name FROM sqlite_master WHERE type = ?', (kind,))}
+
+
+def test_users_db_migrates_to_latest(db_copies, connect):
+    conn = connect(db_copies / 'users.db')
+    before = conn.execute('SELECT username, email, password, is_active FROM users ORDER BY username').fetchall()
+
+    assert migrate(conn, USERS_MIGRATIONS) == _latest(USERS_MIGRATIONS)
+    assert schema_version(conn) == _latest(USERS_MIGRATIONS)
+
+    assert {'id', 'username', 'email', 'password', 'is_active', 'role'} <= _columns(conn, 'users')
+    assert {'table_versions', 'user_changes', 'change_log_state'} <= _names(conn, 'table')
+    assert 'idx_users_email_norm' in _names(conn, 'index')
+
+    after = conn.execute('SELECT username, email, password, is_active, role FROM users ORDER BY username').fetchall()
+    assert [row[:2] + row[3:4] for row in before] == [row[:2] + row[3:4] for row in after]
+    # 明文密码已替换为可以校验原密码的 bcrypt 哈希
+    for (_, _, plaintext, _), (username, _, hashed, _, role) in zip(before, after):
+        assert bcrypt.checkpw(plaintext.encode('utf-8'), bytes(hashed))
+        assert role == ('admin' if username == 'admin' else 'user')
+
+
+def test_settings_db_migrates_to_latest(db_copies, connect):
+    conn = connect(db_copies / 'settings.db')
+    before = conn.execute('SELECT * FROM settings').fetchall()
+
+    assert migrate(conn, SETTINGS_MIGRATIONS) == _latest(SETTINGS_MIGRATIONS)
+
+    assert {'settings', 'email_queue', 'servers'} <= _names(conn, 'table')
+    # 事件发件箱在单独的数据库中
+    assert 'event_outbox' not in _names(conn, 'table')
+    assert conn.execute('SELECT * FROM settings').fetchall() == before
+    assert conn.execute("SELECT COUNT(*) FROM servers WHERE name = 'default'").fetchone()[0] == 1
+
+
+def test_player_db_migrates_to_latest(db_copies, connect):
+    conn = connect(db_copies / 'player.db')
+    count = conn.execute('SELECT COUNT(*) FROM players').fetchone()[0]
+
+    assert migrate(conn, PLAYERS_MIGRATIONS) == _latest(PLAYERS_MIGRATIONS)
+
+    assert {'idx_players_permission_group', 'idx_players_email', 'idx_players_qq', 'idx_players_join_date',
+            'idx_players_leave_date', 'idx_players_email_norm'} <= _names(conn, 'index')
+    assert {'table_versions', 'player_changes', 'player_stats_groups', 'player_stats_dates', 'players_fts',
+            'players_fts_keys'} <= _names(conn, 'table')
+    assert conn.execute('SELECT COUNT(*) FROM players').fetchone()[0] == count
+    assert conn.execute('SELECT COUNT(*) FROM players_fts').fetchone()[0] == count
+    # 日期已规范化为 YYYY-MM-DD
+    assert conn.execute(
+        "SELECT COUNT(*) FROM players WHERE join_date IS NOT NULL AND join_date NOT GLOB "
+        "'[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'").fetchone()[0] == 0
+
+
+def test_migrate_is_idempotent(db_copies, connect):
+    for name, migrations in (('users.db', USERS_MIGRATIONS), ('settings.db', SETTINGS_MIGRATIONS),
+                             ('player.db', PLAYERS_MIGRATIONS), ('events.db', EVENTS_MIGRATIONS)):
+        conn = connect(db_copies / name)
+        migrate(conn, migrations)
+        schema = conn.execute('SELECT type, name, sql FROM sqlite_master ORDER BY name').fetchall()
+        assert migrate(conn, migrations) == _latest(migrations)
+        assert conn.execute('SELECT type, name, sql FROM sqlite_master ORDER BY name').fetchall() == schema
+
+
+# 旧版 app1.py 的 users 表：username 为主键，email 可以为空、可以重复
+def test_legacy_users_table_with_duplicate_emails(tmp_path, connect):
+    conn = connect(tmp_path / 'users.db')
+    conn.execute('CREATE TABLE users (username TEXT PRIMARY KEY, password TEXT, email TEXT, is_active INTEGER)')
+    hashed = bcrypt.hashpw(b'secret', bcrypt.gensalt(4))
+    conn.executemany('INSERT INTO users VALUES (?, ?, ?, ?)', [
+        ('alice', sqlite3.Binary(hashed), 'shared@example.com', 1),
+        ('bob', 'plain-bob', ' Shared@Example.com', 1),
+        ('carol', 'plain-carol', None, 0),
+    ])
+    conn.commit()
+
+    assert migrate(conn, USERS_MIGRATIONS) == _latest(USERS_MIGRATIONS)
+
+    rows = {row[0]: row[1:] for row in conn.execute('SELECT username, email, password, is_active FROM users')}
+    assert rows['alice'][0] == 'shared@example.com'
+    assert rows['bob'][0] == 'bob@localhost'
+    assert rows['carol'][0] == 'carol@localhost'
+    assert rows['carol'][2] == 0
+    # 已有的 bcrypt 哈希保持不变，明文密码被哈希
+    assert bytes(rows['alice'][1]) == hashed
+    assert bcrypt.checkpw(b'plain-bob', bytes(rows['bob'][1]))
+    # 被替换的原始邮箱保留下来，空邮箱没有需要保留的内容
+    conflicts = conn.execute('SELECT username, email FROM user_email_conflicts').fetchall()
+    assert conflicts == [('bob', ' Shared@Example.com')]
+
+
+# 迁移 8 之前的 users 表允许只有大小写或首尾空格不同的邮箱
+def test_case_duplicate_emails_are_made_unique(tmp_path, connect):
+    conn = connect(tmp_path / 'users.db')
+    migrate(conn, USERS_MIGRATIONS[:7])
+    conn.executemany('INSERT INTO users (username, email, password) VALUES (?, ?, ?)', [
+        ('a1', 'Player@Example.com', ''),
+        ('a2', 'player@example.com ', ''),
+        ('b1', 'other@example.com', ''),
+    ])
+    conn.commit()
+
+    assert migrate(conn, USERS_MIGRATIONS) == _latest(USERS_MIGRATIONS)
+
+    emails = dict(conn.execute('SELECT username, email FROM users'))
+    assert emails == {'a1': 'Player@Example.com', 'a2': 'a2@localhost', 'b1': 'other@example.com'}
+    conflicts = conn.execute('''
+        SELECT c.username, c.email FROM user_email_conflicts c JOIN users u ON u.id = c.user_id
+    ''').fetchall()
+    assert conflicts == [('a2', 'player@example.com ')]
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO users (username, email, password) VALUES ('c1', ' OTHER@example.com', '')")
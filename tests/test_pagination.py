@@ -0,0 +1,106 @@
+import json
+import sqlite3
+
+import pytest
+
+from pagination import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, PageArgs, decode_cursor, encode_cursor, paginate,
+                        parse_page_args)
+
+SORT_FIELDS = ('game_id', 'join_date')
+SELECT_SQL = 'SELECT game_id, join_date FROM players'
+
+
+def _row_to_dict(row):
+    return {"game_id": row[0], "join_date": row[1]}
+
+
+@pytest.fixture
+def players_db(tmp_path):
+    path = str(tmp_path / 'player.db')
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE players (game_id TEXT PRIMARY KEY, join_date TEXT)')
+        # join_date 有重复值和 NULL，游标必须用主键区分同值的行
+        conn.executemany('INSERT INTO players VALUES (?, ?)', [
+            (f'p{i:02d}', None if i % 4 == 0 else f'2023-0{i % 3 + 1}-01') for i in range(20)
+        ])
+    return path
+
+
+def _page(path, args):
+    page = parse_page_args(args, SORT_FIELDS)
+    return json.loads(paginate(path, SELECT_SQL, [], [], page, 'game_id', _row_to_dict).get_data())
+
+
+def test_cursor_round_trip():
+    for sort_value, key in [('2023-01-01', 'Steve'), (None, 'p00'), ('工程师', 42)]:
+        cursor = encode_cursor(sort_value, key)
+        assert '=' not in cursor
+        assert decode_cursor(cursor) == [sort_value, key]
+
+
+@pytest.mark.parametrize('cursor', ['not base64!', encode_cursor('a', 'b')[:-2] + '$$', 'e30'])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_parse_page_args():
+    assert parse_page_args({}, SORT_FIELDS) is None
+    page = parse_page_args({'sort': 'join_date'}, SORT_FIELDS)
+    assert (page.limit, page.sort, page.order, page.after) == (DEFAULT_PAGE_SIZE, 'join_date', 'asc', None)
+    assert parse_page_args({'limit': '100000'}, SORT_FIELDS).limit == MAX_PAGE_SIZE
+    # 流式输出默认不限制行数，也不受 MAX_PAGE_SIZE 限制
+    assert parse_page_args({'stream': 'ndjson'}, SORT_FIELDS).limit is None
+    assert parse_page_args({'stream': 'json', 'limit': '5000'}, SORT_FIELDS).limit == 5000
+    for args in ({'limit': '0'}, {'limit': 'x'}, {'sort': 'qq'}, {'order': 'up'}, {'stream': 'csv'}):
+        with pytest.raises(ValueError):
+            parse_page_args(args, SORT_FIELDS)
+
+
+@pytest.mark.parametrize('sort', SORT_FIELDS)
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_pages_cover_every_row_once_including_null_sort_keys(players_db, sort, order):
+    direction = order.upper()
+    with sqlite3.connect(players_db) as conn:
+        expected = [row[0] for row in conn.execute(
+            f'{SELECT_SQL} ORDER BY {sort} {direction}, game_id {direction}')]
+
+    seen = []
+    args = {'limit': '3', 'sort': sort, 'order': order}
+    while True:
+        body = _page(players_db, args)
+        seen.extend(item['game_id'] for item in body['items'])
+        if not body['has_more']:
+            assert body['next_after'] is None
+            break
+        args['after'] = body['next_after']
+    assert seen == expected
+
+
+def test_cursor_on_null_sort_key(players_db):
+    # 升序时 NULL 排在最前，游标落在 NULL 上之后还要继续输出非 NULL 的行；降序时 NULL 排在最后
+    asc = _page(players_db, {'sort': 'join_date', 'limit': '2'})
+    assert [item['join_date'] for item in asc['items']] == [None, None]
+    assert decode_cursor(asc['next_after']) == [None, 'p04']
+    rest = _page(players_db, {'sort': 'join_date', 'after': asc['next_after'], 'limit': '100'})
+    assert [item['game_id'] for item in rest['items'][:3]] == ['p08', 'p12', 'p16']
+    assert rest['items'][3]['join_date'] is not None
+
+    after = encode_cursor(None, 'p12')
+    desc = _page(players_db, {'sort': 'join_date', 'order': 'desc', 'after': after})
+    assert [item['game_id'] for item in desc['items']] == ['p08', 'p04', 'p00']
+
+
+@pytest.mark.parametrize('fmt, mimetype', [('ndjson', 'application/x-ndjson'), ('json', 'application/json')])
+def test_stream_returns_every_row(players_db, fmt, mimetype, monkeypatch):
+    monkeypatch.setattr('pagination.STREAM_BATCH_SIZE', 7)
+    page = PageArgs(None, None, 'game_id', 'asc', fmt)
+    response = paginate(players_db, SELECT_SQL, ['game_id >= ?'], ['p05'], page, 'game_id', _row_to_dict)
+    assert response.mimetype == mimetype
+
+    body = response.get_data(as_text=True)
+    if fmt == 'ndjson':
+        items = [json.loads(line) for line in body.splitlines()]
+    else:
+        items = json.loads(body)
+    assert [item['game_id'] for item in items] == [f'p{i:02d}' for i in range(5, 20)]
@@ -0,0 +1,21 @@
+import subprocess
+import sys
+
+from conftest import ROOT
+from password_hasher import PasswordHasher, hash_cost
+
+
+def test_hash_and_verify():
+    hasher = PasswordHasher(rounds=4, workers=1)
+    hashed = hasher.hash('secret')
+    assert hash_cost(hashed) == 4
+    assert hasher.verify('secret', hashed)
+    assert not hasher.verify('wrong', hashed)
+    # 数据库中不是合法 bcrypt 哈希的值校验失败而不是抛出异常
+    assert not hasher.verify('secret', b'plaintext')
+
+
+def test_importing_apps_does_not_load_bcrypt():
+    code = 'import sys, app1, migrations; print("bcrypt" in sys.modules)'
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == 'False'
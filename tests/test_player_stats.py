@@ -0,0 +1,82 @@
+import datetime
+import random
+
+import pytest
+
+from migrations import migrate, PLAYERS_MIGRATIONS
+from player_stats import read_player_stats, rebuild_player_stats, verify_player_stats
+
+GROUPS = ('Player', 'Engineer', 'Admin', None)
+DAYS = (None, '2023-01-05', '2023-01-20', '2023-02-01', '2024-06-30')
+
+
+@pytest.fixture
+def conn(tmp_path, connect):
+    conn = connect(tmp_path / 'player.db')
+    migrate(conn, PLAYERS_MIGRATIONS)
+    return conn
+
+
+def test_triggers_keep_stats_equal_to_a_full_scan(conn):
+    rng = random.Random(0)
+    for i in range(300):
+        game_id = f'p{rng.randrange(60)}'
+        action = rng.randrange(4)
+        if action == 0:
+            # 与导入的 upsert 模式相同；INSERT OR REPLACE 删除旧行时不触发 DELETE 触发器
+            conn.execute('INSERT INTO players (game_id, permission_group, join_date, leave_date) VALUES (?, ?, ?, ?) '
+                         'ON CONFLICT(game_id) DO UPDATE SET permission_group = excluded.permission_group, '
+                         'join_date = excluded.join_date, leave_date = excluded.leave_date',
+                         (game_id, rng.choice(GROUPS), rng.choice(DAYS), rng.choice(DAYS)))
+        elif action == 1:
+            conn.execute('UPDATE players SET permission_group = ? WHERE game_id = ?', (rng.choice(GROUPS), game_id))
+        elif action == 2:
+            conn.execute('UPDATE players SET join_date = ?, leave_date = ? WHERE game_id = ?',
+                         (rng.choice(DAYS), rng.choice(DAYS), game_id))
+        else:
+            conn.execute('DELETE FROM players WHERE game_id = ?', (game_id,))
+    conn.commit()
+    assert verify_player_stats(conn) == []
+
+
+def test_read_player_stats(conn):
+    conn.executemany('INSERT INTO players (game_id, permission_group, join_date, leave_date) VALUES (?, ?, ?, ?)', [
+        ('Steve', 'Player', '2023-01-05', None),
+        ('Alex', 'Player', '2023-01-20', '2023-02-01'),
+        ('Herobrine', 'Admin', '2023-02-01', '2099-01-01'),
+        ('Nobody', None, None, None),
+    ])
+    conn.commit()
+
+    stats = read_player_stats(conn, today=datetime.date(2023, 6, 1))
+    assert stats['total'] == 4
+    # 离开日期在 today 之后的玩家仍算在职
+    assert (stats['active'], stats['departed']) == (3, 1)
+    assert stats['permission_groups'] == [{'permission_group': None, 'members': 1},
+                                          {'permission_group': 'Admin', 'members': 1},
+                                          {'permission_group': 'Player', 'members': 2}]
+    assert stats['joins_per_month'] == {'2023-01': 2, '2023-02': 1}
+    assert stats['leaves_per_month'] == {'2023-02': 1, '2099-01': 1}
+    assert stats['as_of'] == '2023-06-01'
+
+
+def test_migration_populates_stats_for_existing_players(tmp_path, connect):
+    conn = connect(tmp_path / 'player.db')
+    migrate(conn, PLAYERS_MIGRATIONS[:7])
+    conn.executemany("INSERT INTO players (game_id, permission_group, join_date) VALUES (?, 'Player', ?)",
+                     [('Steve', '2023/1/5'), ('Alex', '2023-01-20')])
+    conn.commit()
+
+    migrate(conn, PLAYERS_MIGRATIONS)
+    assert verify_player_stats(conn) == []
+    assert read_player_stats(conn)['joins_per_month'] == {'2023-01': 2}
+
+
+def test_rebuild_repairs_drifted_stats(conn):
+    conn.execute("INSERT INTO players (game_id, permission_group) VALUES ('Steve', 'Player')")
+    conn.execute("UPDATE player_stats_groups SET members = 5 WHERE permission_group = 'Player'")
+    conn.commit()
+
+    mismatches = rebuild_player_stats(conn)
+    assert mismatches == [{'table': 'player_stats_groups', 'key': 'Player', 'stored': 5, 'actual': 1}]
+    assert verify_player_stats(conn) == []
@@ -0,0 +1,102 @@
+import sqlite3
+
+import pytest
+from flask import Flask, Response, jsonify, request
+
+import response_cache
+from migrations import migrate, PLAYERS_MIGRATIONS
+from response_cache import ResponseCache, conditional_get
+
+
+@pytest.fixture
+def app_env(tmp_path, monkeypatch):
+    path = str(tmp_path / 'player.db')
+    with sqlite3.connect(path) as conn:
+        migrate(conn, PLAYERS_MIGRATIONS)
+        conn.execute("INSERT INTO players (game_id, permission_group) VALUES ('Steve', 'Player')")
+    cache = ResponseCache()
+    monkeypatch.setattr(response_cache, 'response_cache', cache)
+    calls = []
+    app = Flask(__name__)
+
+    @app.route('/players')
+    @conditional_get(path, 'players')
+    def players():
+        calls.append(request.full_path)
+        if 'stream' in request.args:
+            return Response(iter([b'[]']), mimetype='application/json')
+        with sqlite3.connect(path) as conn:
+            return jsonify([row[0] for row in conn.execute('SELECT game_id FROM players ORDER BY game_id')])
+
+    return app.test_client(), path, cache, calls
+
+
+def _write(path, sql):
+    with sqlite3.connect(path) as conn:
+        conn.execute(sql)
+
+
+def test_if_none_match_returns_304_without_calling_the_view(app_env):
+    client, path, cache, calls = app_env
+    first = client.get('/players')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    second = client.get('/players', headers={'If-None-Match': etag})
+    assert second.status_code == 304
+    assert second.headers['ETag'] == etag
+    assert second.data == b''
+    assert len(calls) == 1
+    assert cache.stats()['not_modified'] == 1
+
+
+def test_cached_body_is_served_until_the_table_changes(app_env):
+    client, path, cache, calls = app_env
+    etag = client.get('/players').headers['ETag']
+    assert client.get('/players').get_json() == ['Steve']
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 1
+
+    _write(path, "INSERT INTO players (game_id, permission_group) VALUES ('Alex', 'Player')")
+    response = client.get('/players', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json() == ['Alex', 'Steve']
+    assert response.headers['ETag'] != etag
+    assert len(calls) == 2
+
+
+def test_query_strings_are_cached_separately(app_env):
+    client, path, cache, calls = app_env
+    a = client.get('/players?sort=game_id').headers['ETag']
+    b = client.get('/players?sort=join_date').headers['ETag']
+    assert a != b
+    assert len(calls) == 2
+    assert cache.stats()['entries'] == 2
+
+
+def test_cursor_pages_and_streams_are_not_cached(app_env):
+    client, path, cache, calls = app_env
+    assert 'ETag' in client.get('/players?after=abc').headers
+    client.get('/players?after=abc')
+    streamed = client.get('/players?stream=json')
+    assert 'ETag' not in streamed.headers
+    client.get('/players?stream=json')
+    assert len(calls) == 4
+    assert cache.stats()['entries'] == 0
+
+
+def test_cache_is_bounded_by_entries_and_bytes():
+    cache = ResponseCache(max_entries=3, max_bytes=10, max_body_bytes=6)
+    cache.put('a', 1, b'aaaa', 'application/json')
+    cache.put('b', 1, b'bbbb', 'application/json')
+    assert cache.get('a', 1) == (b'aaaa', 'application/json')
+    # 超过字节上限时淘汰最久未使用的 b
+    cache.put('c', 1, b'cccc', 'application/json')
+    assert cache.get('b', 1) is None
+    assert cache.stats()['bytes'] == 8
+    # 单个响应体超过上限时不缓存
+    cache.put('d', 1, b'ddddddd', 'application/json')
+    assert cache.get('d', 1) is None
+    assert cache.stats()['too_large'] == 1
+    # 版本不一致视为过期
+    assert cache.get('a', 2) is None
@@ -0,0 +1,63 @@
+import pytest
+
+from migrations import migrate, PLAYERS_MIGRATIONS
+from search import fts_available, search_players
+
+
+@pytest.fixture
+def players(tmp_path, connect):
+    conn = connect(tmp_path / 'player.db')
+    migrate(conn, PLAYERS_MIGRATIONS)
+    conn.executemany('INSERT INTO players (game_id, qq, email, permission_group) VALUES (?, ?, ?, ?)', [
+        ('Steve', '10001', 'steve@example.com', 'Player'),
+        ('SteveJobs', '10002', 'jobs@example.com', 'Player'),
+        ('Alex', '20003', 'alex@steve.net', 'Engineer'),
+        ('Herobrine', '30004', 'hb@example.com', 'Admin'),
+    ])
+    conn.commit()
+    if not fts_available(conn):
+        pytest.skip('SQLite 未编译 FTS5 trigram')
+    return conn
+
+
+def _ids(rows):
+    return [row[0] for row in rows]
+
+
+def test_trigram_search_matches_substrings_in_every_column(players):
+    # 游戏 ID 完全相同（忽略大小写）的排在最前
+    assert _ids(search_players(players, 'steve'))[0] == 'Steve'
+    assert set(_ids(search_players(players, 'steve'))) == {'Steve', 'SteveJobs', 'Alex'}
+    assert _ids(search_players(players, '0003')) == ['Alex']
+    assert _ids(search_players(players, 'robr')) == ['Herobrine']
+    # 关键词中的双引号不会破坏 MATCH 语法
+    assert search_players(players, 'a"b"c') == []
+
+
+def test_search_limit_offset_and_columns(players):
+    rows = search_players(players, 'example.com', limit=2, offset=1, columns=('game_id',))
+    assert len(rows) == 2
+    assert all(len(row) == 1 for row in rows)
+    assert search_players(players, 'example.com', columns=('game_id',))[1:3] == rows
+
+
+def test_short_keywords_fall_back_to_like(players):
+    assert set(_ids(search_players(players, 'he'))) == {'Herobrine'}
+    assert _ids(search_players(players, 'al')) == ['Alex']
+    assert len(search_players(players, '')) == 4
+
+
+def test_index_follows_inserts_updates_and_deletes(players):
+    players.execute("UPDATE players SET email = 'creeper@example.org' WHERE game_id = 'Herobrine'")
+    players.execute("UPDATE players SET game_id = 'Notch' WHERE game_id = 'Alex'")
+    players.execute("DELETE FROM players WHERE game_id = 'SteveJobs'")
+    players.execute("INSERT INTO players (game_id, qq, email) VALUES ('Creeper', '40005', 'c@example.com')")
+
+    assert set(_ids(search_players(players, 'creeper'))) == {'Herobrine', 'Creeper'}
+    assert _ids(search_players(players, 'hb@example')) == []
+    assert _ids(search_players(players, 'notch')) == ['Notch']
+    assert set(_ids(search_players(players, 'steve'))) == {'Steve', 'Notch'}
+    # VACUUM 不改变全文索引的关联键
+    players.commit()
+    players.execute('VACUUM')
+    assert _ids(search_players(players, 'creeper'))[0] == 'Creeper'
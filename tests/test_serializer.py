@@ -0,0 +1,80 @@
+import json
+import sqlite3
+
+import pytest
+
+import serializer
+from pagination import PageArgs, decode_cursor, paginate
+from serializer import dumps, json_rows_response, parse_fields, projector
+
+COLUMNS = ('game_id', 'qq', 'join_date')
+
+
+@pytest.fixture(params=['json', 'orjson'])
+def backend(request, monkeypatch):
+    if request.param == 'orjson' and serializer.orjson is None:
+        pytest.skip('未安装 orjson')
+    monkeypatch.setattr(serializer, 'JSON_BACKEND', request.param)
+    return request.param
+
+
+def test_backends_produce_the_same_bytes(backend):
+    obj = [{"game_id": "史蒂夫", "qq": None, "ok": True, "n": 3, "nested": {"a": [1, 2]}}]
+    assert dumps(obj) == json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def test_json_rows_response(backend):
+    response = json_rows_response([('Steve', '1', None), ('Alex', '2', '2023-01-01')], COLUMNS, status=201)
+    assert response.status_code == 201
+    assert response.mimetype == 'application/json'
+    assert json.loads(response.get_data()) == [
+        {"game_id": "Steve", "qq": "1", "join_date": None},
+        {"game_id": "Alex", "qq": "2", "join_date": "2023-01-01"},
+    ]
+
+
+def test_parse_fields():
+    assert parse_fields({}, COLUMNS) == COLUMNS
+    # 保持请求中的顺序并去重
+    assert parse_fields({'fields': 'qq, game_id,qq'}, COLUMNS) == ('qq', 'game_id')
+    for value in ('password', ',', 'qq,password'):
+        with pytest.raises(ValueError):
+            parse_fields({'fields': value}, COLUMNS)
+
+
+def test_projector():
+    assert projector(None) is None
+    project = projector(('qq', 'game_id'))
+    assert list(project({'game_id': 'Steve', 'qq': '1', 'join_date': None}).items()) == [
+        ('qq', '1'), ('game_id', 'Steve')]
+
+
+@pytest.fixture
+def players_db(tmp_path):
+    path = str(tmp_path / 'player.db')
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE players (game_id TEXT PRIMARY KEY, qq TEXT, join_date TEXT)')
+        conn.executemany('INSERT INTO players VALUES (?, ?, ?)',
+                         [(f'p{i}', str(i), f'2023-01-0{i + 1}') for i in range(5)])
+    return path
+
+
+def _row_to_dict(row):
+    return dict(zip(COLUMNS, row))
+
+
+def test_fields_do_not_affect_the_cursor(players_db, backend):
+    # 只输出 qq，游标仍由排序列 join_date 和主键生成
+    page = PageArgs(2, None, 'join_date', 'asc', None)
+    body = json.loads(paginate(players_db, 'SELECT game_id, qq, join_date FROM players', [], [], page,
+                               'game_id', _row_to_dict, fields=('qq',)).get_data())
+    assert body['items'] == [{'qq': '0'}, {'qq': '1'}]
+    assert decode_cursor(body['next_after']) == ['2023-01-02', 'p1']
+
+
+def test_streamed_rows_are_projected(players_db, backend):
+    page = PageArgs(None, None, 'game_id', 'asc', 'ndjson')
+    response = paginate(players_db, 'SELECT game_id, qq, join_date FROM players', [], [], page,
+                        'game_id', _row_to_dict, fields=('game_id',))
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == [{'game_id': f'p{i}'} for i in range(5)]
@@ -0,0 +1,69 @@
+import pytest
+
+from conftest import wait_for
+from migrations import migrate, SETTINGS_MIGRATIONS
+from server_registry import FleetStatusPoller, sync_default_server, validate_server
+
+
+def _servers(conn):
+    return conn.execute('SELECT name, address, mcsm_api_address, mcsm_daemon_id, mcsm_instance_id, mcsm_apikey '
+                        'FROM servers ORDER BY id').fetchall()
+
+
+def test_default_server_follows_settings(db_copies, connect):
+    conn = connect(db_copies / 'settings.db')
+    migrate(conn, SETTINGS_MIGRATIONS)
+    conn.execute("DELETE FROM servers")
+    conn.execute("INSERT INTO servers (name, address) VALUES ('lobby', 'lobby.example:25565')")
+
+    # 设置中没有服务器时不新建 default 行
+    sync_default_server(conn, '', '', '', '', '')
+    assert [row[0] for row in _servers(conn)] == ['lobby']
+
+    sync_default_server(conn, ' mc.example:25566 ', 'http://mcsm.example/', 'd1', 'i1', 'key')
+    sync_default_server(conn, 'mc.example:25577', 'http://mcsm.example/', 'd1', 'i2', None)
+    assert _servers(conn) == [('lobby', 'lobby.example:25565', '', '', '', ''),
+                              ('default', 'mc.example:25577', 'http://mcsm.example', 'd1', 'i2', '')]
+
+
+def test_validate_server_rejects_empty_name():
+    with pytest.raises(ValueError):
+        validate_server({'name': ' '})
+    assert validate_server({'name': 'a', 'enabled': False}) == {'name': 'a', 'enabled': 0}
+
+
+def _wait_for_poll(poller, polls):
+    wait_for(lambda: poller.polls + poller.failures >= polls)
+
+
+def test_fleet_status_when_servers_table_is_missing(tmp_path, connect):
+    # 空的 settings.db：没有 servers 表，轮询失败
+    connect(tmp_path / 'settings.db').close()
+    poller = FleetStatusPoller(str(tmp_path / 'settings.db'), str(tmp_path / 'player.db'), interval=60)
+    poller.get()
+    _wait_for_poll(poller, 1)
+
+    status = poller.get()
+    assert status['servers'] == []
+    assert status['stale'] is True
+    assert 'servers' in status['error']
+
+
+def test_fleet_status_keeps_last_snapshot_after_a_failure(db_copies, connect):
+    conn = connect(db_copies / 'settings.db')
+    migrate(conn, SETTINGS_MIGRATIONS)
+    conn.execute("UPDATE servers SET address = '', mcsm_api_address = ''")
+    conn.commit()
+    poller = FleetStatusPoller(str(db_copies / 'settings.db'), str(db_copies / 'player.db'), interval=60)
+    poller.get()
+    _wait_for_poll(poller, 1)
+    assert poller.get()['totals']['servers'] == 1
+
+    conn.execute('DROP TABLE servers')
+    conn.commit()
+    poller.refresh()
+    _wait_for_poll(poller, 2)
+    status = poller.get()
+    assert status['totals']['servers'] == 1
+    assert status['error'] is not None
+    assert status['stale'] is False
@@ -0,0 +1,106 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+import server_status
+from conftest import fake_settings_cache
+from migrations import migrate, PLAYERS_MIGRATIONS
+from server_status import ServerStatusPoller, StatusError, query_status
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_query_parses_status_response(slp_fake_factory):
+    fake = slp_fake_factory(['Steve', 'Alex'], online=5, motd='Eden')
+    status = asyncio.run(query_status('127.0.0.1', fake.port))
+    assert status['online'] is True
+    assert status['version'] == '1.20.4'
+    assert status['protocol'] == 765
+    # 聊天组件的 extra 拼接为纯文本
+    assert status['motd'] == 'Eden server'
+    assert (status['players_online'], status['players_max']) == (5, 100)
+    assert status['sample'] == ['Steve', 'Alex']
+    assert fake.pings == 1
+
+
+def test_query_times_out(slp_fake_factory):
+    fake = slp_fake_factory([], latency=2)
+    start = time.monotonic()
+    with pytest.raises(StatusError, match='超时'):
+        asyncio.run(query_status('127.0.0.1', fake.port, timeout=0.2))
+    assert time.monotonic() - start < 1
+
+
+def test_query_connection_refused():
+    with pytest.raises(StatusError, match='连接失败'):
+        asyncio.run(query_status('127.0.0.1', _free_port(), timeout=1))
+
+
+def test_flatten_text_and_invalid_varint():
+    assert server_status._flatten_text([{'text': 'a', 'extra': ['b', {'text': 'c'}]}, 'd']) == 'abcd'
+    with pytest.raises(StatusError):
+        server_status._parse_varint(b'\xff\xff\xff\xff\xff\xff', 0)
+
+
+@pytest.fixture
+def poller_factory(tmp_path, connect):
+    conn = connect(tmp_path / 'player.db')
+    migrate(conn, PLAYERS_MIGRATIONS)
+    conn.execute("INSERT INTO players (game_id, permission_group) VALUES ('Steve', 'Engineer')")
+    conn.commit()
+
+    def create(host, port, **kwargs):
+        settings_cache = fake_settings_cache(minecraft_server_host=host, minecraft_server_port=port)
+        poller = ServerStatusPoller(settings_cache, str(tmp_path / 'player.db'), **kwargs)
+        # 测试中直接调用 poll_once，不启动后台轮询线程
+        poller._thread = object()
+        return poller
+
+    return create
+
+
+def test_poller_matches_registered_players(slp_fake_factory, poller_factory):
+    fake = slp_fake_factory(['Steve', 'Herobrine'], online=2)
+    poller = poller_factory('127.0.0.1', fake.port)
+    asyncio.run(poller.poll_once())
+
+    snapshot = poller.get()
+    assert snapshot['online'] is True
+    assert snapshot['online_players'] == [{'game_id': 'Steve', 'permission_group': 'Engineer'}]
+    assert snapshot['unknown_players'] == ['Herobrine']
+    assert snapshot['error'] is None
+    assert snapshot['stale'] is False
+
+
+def test_offline_snapshot_keeps_last_success_and_becomes_stale(slp_fake_factory, poller_factory):
+    fake = slp_fake_factory(['Steve'])
+    poller = poller_factory('127.0.0.1', fake.port, ttl=0.3, timeout=0.3)
+    asyncio.run(poller.poll_once())
+    updated_at = poller.get()['updated_at']
+
+    fake.close()
+    asyncio.run(poller.poll_once())
+    snapshot = poller.get()
+    assert snapshot['online'] is False
+    assert snapshot['error']
+    assert snapshot['updated_at'] == updated_at
+    assert snapshot['stale'] is False
+
+    time.sleep(0.35)
+    assert poller.get()['stale'] is True
+    assert poller.stats()['failures'] == 1
+
+
+def test_missing_address_and_no_snapshot(poller_factory):
+    poller = poller_factory('', 25565)
+    assert poller.get() == {"online": None, "error": None, "checked_at": None, "updated_at": None, "stale": True}
+    asyncio.run(poller.poll_once())
+    snapshot = poller.get()
+    assert snapshot['online'] is None
+    assert snapshot['stale'] is True
@@ -0,0 +1,67 @@
+import pytest
+
+from migrations import migrate, SETTINGS_MIGRATIONS
+from settings_cache import SETTINGS_FIELDS, SettingsCache, parse_server_address
+
+
+def _save(conn, **values):
+    row = {field: '' for field in SETTINGS_FIELDS}
+    row.update(values)
+    conn.execute('DELETE FROM settings')
+    conn.execute(f'INSERT INTO settings ({", ".join(row)}) VALUES ({", ".join("?" * len(row))})',
+                 tuple(row.values()))
+    conn.commit()
+
+
+def test_cache_reloads_only_after_another_connection_commits(tmp_path, connect):
+    path = str(tmp_path / 'settings.db')
+    conn = connect(path)
+    cache = SettingsCache(path)
+    # settings 表尚未创建
+    assert cache.get() is None
+
+    migrate(conn, SETTINGS_MIGRATIONS)
+    _save(conn, minecraftServerIP='mc.example.com:25566', emailServicePort='465',
+          mcsmApiAddress='http://mcsm.example.com/')
+    settings = cache.get()
+    assert (settings.minecraft_server_host, settings.minecraft_server_port) == ('mc.example.com', 25566)
+    assert settings.email_service_port == 465
+    assert settings.mcsm_api_address == 'http://mcsm.example.com'
+    assert settings.to_dict()['minecraftServerIP'] == 'mc.example.com:25566'
+
+    for _ in range(3):
+        assert cache.get() is settings
+    misses = cache.stats()['misses']
+    assert cache.stats()['hits'] == 3
+
+    _save(conn, minecraftServerIP='play.example.com')
+    assert cache.get().minecraft_server_ip == 'play.example.com'
+    assert cache.stats()['misses'] == misses + 1
+
+
+def test_invalidate_forces_a_reload(tmp_path, connect):
+    path = str(tmp_path / 'settings.db')
+    conn = connect(path)
+    migrate(conn, SETTINGS_MIGRATIONS)
+    _save(conn, minecraftServerIP='mc.example.com')
+    cache = SettingsCache(path)
+    first = cache.get()
+    assert cache.get() is first
+
+    cache.invalidate()
+    second = cache.get()
+    assert second is not first
+    assert second.minecraft_server_ip == 'mc.example.com'
+    assert cache.stats()['misses'] == 2
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('', (None, None)),
+    ('mc.example.com', ('mc.example.com', 25565)),
+    (' mc.example.com:25566 ', ('mc.example.com', 25566)),
+    ('mc.example.com:99999', ('mc.example.com', 25565)),
+    ('[::1]:25570', ('::1', 25570)),
+    ('[::1]', ('::1', 25565)),
+])
+def test_parse_server_address(value, expected):
+    assert parse_server_address(value, 25565) == expected
@@ -0,0 +1,67 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tokens import TokenError, TokenSigner
+
+
+def test_tampered_expired_and_wrong_type_tokens_are_rejected():
+    signer = TokenSigner('secret', access_ttl=0)
+    token = TokenSigner('secret').issue_access(1, 'admin')
+    body, signature = token.split('.')
+    for bad in (f'{body}.x{signature[1:]}', 'no-dot', None, TokenSigner('other').issue_access(1, 'admin')):
+        with pytest.raises(TokenError):
+            signer.verify(bad)
+    with pytest.raises(TokenError, match='wrong token type'):
+        signer.verify(token, 'refresh')
+    with pytest.raises(TokenError, match='expired'):
+        signer.verify(signer.issue_access(1, 'admin'))
+    assert signer.verify(token)['sub'] == 1
+    assert signer.stats()['rejected'] == 6
+
+
+def test_counters_are_exact_under_concurrency():
+    signer = TokenSigner('secret')
+
+    def work(i):
+        signer.verify(signer.issue_access(i, 'user'))
+        with pytest.raises(TokenError):
+            signer.verify('x.y')
+
+    with ThreadPoolExecutor(16) as pool:
+        list(pool.map(work, range(2000)))
+    stats = signer.stats()
+    assert (stats['issued'], stats['verified'], stats['rejected']) == (2000, 2000, 2000)
+
+
+def test_revocation_is_local_without_a_database():
+    first, second = TokenSigner('secret'), TokenSigner('secret')
+    token = first.issue_access(1, 'user')
+    first.revoke_user(1)
+    with pytest.raises(TokenError, match='revoked'):
+        first.verify(token)
+    # 另一个进程在令牌过期前仍然接受
+    assert second.verify(token)['sub'] == 1
+
+
+def test_revocation_is_shared_through_the_database(tmp_path):
+    path = str(tmp_path / 'revocations.db')
+    first = TokenSigner('secret', revocation_path=path)
+    second = TokenSigner('secret', revocation_path=path)
+    tokens = [first.issue_access(user_id, 'user') for user_id in (1, 2, 3)]
+    assert second.verify(tokens[0])['sub'] == 1
+
+    first.revoke_users([1, 2])
+    for token in tokens[:2]:
+        with pytest.raises(TokenError, match='revoked'):
+            second.verify(token)
+    assert second.verify(tokens[2])['sub'] == 3
+    assert second.stats()['revoked_users'] == 2
+
+    # 吊销之后重新登录签发的令牌有效
+    time.sleep(0.002)
+    assert second.verify(first.issue_access(1, 'user'))['sub'] == 1
+    # 新的进程启动时读取已有的吊销记录
+    with pytest.raises(TokenError, match='revoked'):
+        TokenSigner('secret', revocation_path=path).verify(tokens[1])
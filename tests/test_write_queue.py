@@ -0,0 +1,94 @@
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import write_queue
+from conftest import wait_for
+from write_queue import GroupCommitWriter, WriteQueueFullError, write
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'player.db')
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE players (game_id TEXT PRIMARY KEY, qq TEXT)')
+    return path
+
+
+def _count(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute('SELECT COUNT(*) FROM players').fetchone()[0]
+
+
+def _insert(game_id):
+    return lambda conn: conn.execute('INSERT INTO players (game_id) VALUES (?)', (game_id,)).rowcount
+
+
+def test_concurrent_writes_share_transactions(path):
+    writer = GroupCommitWriter(path, batch_delay_ms=5)
+    with ThreadPoolExecutor(32) as pool:
+        results = list(pool.map(lambda i: writer.submit(_insert(f'p{i}')), range(200)))
+
+    assert results == [1] * 200
+    assert _count(path) == 200
+    stats = writer.stats()
+    assert stats['committed'] == 200
+    assert stats['batches'] < 200
+    assert stats['largest_batch'] > 1
+
+
+def test_failed_write_is_rolled_back_alone(path):
+    writer = GroupCommitWriter(path, batch_delay_ms=50)
+    with ThreadPoolExecutor(3) as pool:
+        futures = [pool.submit(writer.submit, _insert(game_id)) for game_id in ('Steve', 'Steve', 'Alex')]
+    outcomes = sorted(type(future.exception()).__name__ if future.exception() else 'ok' for future in futures)
+
+    assert outcomes == ['IntegrityError', 'ok', 'ok']
+    assert _count(path) == 2
+    assert writer.stats()['failed'] == 1
+
+
+def test_full_queue_rejects_writes(path):
+    writer = GroupCommitWriter(path, queue_size=1, queue_timeout=0.05)
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocking(conn):
+        started.set()
+        release.wait(5)
+
+    threads = [threading.Thread(target=writer.submit, args=(blocking,))]
+    threads[0].start()
+    started.wait(5)
+    # 写线程被占用，第二个修改占满队列
+    threads.append(threading.Thread(target=writer.submit, args=(_insert('Steve'),)))
+    threads[1].start()
+    wait_for(lambda: writer.stats()['queued'] == 1)
+
+    with pytest.raises(WriteQueueFullError):
+        writer.submit(_insert('Alex'))
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert writer.stats()['rejected'] == 1
+    assert _count(path) == 1
+
+
+def test_write_without_coalescing_commits_directly(path, monkeypatch):
+    monkeypatch.setattr(write_queue, 'WRITE_COALESCING', False)
+    assert write(path, _insert('Steve')) == 1
+    with pytest.raises(sqlite3.IntegrityError):
+        write(path, _insert('Steve'))
+    assert _count(path) == 1
+    assert write_queue.writer_stats()['enabled'] is False
+
+
+def test_write_with_coalescing_uses_one_writer_per_database(path, monkeypatch):
+    monkeypatch.setattr(write_queue, 'WRITE_COALESCING', True)
+    monkeypatch.setattr(write_queue, '_writers', {})
+    assert write(path, _insert('Steve')) == 1
+    assert write(path, _insert('Alex')) == 1
+    assert write_queue.get_writer(path) is write_queue.get_writer(path)
+    assert [stats['committed'] for stats in write_queue.writer_stats()['writers']] == [2]
@@ -0,0 +1,222 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask import g, jsonify, request
+
+# 无状态访问令牌：payload 和 HMAC-SHA256 签名都在令牌里，验证只需要一次 HMAC 计算，不查询数据库。
+# 启用 AUTH_REQUIRED 时必须设置 TOKEN_SECRET（未设置时启动失败），所有进程用同一个密钥签发和验证。
+TOKEN_SECRET = os.environ.get('TOKEN_SECRET', '')
+# 访问令牌有效期（秒），封禁后最多在这段时间内仍被其他进程接受
+ACCESS_TOKEN_TTL = int(os.environ.get('ACCESS_TOKEN_TTL', '900'))
+# 刷新令牌有效期（秒），刷新时会重新检查数据库中的封禁状态
+REFRESH_TOKEN_TTL = int(os.environ.get('REFRESH_TOKEN_TTL', str(7 * 24 * 3600)))
+# 吊销记录（封禁、删除账号、刷新时发现账号已封禁）默认只保存在本进程内存中，其他 worker 仍接受已吊销的
+# 访问令牌直到过期（最多 ACCESS_TOKEN_TTL 秒）。设置 TOKEN_REVOCATION_DB 后吊销记录保存在该 SQLite 文件中，
+# 所有进程共享：验证时用 PRAGMA data_version 判断其他进程是否写入过，只有变化时才重新读取
+TOKEN_REVOCATION_DB = os.environ.get('TOKEN_REVOCATION_DB', '')
+# 设置 AUTH_REQUIRED=1 时，除公开接口外所有请求都需要 Authorization: Bearer <access_token>
+AUTH_REQUIRED = os.environ.get('AUTH_REQUIRED', '0') == '1'
+
+ROLES = ('user', 'admin')
+
+
+class TokenError(Exception):
+    pass
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+class TokenSigner:
+    def __init__(self, secret=None, access_ttl=ACCESS_TOKEN_TTL, refresh_ttl=REFRESH_TOKEN_TTL,
+                 revocation_path=TOKEN_REVOCATION_DB):
+        if not secret:
+            secret = secrets.token_bytes(32)
+        self._key = secret.encode('utf-8') if isinstance(secret, str) else secret
+        self.access_ttl = access_ttl
+        self.refresh_ttl = refresh_ttl
+        # 被吊销的用户：user_id -> 吊销时间（毫秒），在此之前签发的令牌全部失效
+        self._revoked = {}
+        self._lock = threading.Lock()
+        self.revocation_path = revocation_path
+        self._conn = None
+        self._pid = None
+        self._revocation_version = None
+        self.issued = 0
+        self.verified = 0
+        self.rejected = 0
+
+    def _sign(self, body):
+        return _b64encode(hmac.new(self._key, body.encode('ascii'), hashlib.sha256).digest())
+
+    def _issue(self, user_id, role, token_type, ttl):
+        now = _now_ms()
+        payload = {"sub": user_id, "role": role, "typ": token_type, "iat": now, "exp": now + ttl * 1000}
+        body = _b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+        with self._lock:
+            self.issued += 1
+        return f'{body}.{self._sign(body)}'
+
+    def issue_access(self, user_id, role):
+        return self._issue(user_id, role, 'access', self.access_ttl)
+
+    def issue_refresh(self, user_id, role):
+        return self._issue(user_id, role, 'refresh', self.refresh_ttl)
+
+    # 登录成功后返回给客户端的令牌
+    def issue_pair(self, user_id, role):
+        return {
+            "access_token": self.issue_access(user_id, role),
+            "refresh_token": self.issue_refresh(user_id, role),
+            "token_type": "Bearer",
+            "expires_in": self.access_ttl,
+        }
+
+    def _reject(self, message):
+        with self._lock:
+            self.rejected += 1
+        raise TokenError(message)
+
+    # 验证签名、类型、有效期和吊销状态，返回 payload
+    def verify(self, token, token_type='access'):
+        try:
+            body, signature = token.split('.', 1)
+            valid = hmac.compare_digest(signature, self._sign(body))
+            payload = json.loads(_b64decode(body)) if valid else None
+        except (AttributeError, ValueError, UnicodeError):
+            self._reject('malformed token')
+        if not valid:
+            self._reject('invalid signature')
+
+        if payload.get('typ') != token_type:
+            self._reject('wrong token type')
+        now = _now_ms()
+        if payload.get('exp', 0) <= now:
+            self._reject('token expired')
+        with self._lock:
+            self._sync_revocations()
+            revoked_at = self._revoked.get(payload.get('sub'))
+            if revoked_at is None or payload.get('iat', 0) > revoked_at:
+                self.verified += 1
+                return payload
+        self._reject('token revoked')
+
+    # 调用方持有 self._lock。吊销记录库用一个专用连接，fork 之后的子进程重新打开
+    def _revocation_connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.revocation_path, timeout=5, check_same_thread=False)
+            self._pid = os.getpid()
+            self._revocation_version = None
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS token_revocations (
+                    user_id INTEGER PRIMARY KEY,
+                    revoked_at INTEGER NOT NULL
+                )
+            ''')
+            self._conn.commit()
+        return self._conn
+
+    # 调用方持有 self._lock。其他进程写入过吊销记录时重新读取
+    def _sync_revocations(self):
+        if not self.revocation_path:
+            return
+        conn = self._revocation_connection()
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if version != self._revocation_version:
+            self._revoked = dict(conn.execute('SELECT user_id, revoked_at FROM token_revocations'))
+            self._revocation_version = version
+
+    # 吊销用户当前所有令牌（封禁、删除时调用），之后重新登录签发的令牌不受影响
+    def revoke_user(self, user_id):
+        self.revoke_users([user_id])
+
+    def revoke_users(self, user_ids):
+        now = _now_ms()
+        # 超过刷新令牌有效期的记录已无意义，顺便清理
+        cutoff = now - self.refresh_ttl * 1000
+        with self._lock:
+            if self.revocation_path:
+                self._sync_revocations()
+                conn = self._revocation_connection()
+                try:
+                    conn.executemany('INSERT OR REPLACE INTO token_revocations (user_id, revoked_at) VALUES (?, ?)',
+                                     ((user_id, now) for user_id in user_ids))
+                    conn.execute('DELETE FROM token_revocations WHERE revoked_at <= ?', (cutoff,))
+                    conn.commit()
+                except sqlite3.Error:
+                    conn.rollback()
+                    raise
+            for user_id in user_ids:
+                self._revoked[user_id] = now
+            if len(self._revoked) > 1024:
+                self._revoked = {uid: at for uid, at in self._revoked.items() if at > cutoff}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "issued": self.issued,
+                "verified": self.verified,
+                "rejected": self.rejected,
+                "revoked_users": len(self._revoked),
+                "shared_revocations": bool(self.revocation_path),
+            }
+
+
+signer = TokenSigner(TOKEN_SECRET)
+
+
+def bearer_token():
+    header = request.headers.get('Authorization', '')
+    if header[:7].lower() == 'bearer ':
+        return header[7:].strip()
+    return None
+
+
+# 请求前检查访问令牌：GET 需要任意有效令牌，修改数据的请求和 admin_endpoints 中的接口需要 admin 角色。
+# 验证通过的 payload 保存在 g.token 中
+def _check_request(public_endpoints, admin_endpoints, messages):
+    if request.method == 'OPTIONS' or request.endpoint in public_endpoints:
+        return None
+    token = bearer_token()
+    if token is None:
+        return jsonify({"message": messages['missing']}), 401
+    try:
+        g.token = signer.verify(token)
+    except TokenError:
+        return jsonify({"message": messages['invalid']}), 401
+    if ((request.method not in ('GET', 'HEAD') or request.endpoint in admin_endpoints)
+            and g.token.get('role') != 'admin'):
+        return jsonify({"message": messages['forbidden']}), 403
+    return None
+
+
+# 在 app 上启用令牌校验；未启用时不注册任何钩子。
+# admin_endpoints 为只有管理员可以读取的接口（设置、账号列表、运行状态等）
+def init_auth(app, public_endpoints, messages, enabled=None, admin_endpoints=()):
+    if enabled is None:
+        enabled = AUTH_REQUIRED
+    if not enabled:
+        return False
+    if not TOKEN_SECRET:
+        # 随机密钥只在本进程有效，多个 worker 或重启后令牌互不认可
+        raise RuntimeError('AUTH_REQUIRED=1 requires TOKEN_SECRET to be set')
+    public_endpoints = frozenset(public_endpoints) | {'static'}
+    admin_endpoints = frozenset(admin_endpoints)
+    app.before_request(lambda: _check_request(public_endpoints, admin_endpoints, messages))
+    return True
@@ -0,0 +1,186 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from db import get_db
+
+# 合并写入（group commit）：设置 WRITE_COALESCING=1 后，每个数据库由一个写线程执行所有经 write() 提交的修改，
+# 把排队的修改放在同一个事务中提交，避免并发请求各自提交、互相等待写锁。
+# 每个修改在自己的 SAVEPOINT 中执行，失败时只回滚该修改，调用方仍然得到各自的结果或异常；
+# 事务提交成功后才返回结果。未启用时 write() 直接借一个连接执行并提交，行为与原来相同。
+WRITE_COALESCING = os.environ.get('WRITE_COALESCING', '0') == '1'
+# 一个事务包含上一次提交期间排队的所有修改（最多 WRITE_BATCH_SIZE 个）。
+# WRITE_BATCH_DELAY_MS > 0 时收到第一个修改后再等待这么久以凑更大的批次，只在每次提交都很慢（synchronous=FULL）时有用
+WRITE_BATCH_DELAY_MS = float(os.environ.get('WRITE_BATCH_DELAY_MS', '0'))
+WRITE_BATCH_SIZE = int(os.environ.get('WRITE_BATCH_SIZE', '128'))
+# 队列上限；队列已满时调用方最多等待 WRITE_QUEUE_TIMEOUT 秒，之后抛出 WriteQueueFullError
+WRITE_QUEUE_SIZE = int(os.environ.get('WRITE_QUEUE_SIZE', '1024'))
+WRITE_QUEUE_TIMEOUT = float(os.environ.get('WRITE_QUEUE_TIMEOUT', '1'))
+
+
+class WriteQueueFullError(Exception):
+    pass
+
+
+class GroupCommitWriter:
+    def __init__(self, path, batch_size=WRITE_BATCH_SIZE, batch_delay_ms=WRITE_BATCH_DELAY_MS,
+                 queue_size=WRITE_QUEUE_SIZE, queue_timeout=WRITE_QUEUE_TIMEOUT):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay_ms / 1000
+        self.queue_timeout = queue_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        # 统计
+        self.submitted = 0
+        self.rejected = 0
+        self.batches = 0
+        self.committed = 0
+        self.failed = 0
+        self.largest_batch = 0
+        self.commit_seconds = 0.0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=f'writer:{self.path}', daemon=True)
+                    self._thread.start()
+
+    # 提交一个修改 fn(conn)，阻塞到所在事务提交后返回 fn 的返回值；fn 抛出的异常原样抛给调用方
+    # fn 中不能调用 commit / rollback
+    def submit(self, fn):
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put((fn, future), timeout=self.queue_timeout)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise WriteQueueFullError(f'{self.path}: 写入队列已满')
+        with self._lock:
+            self.submitted += 1
+        return future.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._commit(batch)
+            except BaseException as e:
+                # 事务整体失败（开始或提交时出错），这一批的调用方都收到该异常
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                with self._lock:
+                    self.failed += len(batch)
+
+    def _commit(self, batch):
+        results = []
+        start = time.perf_counter()
+        with get_db(self.path) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for fn, _ in batch:
+                    conn.execute('SAVEPOINT write_op')
+                    try:
+                        results.append((True, fn(conn)))
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO write_op')
+                        results.append((False, e))
+                    conn.execute('RELEASE write_op')
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        failed = 0
+        for (fn, future), (ok, value) in zip(batch, results):
+            if ok:
+                future.set_result(value)
+            else:
+                failed += 1
+                future.set_exception(value)
+        with self._lock:
+            self.batches += 1
+            self.committed += len(batch) - failed
+            self.failed += failed
+            self.largest_batch = max(self.largest_batch, len(batch))
+            self.commit_seconds += time.perf_counter() - start
+
+    def stats(self):
+        with self._lock:
+            return {
+                "path": self.path,
+                "queued": self._queue.qsize(),
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "batches": self.batches,
+                "committed": self.committed,
+                "failed": self.failed,
+                "largest_batch": self.largest_batch,
+                "avg_batch": round((self.committed + self.failed) / self.batches, 2) if self.batches else 0,
+                "commit_ms_total": round(self.commit_seconds * 1000, 3),
+            }
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+# 写线程不会被 fork 复制，子进程用到时重新创建
+def _reset_after_fork():
+    global _writers, _writers_lock
+    _writers = {}
+    _writers_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_writer(path):
+    writer = _writers.get(path)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(path)
+            if writer is None:
+                writer = GroupCommitWriter(path)
+                _writers[path] = writer
+    return writer
+
+
+# 路由中使用：rowcount = write(PLAYERS_DATABASE, lambda conn: conn.execute(...).rowcount)
+def write(path, fn):
+    if WRITE_COALESCING:
+        return get_writer(path).submit(fn)
+    with get_db(path) as conn:
+        try:
+            result = fn(conn)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return result
+
+
+def writer_stats():
+    with _writers_lock:
+        writers = list(_writers.values())
+    return {"enabled": WRITE_COALESCING, "writers": [writer.stats() for writer in writers]}